@@ -0,0 +1,260 @@
+"""Run time and peak memory of the ECCC station converters, on synthetic data at several scales.
+
+The pipeline of :py:mod:`miranda.eccc._raw` is run from start to end on the flat files written by
+``eccc_synthetic.py``: ``convert_hourly_flat_files``, ``convert_daily_flat_files``, ``merge_converted_variables``
+and ``aggregate_stations``. Every step runs in a fresh process, so that its peak resident memory is measured on
+its own. With psutil installed, the peak memory of the step along with the worker processes it starts is sampled
+as well. Everything runs offline.
+
+Results can be saved to a JSON file, and compared to a previous run to catch regressions: the comparison fails
+(exit code 1) when a step got slower or larger than allowed by the tolerance.
+
+Usage: python benchmarks/eccc_conversion.py [--scales small medium] [--processes 1] [--save results.json]
+    [--compare previous.json] [--tolerance 0.25]
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from eccc_synthetic import station_codes, write_flat_files, write_inventory
+
+try:
+    import psutil
+
+    has_psutil = True
+except ImportError:
+    psutil = None
+    has_psutil = False
+
+SCALES = dict(
+    small=dict(stations=5, years=1),
+    medium=dict(stations=25, years=2),
+    large=dict(stations=100, years=4),
+)
+
+HOURLY_VARIABLES = [76, 78, 80]
+DAILY_VARIABLES = [1, 2, 12]
+
+
+def _peak_rss() -> float:
+    """Peak resident memory of the process, in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux, but in bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+class _TreeMemory(threading.Thread):
+    """Sample the resident memory of the process and of all its child processes, keeping the peak of their sum."""
+
+    def __init__(self, interval: float = 0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        process = psutil.Process()
+        while not self._done.is_set():
+            total = 0
+            for p in [process] + process.children(recursive=True):
+                try:
+                    total += p.memory_info().rss
+                except psutil.Error:
+                    pass
+            self.peak = max(self.peak, total)
+            self._done.wait(self.interval)
+
+    def stop(self) -> float:
+        """Stop sampling, returning the peak in MiB."""
+        self._done.set()
+        self.join()
+        return self.peak / 2**20
+
+
+def _measure(name: str, args: tuple, kwargs: dict, connection) -> None:
+    """Run a function of `miranda.eccc`, then send its run time and the peak memory of the processes back."""
+    try:
+        import miranda.eccc
+
+        func = getattr(miranda.eccc, name)
+        sampler = _TreeMemory() if has_psutil else None
+        if sampler is not None:
+            sampler.start()
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        connection.send(
+            dict(
+                seconds=elapsed,
+                peak_mib=_peak_rss(),
+                total_peak_mib=sampler.stop() if sampler is not None else None,
+            )
+        )
+    except Exception as e:  # noqa
+        connection.send(dict(error=f"{type(e).__name__}: {e}"))
+    finally:
+        connection.close()
+
+
+def run_step(name: str, *args, **kwargs) -> Dict[str, float]:
+    """Run a function of `miranda.eccc` in a new process, returning its run time and peak memory."""
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_measure, args=(name, args, kwargs, sender))
+    process.start()
+    sender.close()
+    result = receiver.recv()
+    process.join()
+    if "error" in result:
+        raise RuntimeError(f"{name} failed: {result['error']}")
+    return result
+
+
+def pipeline(
+    folder: Path, stations: int, years: int, processes: int, missing: float
+) -> List[Tuple[str, Dict[str, float]]]:
+    """Generate the source files of a scale, then run and measure every step of the conversion."""
+    source = folder.joinpath("source")
+    write_flat_files(
+        source, "hourly", stations, years, HOURLY_VARIABLES, missing=missing
+    )
+    write_flat_files(source, "daily", stations, years, DAILY_VARIABLES, missing=missing)
+    inventory = write_inventory(
+        folder.joinpath("inventory.csv"), station_codes(stations)
+    )
+    source_mib = sum(f.stat().st_size for f in source.iterdir()) / 2**20
+
+    converted, merged, aggregated = [
+        folder.joinpath(step) for step in ["converted", "merged", "aggregated"]
+    ]
+    steps = [
+        (
+            "convert_hourly_flat_files",
+            (source, converted.joinpath("hourly")),
+            dict(variables=HOURLY_VARIABLES, processes=processes),
+        ),
+        (
+            "convert_daily_flat_files",
+            (source, converted.joinpath("daily")),
+            dict(variables=DAILY_VARIABLES, processes=processes),
+        ),
+    ]
+    for time_step in ["hourly", "daily"]:
+        steps.append(
+            (
+                "merge_converted_variables",
+                (converted.joinpath(time_step), merged.joinpath(time_step)),
+                dict(processes=processes),
+            )
+        )
+    for time_step, variables in [
+        ("hourly", HOURLY_VARIABLES),
+        ("daily", DAILY_VARIABLES),
+    ]:
+        steps.append(
+            (
+                "aggregate_stations",
+                (
+                    merged.joinpath(time_step),
+                    aggregated.joinpath(time_step),
+                    inventory,
+                    time_step[0],
+                    variables,
+                ),
+                dict(processes=processes),
+            )
+        )
+
+    results = list()
+    for name, args, kwargs in steps:
+        label = f"{name} ({args[0].name})"
+        result = run_step(name, *args, **kwargs)
+        result["source_mib"] = source_mib
+        results.append((label, result))
+        total = result["total_peak_mib"]
+        print(
+            f"{label:<40} {result['seconds']:>9.2f} {result['peak_mib']:>10.0f} "
+            f"{'n/a' if total is None else f'{total:.0f}':>14}",
+            flush=True,
+        )
+    return results
+
+
+def compare(
+    results: Dict[str, Dict[str, Dict[str, float]]],
+    previous: Dict[str, Dict[str, Dict[str, float]]],
+    tolerance: float,
+) -> List[str]:
+    """Steps slower or larger than in a previous run, beyond the tolerance (relative)."""
+    regressions = list()
+    for scale, steps in results.items():
+        for step, result in steps.items():
+            before = previous.get(scale, dict()).get(step)
+            if before is None:
+                continue
+            for key in ["seconds", "peak_mib", "total_peak_mib"]:
+                if result.get(key) is None or before.get(key) is None:
+                    continue
+                if result[key] > before[key] * (1 + tolerance):
+                    regressions.append(
+                        f"{scale}, {step}: {key} went from {before[key]:.2f} to {result[key]:.2f}."
+                    )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scales", nargs="+", choices=list(SCALES), default=["small", "medium"]
+    )
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--missing", type=float, default=0.1)
+    parser.add_argument(
+        "--workdir",
+        type=Path,
+        help="Keep the generated and converted files in this folder. Default: A temporary folder.",
+    )
+    parser.add_argument("--save", type=Path, help="Save the results as JSON.")
+    parser.add_argument(
+        "--compare", type=Path, help="Compare to the results of a previous run."
+    )
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    all_results = dict()
+    with tempfile.TemporaryDirectory(prefix="eccc_benchmark") as tmp:
+        workdir = args.workdir or Path(tmp)
+        for scale in args.scales:
+            print(
+                f"\n{scale}: {SCALES[scale]['stations']} stations, {SCALES[scale]['years']} year(s), "
+                f"{args.processes} process(es)"
+            )
+            print(
+                f"{'step':<40} {'time (s)':>9} {'peak (MiB)':>10} {'+ workers (MiB)':>14}"
+            )
+            all_results[scale] = dict(
+                pipeline(
+                    workdir.joinpath(scale),
+                    processes=args.processes,
+                    missing=args.missing,
+                    **SCALES[scale],
+                )
+            )
+
+    if args.save:
+        args.save.write_text(json.dumps(all_results, indent=2))
+    if args.compare:
+        regressions = compare(
+            all_results, json.loads(args.compare.read_text()), args.tolerance
+        )
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
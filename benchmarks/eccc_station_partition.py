@@ -0,0 +1,78 @@
+"""Scaling of the station/element partitioning of decoded ECCC flat file records.
+
+Compares the former approach (one boolean mask per station, then per element) with
+:py:func:`miranda.eccc._flat_files.partition_records` for an increasing number of stations per file.
+
+Usage: python benchmarks/eccc_station_partition.py [--records-per-station 2000] [--elements 10]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from miranda.eccc._flat_files import FlatFileRecords, partition_records
+
+
+def synthetic_records(
+    stations: int, elements: int, records_per_station: int, seed: int = 0
+) -> FlatFileRecords:
+    rng = np.random.default_rng(seed)
+    n = stations * records_per_station
+    station = np.repeat(
+        np.array([f"{7000000 + s:07d}" for s in range(stations)]), records_per_station
+    )
+    element = rng.integers(1, elements + 1, size=n).astype(np.int16)
+    return FlatFileRecords(
+        station=station,
+        year=np.full(n, 2000, dtype=np.int16),
+        month=np.ones(n, dtype=np.int8),
+        day=np.ones(n, dtype=np.int8),
+        element=element,
+        values=np.zeros((n, 24), dtype=np.int32),
+        flags=np.zeros((n, 24), dtype=np.uint8),
+    )
+
+
+def boolean_masks(records: FlatFileRecords) -> int:
+    groups = 0
+    for code in np.unique(records.station):
+        in_station = records.station == code
+        for element in np.unique(records.element[in_station]):
+            selection = in_station & (records.element == element)
+            groups += bool(selection.any())
+    return groups
+
+
+def partitioned(records: FlatFileRecords) -> int:
+    return sum(len(elements) for elements in partition_records(records).values())
+
+
+def _timeit(func, records, repeat: int = 3) -> float:
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(records)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records-per-station", type=int, default=2000)
+    parser.add_argument("--elements", type=int, default=10)
+    parser.add_argument(
+        "--stations", type=int, nargs="+", default=[10, 50, 100, 250, 500, 1000]
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'stations':>10} {'records':>10} {'masks (s)':>12} {'partition (s)':>14} {'speedup':>8}"
+    )
+    for n_stations in args.stations:
+        recs = synthetic_records(n_stations, args.elements, args.records_per_station)
+        assert boolean_masks(recs) == partitioned(recs)
+        t_masks = _timeit(boolean_masks, recs)
+        t_partition = _timeit(partitioned, recs)
+        print(
+            f"{n_stations:>10} {recs.year.size:>10} {t_masks:>12.4f} {t_partition:>14.4f} {t_masks / t_partition:>8.1f}"
+        )
@@ -0,0 +1,403 @@
+"""Synthetic ECCC station data, written in the formats read by :py:mod:`miranda.eccc`.
+
+Writes hourly (HLY) and daily (DLY) flat files, AHCCD homogenized station files and daily summary CSV files,
+for any number of stations, years and variables, with a given ratio of missing values. Values follow a seasonal
+cycle (temperatures), are sparse (precipitation) or are uniformly distributed (other elements), with a few
+estimated ("E") values. The data is only meant to exercise the converters at scale, offline.
+
+Usage: python benchmarks/eccc_synthetic.py OUTPUT [--stations 10] [--years 1] [--missing 0.1]
+"""
+import argparse
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# Element codes generated as temperatures and as precipitation; other elements are uniformly distributed
+_TEMPERATURE_ELEMENTS = {1, 2, 3, 74, 78, 79}
+_PRECIPITATION_ELEMENTS = {10, 11, 12, 123}
+
+_FLAT_FILE_STEPS = dict(hourly=24, daily=31)
+_FLAT_FILE_MISSING = -9999
+
+_AHCCD_CODES = dict(tasmax="dx", tasmin="dn", tas="dm", pr="dt", prsn="ds", prlp="dr")
+
+_SUMMARY_FIELDS = [
+    "Max Temp (°C)",
+    "Min Temp (°C)",
+    "Mean Temp (°C)",
+    "Heat Deg Days (°C)",
+    "Cool Deg Days (°C)",
+    "Total Rain (mm)",
+    "Total Snow (cm)",
+    "Total Precip (mm)",
+    "Snow on Grnd (cm)",
+    "Dir of Max Gust (10s deg)",
+    "Spd of Max Gust (km/h)",
+]
+
+
+def station_codes(stations: int) -> List[str]:
+    """Climate identifiers of synthetic stations, some of them alphanumeric like many ECCC stations."""
+    return [
+        f"70{s:05d}" if s % 2 == 0 else f"70{s // 100:02d}A{s % 100:02d}"
+        for s in range(stations)
+    ]
+
+
+def write_inventory(path: Path, codes: Sequence[str]) -> Path:
+    """Write an ECCC station inventory of the given stations."""
+    lines = [
+        '"Modified Date","2022-01-01 00:00 UTC"',
+        '"Disclaimer","Synthetic stations"',
+        '"Notes","Synthetic stations"',
+        '"Name","Province","Climate ID","Station ID","WMO ID","TC ID",'
+        '"Latitude (Decimal Degrees)","Longitude (Decimal Degrees)","Latitude","Longitude",'
+        '"Elevation (m)","First Year","Last Year"',
+    ]
+    for s, code in enumerate(codes):
+        lat, lon = 43 + (s % 170) * 0.1, -80 + (s // 170) * 0.1
+        lines.append(
+            f'"STATION {s}","QUEBEC","{code}","{s + 1}","","",'
+            f'"{lat:.2f}","{lon:.2f}","{int(lat * 1e7)}","{int(lon * 1e7)}",'
+            f'"{s % 500}","1900","2022"'
+        )
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_text("\n".join(lines) + "\n")
+    return Path(path)
+
+
+def _values(
+    element: int, day_of_year: np.ndarray, shape: tuple, rng: np.random.Generator
+) -> np.ndarray:
+    """Integer values (in the tenths used by ECCC) of an element, along days of the year on the first axis."""
+    season = -np.cos(2 * np.pi * day_of_year / 365.25).reshape(
+        (-1,) + (1,) * (len(shape) - 1)
+    )
+    if element in _TEMPERATURE_ELEMENTS:
+        values = 50 + 150 * season + rng.normal(0, 40, shape)
+    elif element in _PRECIPITATION_ELEMENTS:
+        values = rng.gamma(0.8, 40, shape) * (rng.random(shape) < 0.3)
+    else:
+        values = rng.uniform(0, 1000, shape)
+    return np.rint(values).astype(np.int32)
+
+
+def _flags(shape: tuple, missing: float, rng: np.random.Generator) -> np.ndarray:
+    """ASCII flag codes: "M" for missing values (with the given ratio), a few "E" and blanks otherwise."""
+    draws = rng.random(shape)
+    flags = np.full(shape, ord(" "), dtype=np.uint8)
+    flags[draws < missing + 0.02] = ord("E")
+    flags[draws < missing] = ord("M")
+    return flags
+
+
+def _ascii_integers(values: np.ndarray, width: int) -> np.ndarray:
+    """Zero-padded ASCII integers (with a leading minus sign when negative) along a new last axis."""
+    magnitude = np.abs(values.astype(np.int64))
+    powers = 10 ** np.arange(width - 1, -1, -1)
+    digits = (magnitude[..., np.newaxis] // powers % 10 + ord("0")).astype(np.uint8)
+    digits[..., 0] = np.where(values < 0, ord("-"), digits[..., 0])
+    return digits
+
+
+def _flat_file_records(
+    codes: Sequence[str],
+    year: int,
+    time_step: str,
+    variables: Sequence[int],
+    missing: float,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """Lines of a flat file as a (records, line length + 1) uint8 array, ordered by station, date and element."""
+    steps = _FLAT_FILE_STEPS[time_step]
+    if time_step == "hourly":
+        dates = pd.date_range(f"{year}-01-01", f"{year}-12-31", freq="D")
+        day_of_year = dates.dayofyear.values
+    else:
+        dates = pd.date_range(f"{year}-01-01", f"{year}-12-01", freq="MS")
+        day_of_year = dates.dayofyear.values + 15
+
+    # Records of a station: (dates, elements), then all stations one after another
+    n_dates, n_elements = dates.size, len(variables)
+    per_station = n_dates * n_elements
+    n = len(codes) * per_station
+
+    values = np.empty((len(codes), n_dates, n_elements, steps), dtype=np.int32)
+    for e, element in enumerate(variables):
+        values[:, :, e] = np.moveaxis(
+            _values(element, day_of_year, (n_dates, len(codes), steps), rng),
+            1,
+            0,
+        )
+    values = values.reshape(n, steps)
+    flags = _flags((n, steps), missing, rng)
+    if time_step == "daily":
+        # Days beyond the end of the month are always missing
+        beyond = np.arange(1, 32) > dates.days_in_month.values[:, np.newaxis]
+        flags.reshape(len(codes), n_dates, n_elements, steps)[
+            :, beyond[:, np.newaxis, :].repeat(n_elements, axis=1)
+        ] = ord("M")
+    values[flags == ord("M")] = _FLAT_FILE_MISSING
+
+    station = np.repeat(
+        np.array([f"{c:>7}" for c in codes], dtype="S7").view(np.uint8).reshape(-1, 7),
+        per_station,
+        axis=0,
+    )
+    header = [
+        station,
+        np.broadcast_to(_ascii_integers(np.array(year), 4), (n, 4)),
+        np.tile(
+            np.repeat(_ascii_integers(dates.month.values, 2), n_elements, 0),
+            (len(codes), 1),
+        ),
+    ]
+    if time_step == "hourly":
+        header.append(
+            np.tile(
+                np.repeat(_ascii_integers(dates.day.values, 2), n_elements, 0),
+                (len(codes), 1),
+            )
+        )
+    header.append(
+        np.tile(_ascii_integers(np.array(variables), 3), (len(codes) * n_dates, 1))
+    )
+
+    fields = np.concatenate(
+        [_ascii_integers(values, 6), flags[..., np.newaxis]], axis=-1
+    ).reshape(n, steps * 7)
+    newline = np.full((n, 1), ord("\n"), dtype=np.uint8)
+    return np.concatenate(header + [fields, newline], axis=1)
+
+
+def write_flat_files(
+    folder: Path,
+    time_step: str,
+    stations: int = 10,
+    years: int = 1,
+    variables: Optional[Sequence[int]] = None,
+    missing: float = 0.1,
+    start_year: int = 2000,
+    seed: int = 0,
+) -> List[Path]:
+    """Write one hourly (HLY) or daily (DLY) flat file per year, with the records of all stations and variables.
+
+    Parameters
+    ----------
+    folder : Path
+    time_step : {"hourly", "daily"}
+    stations : int
+    years : int
+      Number of years, starting with `start_year`.
+    variables : Sequence[int], optional
+      Element codes. Default: 76, 78 and 80 (hourly) or 1, 2 and 12 (daily).
+    missing : float
+      Ratio of missing values.
+    start_year : int
+    seed : int
+
+    Returns
+    -------
+    List[Path]
+    """
+    if variables is None:
+        variables = [76, 78, 80] if time_step == "hourly" else [1, 2, 12]
+    rng = np.random.default_rng(seed)
+    codes = station_codes(stations)
+    prefix = "HLY" if time_step == "hourly" else "DLY"
+
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    files = list()
+    for year in range(start_year, start_year + years):
+        path = folder.joinpath(f"{prefix}01_{year}.txt")
+        path.write_bytes(
+            _flat_file_records(
+                codes, year, time_step, variables, missing, rng
+            ).tobytes()
+        )
+        files.append(path)
+    return files
+
+
+def ahccd_station_ids(variable: str, stations: int) -> List[str]:
+    """Identifiers of AHCCD stations found in the metadata bundled with miranda."""
+    data = Path(__file__).parents[1].joinpath("miranda", "eccc", "data")
+    if variable.startswith("tas"):
+        metadata = pd.read_csv(data.joinpath("ahccd_gen3_temperature.csv"), header=2)
+        ids = metadata["StnId"]
+    else:
+        metadata = pd.read_csv(data.joinpath("ahccd_gen2_precipitation.csv"), header=3)
+        ids = metadata["stnid"]
+    ids = ids.astype(str).str.replace(" ", "").drop_duplicates().tolist()
+    if stations > len(ids):
+        raise ValueError(f"Only {len(ids)} AHCCD stations are known for {variable}.")
+    return ids[:stations]
+
+
+def write_ahccd_files(
+    folder: Path,
+    variable: str = "tasmax",
+    stations: int = 10,
+    years: int = 1,
+    missing: float = 0.1,
+    start_year: int = 2000,
+    seed: int = 0,
+) -> List[Path]:
+    """Write the fixed-width AHCCD file of every station: one line per month, with the values and flags of 31 days.
+
+    Temperatures follow the third generation layout, precipitation the second generation one.
+    """
+    rng = np.random.default_rng(seed)
+    code = _AHCCD_CODES[variable]
+    temperature = variable.startswith("tas")
+    width, decimals, nan = (7, 1, -9999.9) if temperature else (8, 2, -9999.99)
+
+    months = pd.date_range(
+        f"{start_year}-01-01", f"{start_year + years - 1}-12-01", freq="MS"
+    )
+    days = np.arange(1, 32)
+    beyond = days > months.days_in_month.values[:, np.newaxis]
+
+    if temperature:
+        header = ["Temperature (synthetic)", "Température (synthétique)", "Station"]
+        layout = "Year  Mo " + "".join(f"{f'D{d:02d}':>{width}} " for d in days)
+    else:
+        header = []
+        layout = "Year Mo " + "".join(f"{f'D{d:02d}':>{width}} " for d in days)
+
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    files = list()
+    for stnid in ahccd_station_ids(variable, stations):
+        element = 1 if temperature else 12
+        values = (
+            _values(element, months.dayofyear.values + 15, (months.size, 31), rng) / 10
+        )
+        flags = _flags((months.size, 31), missing, rng)
+        flags[beyond] = ord("M")
+        values[flags == ord("M")] = nan
+
+        lines = list(header) + [layout]
+        for month, row, row_flags in zip(months, values, flags.view("S1")):
+            fields = "".join(
+                f"{v:>{width}.{decimals}f}{f.decode()}" for v, f in zip(row, row_flags)
+            )
+            if temperature:
+                lines.append(f"{month.year:>5} {month.month:>2} {fields}")
+            else:
+                lines.append(f"{month.year:>4} {month.month:>2} {fields}")
+
+        path = folder.joinpath(f"{code}{stnid}.txt")
+        path.write_text("\n".join(lines) + "\n")
+        files.append(path)
+    return files
+
+
+def write_daily_summaries(
+    folder: Path,
+    stations: int = 10,
+    years: int = 1,
+    missing: float = 0.1,
+    start_year: int = 2000,
+    seed: int = 0,
+) -> List[Path]:
+    """Write the daily summary CSV files of every station, one file per year in a folder per station."""
+    rng = np.random.default_rng(seed)
+    codes = station_codes(stations)
+
+    columns = ["Date/Time", "Year", "Month", "Day", "Data Quality"]
+    for field in _SUMMARY_FIELDS:
+        columns.extend([field, f"{field.split(' (')[0]} Flag"])
+
+    files = list()
+    for s, code in enumerate(codes):
+        station_folder = Path(folder).joinpath(code)
+        station_folder.mkdir(parents=True, exist_ok=True)
+        for year in range(start_year, start_year + years):
+            dates = pd.date_range(f"{year}-01-01", f"{year}-12-31", freq="D")
+            data = pd.DataFrame(
+                {
+                    "Date/Time": dates.strftime("%Y-%m-%d"),
+                    "Year": dates.year,
+                    "Month": dates.month,
+                    "Day": dates.day,
+                    "Data Quality": "",
+                }
+            )
+            day_of_year = dates.dayofyear.values
+            tasmax = _values(1, day_of_year, (dates.size,), rng) / 10 + 5
+            tasmin = tasmax - rng.uniform(2, 15, dates.size)
+            tas = (tasmax + tasmin) / 2
+            rain = _values(10, day_of_year, (dates.size,), rng) / 10
+            snow = np.where(tas < 0, rain, 0)
+            rain = np.where(tas < 0, 0, rain)
+            fields = [
+                tasmax,
+                tasmin,
+                tas,
+                np.maximum(18 - tas, 0),
+                np.maximum(tas - 18, 0),
+                rain,
+                snow,
+                rain + snow,
+                np.rint(rng.uniform(0, 50, dates.size)),
+                np.rint(rng.uniform(0, 36, dates.size)),
+                np.rint(rng.uniform(31, 100, dates.size)),
+            ]
+            for field, values in zip(_SUMMARY_FIELDS, fields):
+                flags = _flags((dates.size,), missing, rng)
+                data[field] = np.where(flags == ord("M"), np.nan, np.round(values, 1))
+                data[f"{field.split(' (')[0]} Flag"] = np.where(
+                    flags == ord(" "), "", flags.view("S1").astype(str)
+                )
+
+            lat, lon = 43 + (s % 170) * 0.1, -80 + (s // 170) * 0.1
+            header = [
+                f'"Station Name","STATION {s}"',
+                '"Province","QUEBEC"',
+                f'"Latitude","{lat:.2f}"',
+                f'"Longitude","{lon:.2f}"',
+                f'"Elevation","{s % 500}.0"',
+                f'"Climate Identifier","{code}"',
+                '"WMO Identifier",""',
+                '"TC Identifier",""',
+                "",
+                '"Legend"',
+                '"E","Estimated"',
+                '"M","Missing"',
+                "",
+            ]
+            path = station_folder.joinpath(f"{code}_{year}_P1D.csv")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n".join(header) + "\n")
+                data[columns].to_csv(f, index=False, quoting=1)
+            files.append(path)
+    return files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--stations", type=int, default=10)
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--start-year", type=int, default=2000)
+    parser.add_argument("--missing", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    common = dict(
+        stations=args.stations,
+        years=args.years,
+        missing=args.missing,
+        start_year=args.start_year,
+        seed=args.seed,
+    )
+    write_inventory(args.output.joinpath("inventory.csv"), station_codes(args.stations))
+    write_flat_files(args.output.joinpath("flat"), "hourly", **common)
+    write_flat_files(args.output.joinpath("flat"), "daily", **common)
+    for var in ["tasmax", "pr"]:
+        write_ahccd_files(args.output.joinpath("ahccd", var), var, **common)
+    write_daily_summaries(args.output.joinpath("summaries"), **common)
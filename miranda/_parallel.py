@@ -0,0 +1,26 @@
+import itertools
+import multiprocessing
+import multiprocessing.pool
+from typing import Callable, List, Optional
+
+__all__ = ["batch_pool", "run_batches"]
+
+
+def batch_pool(processes: int) -> Optional[multiprocessing.pool.Pool]:
+    """Pool of worker processes for file batches, or None to process them one after another.
+
+    Workers are spawned rather than forked, as forking after HDF5 files were opened can deadlock the workers.
+    """
+    if processes > 1:
+        return multiprocessing.get_context("spawn").Pool(processes=processes)
+
+
+def run_batches(
+    func: Callable,
+    combinations: List[tuple],
+    pool: Optional[multiprocessing.pool.Pool] = None,
+) -> list:
+    """Run batches one after another, or concurrently in a pool of worker processes."""
+    if pool is not None and len(combinations) > 1:
+        return pool.starmap(func, combinations)
+    return list(itertools.starmap(func, combinations))
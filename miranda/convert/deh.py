@@ -1,18 +1,21 @@
+import io
 import json
 import logging.config
 import re
 from pathlib import Path
-from typing import Optional, Tuple, Union
+from typing import Optional, Sequence, Tuple, Union
 
+import numpy as np
 import pandas as pd
 import xarray as xr
 
+from miranda._parallel import batch_pool, run_batches
 from miranda.scripting import LOGGING_CONFIG
-from miranda.units import u
+from miranda.units import convert_units
 
 logging.config.dictConfig(LOGGING_CONFIG)
 
-__all__ = ["open_txt"]
+__all__ = ["open_txt", "open_txt_files"]
 
 # CMOR-like attributes
 cmor = json.load(open(Path(__file__).parent / "data" / "deh_cf_attrs.json"))[  # noqa
@@ -27,15 +30,21 @@ meta_patterns = {
 }
 
 data_header_pattern = "Station Date Débit (m³/s) Remarque\n"
+# The same header, as found in the files before collapsing their spaces
+data_header_regex = re.compile(
+    " +".join(re.escape(w) for w in data_header_pattern.split()) + " *\n"
+)
 
 
 def extract_daily(path) -> Tuple[dict, pd.DataFrame]:
-    """Extract data and metadata from DEH (MELCC) stream flow file."""
+    """Extract data and metadata from DEH (MELCC) stream flow file, reading it once."""
 
     with open(path, encoding="latin1") as fh:
         txt = fh.read()
-        txt = re.sub(" +", " ", txt)
-        meta, data = txt.split(data_header_pattern)
+    header = data_header_regex.search(txt)
+    if header is None:
+        raise ValueError(f"No data header found in {path}.")
+    meta = re.sub(" +", " ", txt[: header.start()])
 
     m = dict()
     for key in meta_patterns:
@@ -45,23 +54,19 @@ def extract_daily(path) -> Tuple[dict, pd.DataFrame]:
         )
 
     d = pd.read_csv(
-        path,
+        io.StringIO(txt[header.end() :]),
         delimiter=r"\s+",
-        skiprows=len(meta.splitlines()),
-        encoding="latin1",
-        converters={0: lambda x: str(x)},  # noqa
-        index_col=1,
-        parse_dates=True,
-        infer_datetime_format=True,
+        header=None,
+        names=["Station", "time", "Débit", "Remarque"],
+        dtype={"Station": str, "Remarque": object},
     )
-    if len(d["Station"].unique()) == 1:
-        m["station"] = d["Station"].unique()[0]
+    stations = d["Station"].unique()
+    if len(stations) == 1:
+        m["station"] = stations[0]
         d = d.drop("Station", axis=1)
     else:
         raise ValueError("Multiple stations detected in the same file.")
-    d = d.rename(columns={"Remarque": "Nan", "(m³/s)": "Remarque"})
-    d.index.names = ["time"]
-    d = d.drop("Nan", axis=1)
+    d = d.set_index(pd.to_datetime(d["time"], format="%Y/%m/%d")).drop("time", axis=1)
 
     return m, d
 
@@ -77,7 +82,7 @@ def to_cf(meta: dict, data: pd.DataFrame, cf_table: Optional[dict] = {}) -> xr.D
     ds["station_id"] = xr.DataArray(meta["station"])
 
     ds["area"] = xr.DataArray(
-        u.convert(float(meta["bv"].split(" ")[0]), meta["bv"].split(" ")[1], "km²"),
+        convert_units(float(meta["bv"].split(" ")[0]), meta["bv"].split(" ")[1], "km²"),
         attrs={"long_name": "drainage area", "units": "km2"},
     )
 
@@ -122,3 +127,66 @@ def open_txt(path: Union[str, Path], cf_table: Optional[dict] = cmor) -> xr.Data
     """Extract daily HQ meteorological data and convert to xr.DataArray with CF-Convention attributes."""
     meta, data = extract_daily(path)
     return to_cf(meta, data, cf_table)
+
+
+def open_txt_files(
+    paths: Sequence[Union[str, Path]],
+    cf_table: Optional[dict] = cmor,
+    processes: int = 1,
+) -> xr.Dataset:
+    """Extract the daily stream flow of many DEH (MELCC) stations into a single dataset with CF-Convention attributes.
+
+    Parameters
+    ----------
+    paths : Sequence[Union[str, Path]]
+      DEH stream flow files, one per station.
+    cf_table : dict, optional
+      Attributes of the variables.
+    processes : int
+      Number of files parsed concurrently.
+
+    Returns
+    -------
+    xr.Dataset
+      (station, time) stream flow and flags over the union of the time steps of the files, along with the name,
+      identifier, drainage area and coordinates of every station. Time steps without a flag hold an empty string.
+    """
+    paths = [Path(p) for p in paths]
+    if not paths:
+        raise FileNotFoundError("No DEH files given.")
+
+    combinations = [(p, cf_table) for p in paths]
+    pool = batch_pool(processes)
+    try:
+        stations = run_batches(open_txt, combinations, pool)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    station_ids = [ds.station_id.item() for ds in stations]
+    if len(set(station_ids)) < len(station_ids):
+        duplicates = sorted({s for s in station_ids if station_ids.count(s) > 1})
+        raise ValueError(f"Stations found in several files: {', '.join(duplicates)}.")
+
+    time = np.unique(np.concatenate([ds.time.values for ds in stations]))
+    q = np.full((len(stations), time.size), np.nan)
+    flag = np.full((len(stations), time.size), "", dtype=object)
+    for row, ds in enumerate(stations):
+        columns = np.searchsorted(time, ds.time.values)
+        q[row, columns] = ds.q.values
+        flags = ds.flag.values
+        present = pd.notna(flags)
+        flag[row, columns[present]] = flags[present]
+
+    first = stations[0]
+    out = xr.Dataset(coords=dict(time=time), attrs=first.attrs)
+    out["q"] = (("station", "time"), q, first.q.attrs)
+    out["flag"] = (("station", "time"), flag.astype(str), first.flag.attrs)
+    for v in ["name", "station_id", "area", "lat", "lon"]:
+        out[v] = (
+            "station",
+            np.array([ds[v].item() for ds in stations]),
+            first[v].attrs,
+        )
+    return out
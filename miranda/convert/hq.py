@@ -1,34 +1,37 @@
 import csv
 import datetime as dt
+import io
 import json
 import logging.config
 import re
 from pathlib import Path
-from typing import Any, Optional, Tuple, Union
+from typing import Any, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import pandas as pd
 import xarray as xr
 
+from miranda._parallel import batch_pool, run_batches
 from miranda.scripting import LOGGING_CONFIG
-from miranda.units import u, units2pint
+from miranda.units import convert_units
 
 logging.config.dictConfig(LOGGING_CONFIG)
 
-__all__ = ["open_csv"]
+__all__ = ["open_csv", "open_csv_files"]
 
 # CMOR-like attributes
 cmor = json.load(open(Path(__file__).parent / "data" / "hq_cf_attrs.json"))[
     "variable_entry"
 ]
 
-fp = r"[-+]?\d*,\d+|\d+"
+fp = r"[-+]?(?:\d*,\d+|\d+)"
 
 section_patterns = r"(\w+) :\n"
 
 meta_patterns = {
     "Installation": {
         "nom": "Nom;(.*)",
+        "identificateur": "Identificateur;(.*)",
         "type": "Type;(.*)",
         "ouverture": "Ouverture;(.+)",
         "fermeture": "Fermeture;(.+)",
@@ -105,15 +108,23 @@ cf_frequency = {
     "Instantanée du pas horaire": "1h",
     "Fin du pas horaire": "1h",
 }
-cf_attrs_names = {"x": "lon", "y": "lat", "z": "elevation", "nom": "site"}
+cf_attrs_names = {
+    "x": "lon",
+    "y": "lat",
+    "z": "elevation",
+    "nom": "site",
+    "identificateur": "station_id",
+}
 
 
 def extract_daily(path) -> Tuple[dict, pd.DataFrame]:
-    """Extract data and metadata from HQ meteo file."""
+    """Extract data and metadata from HQ meteo file, reading it once."""
 
     with open(path, encoding="latin1") as fh:
         txt = fh.read()
-        meta, data = re.split(data_header_pattern, txt, maxsplit=2)
+    meta, header, data = txt.partition(data_header_pattern)
+    if not header:
+        raise ValueError(f"No data header found in {path}.")
 
     sections = iter(re.split(section_patterns, meta)[1:])
 
@@ -133,15 +144,12 @@ def extract_daily(path) -> Tuple[dict, pd.DataFrame]:
             )
 
     d = pd.read_csv(
-        path,
+        io.StringIO(header + data),
         delimiter=";",
-        skiprows=len(meta.splitlines()),
-        encoding="latin1",
         index_col=0,
-        parse_dates=True,
-        infer_datetime_format=True,
         decimal=",",
     )
+    d.index = pd.to_datetime(d.index, format="%Y-%m-%d %H:%M")
 
     return m, d
 
@@ -161,7 +169,7 @@ def to_cf(
 
     # Get default variable attributes
     name, table_name = guess_variable(m, cf_table)
-    attrs = cf_table.get(table_name)
+    attrs = dict(cf_table.get(table_name))
 
     # Add custom HQ attributes
     for key, val in cf_attrs_names.items():
@@ -172,9 +180,12 @@ def to_cf(
 
     # Convert units
     if attrs["units"] != m["unité"]:
-        x = u.convert(x, m["unité"], units2pint(attrs["units"]))
+        x = convert_units(x, m["unité"], attrs["units"])
 
-    coords = {k: attrs.pop(k, np.nan) for k in ["lon", "lat", "elevation", "site"]}
+    coords = {
+        k: attrs.pop(k, np.nan)
+        for k in ["lon", "lat", "elevation", "site", "station_id"]
+    }
     coords["time"] = data.index.values
     cf_corrected = xr.DataArray(
         data=x, dims="time", coords=coords, name=name, attrs=attrs
@@ -186,3 +197,132 @@ def open_csv(path: Union[str, Path], cf_table: Optional[dict] = cmor) -> xr.Data
     """Extract daily HQ meteo data and convert to xr.DataArray with CF-Convention attributes."""
     meta, data = extract_daily(path)
     return to_cf(meta, data, cf_table)
+
+
+def _leading_codes(values: pd.Series) -> np.ndarray:
+    """Integer codes of labels such as "1-Valide", decoding every distinct label once.
+
+    Absent labels, and labels without a leading code, give -1.
+    """
+    codes, labels = pd.factorize(values)
+    table = np.full(len(labels) + 1, -1, dtype=np.int16)
+    for i, label in enumerate(labels):
+        match = re.match(r"\s*(\d+)", str(label))
+        if match:
+            table[i] = int(match.groups()[0])
+        else:
+            logging.warning(f"No code found in label `{label}`. Skipping...")
+    return table[codes]
+
+
+def _station_key(da: xr.DataArray) -> str:
+    """Identifier of the station of a HQ meteo file, or its site name if the file has no identifier."""
+    station_id = da.station_id.item()
+    if pd.isnull(station_id):
+        return da.site.item()
+    return str(station_id)
+
+
+def _read_station(
+    path: Union[str, Path], cf_table: dict
+) -> Tuple[xr.DataArray, np.ndarray, np.ndarray]:
+    """Values of a HQ meteo file as a CF DataArray, along with its quality and status codes."""
+    meta, data = extract_daily(path)
+    da = to_cf(meta, data, cf_table)
+    return da, _leading_codes(data["Qualite"]), _leading_codes(data["Statut"])
+
+
+def open_csv_files(
+    paths: Sequence[Union[str, Path]],
+    cf_table: Optional[dict] = cmor,
+    processes: int = 1,
+) -> xr.Dataset:
+    """Extract the HQ meteo data of many stations into a single dataset with CF-Convention attributes.
+
+    Parameters
+    ----------
+    paths : Sequence[Union[str, Path]]
+      HQ meteo files, one per station and variable.
+    cf_table : dict, optional
+      Attributes of the variables.
+    processes : int
+      Number of files parsed concurrently.
+
+    Returns
+    -------
+    xr.Dataset
+      (station, time) arrays of every variable found, with their quality and status codes (-1 where a station has
+      no value), over the union of the time steps of the files. Stations are identified by their identifier (their
+      site name in files without one), along with their site name and coordinates.
+    """
+    paths = [Path(p) for p in paths]
+    if not paths:
+        raise FileNotFoundError("No HQ files given.")
+
+    combinations = [(p, cf_table) for p in paths]
+    pool = batch_pool(processes)
+    try:
+        stations = run_batches(_read_station, combinations, pool)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    frequencies = {da.attrs.get("frequency") for da, _, _ in stations}
+    if len(frequencies) > 1:
+        raise ValueError(f"Files of several time steps found: {sorted(frequencies)}.")
+
+    # Stations and time steps of all files
+    keys = list(dict.fromkeys(_station_key(da) for da, _, _ in stations))
+    station_index = {key: i for i, key in enumerate(keys)}
+    time = np.unique(np.concatenate([da.time.values for da, _, _ in stations]))
+
+    sites = [""] * len(keys)
+    coords = {k: np.full(len(keys), np.nan) for k in ["lon", "lat", "elevation"]}
+    variables = dict()
+    for (da, quality, status), path in zip(stations, paths):
+        row = station_index[_station_key(da)]
+        sites[row] = da.site.item()
+        for k in coords:
+            coords[k][row] = da[k].item()
+
+        if da.name not in variables:
+            variables[da.name] = (
+                np.full((len(keys), time.size), np.nan),
+                np.full((len(keys), time.size), -1, dtype=np.int16),
+                np.full((len(keys), time.size), -1, dtype=np.int16),
+                da.attrs,
+                np.zeros(len(keys), dtype=bool),
+            )
+        values, qualities, statuses, _, found = variables[da.name]
+        if found[row]:
+            raise ValueError(f"Station {keys[row]} found twice for {da.name}: {path}.")
+        found[row] = True
+
+        columns = np.searchsorted(time, da.time.values)
+        values[row, columns] = da.values
+        qualities[row, columns] = quality
+        statuses[row, columns] = status
+
+    ds = xr.Dataset(
+        coords=dict(
+            time=time,
+            station_id=("station", np.array(keys, dtype=str)),
+            site=("station", np.array(sites, dtype=str)),
+            **{k: ("station", v) for k, v in coords.items()},
+        )
+    )
+    for name, (values, qualities, statuses, attrs, _) in variables.items():
+        ds[name] = (("station", "time"), values, attrs)
+        long_name = attrs.get("long_name", name)
+        ds[f"{name}_quality"] = (
+            ("station", "time"),
+            qualities,
+            dict(long_name=f"{long_name} quality code"),
+        )
+        ds[f"{name}_status"] = (
+            ("station", "time"),
+            statuses,
+            dict(long_name=f"{long_name} status code"),
+        )
+    return ds
@@ -1,2 +1,3 @@
+from ._cache import *
 from ._decoder import *
 from ._time import *
@@ -0,0 +1,214 @@
+import datetime
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import stat
+from logging import config
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from miranda.scripting import LOGGING_CONFIG
+
+config.dictConfig(LOGGING_CONFIG)
+
+__all__ = ["FacetCache"]
+
+# Number of files looked up or written per query, below the SQLite limit of query parameters
+_BATCH_SIZE = 500
+
+
+def _signature(file: Union[str, os.PathLike]) -> Optional[Tuple[int, int]]:
+    """Size and modification time (ns) of a file, or None if it does not exist.
+
+    The attributes of zarr stores are read from their .zattrs file, whose changes are not seen by the directory.
+    """
+    try:
+        st = os.stat(file)
+        if stat.S_ISDIR(st.st_mode):
+            attrs = os.path.join(file, ".zattrs")
+            if os.path.exists(attrs):
+                st = os.stat(attrs)
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def _encode_value(value: Any) -> Any:
+    """JSON form of the facet values that JSON does not support: time deltas, timestamps and numpy scalars."""
+    if value is pd.NaT:
+        return {"__timedelta__": "NaT"}
+    if isinstance(value, datetime.timedelta):
+        return {"__timedelta__": pd.Timedelta(value).isoformat()}
+    if isinstance(value, datetime.datetime):
+        return {"__timestamp__": pd.Timestamp(value).isoformat()}
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Facet value `{value}` of type {type(value)} cannot be cached.")
+
+
+def _decode_value(obj: dict) -> Any:
+    if "__timedelta__" in obj:
+        return pd.Timedelta(obj["__timedelta__"])
+    if "__timestamp__" in obj:
+        return pd.Timestamp(obj["__timestamp__"])
+    return obj
+
+
+def _batches(iterable: Iterable, size: int = _BATCH_SIZE) -> Iterable[list]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class FacetCache:
+    """On-disk (SQLite) cache of decoded facets, keyed on the path, size and modification time of files.
+
+    Facets are cached per decoder, i.e. per project and decoding method, as JSON text. The facets of a file that
+    changed size or modification time since it was decoded are ignored, then replaced when the file is decoded again.
+
+    Parameters
+    ----------
+    path : Union[str, os.PathLike]
+      SQLite database of the cache, created if needed.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self.path)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS facets ("
+                "path TEXT NOT NULL, decoder TEXT NOT NULL, size INTEGER NOT NULL, mtime INTEGER NOT NULL, "
+                "facets TEXT NOT NULL, PRIMARY KEY (path, decoder))"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM facets").fetchone()[0]
+
+    def close(self) -> None:
+        self._connection.close()
+
+    @staticmethod
+    def _key(file: Union[str, os.PathLike]) -> str:
+        return os.path.abspath(os.fspath(file))
+
+    def lookup(
+        self, files: Iterable[Union[str, os.PathLike]], decoder: str
+    ) -> Tuple[Dict, Dict]:
+        """Facets of the files unchanged since they were cached, and the signatures of the other files.
+
+        Parameters
+        ----------
+        files : Iterable[Union[str, os.PathLike]]
+        decoder : str
+          Decoder the facets were cached for.
+
+        Returns
+        -------
+        dict
+          Cached facets, by file.
+        dict
+          (size, modification time) of the files to decode, by file. None for files that do not exist.
+        """
+        hits, misses = dict(), dict()
+        for batch in _batches(files):
+            keys = {self._key(f): f for f in batch}
+            rows = self._connection.execute(
+                f"SELECT path, size, mtime, facets FROM facets WHERE decoder = ? "
+                f"AND path IN ({','.join('?' * len(keys))})",
+                [decoder, *keys],
+            )
+            cached = {path: (size, mtime, facets) for path, size, mtime, facets in rows}
+            for key, file in keys.items():
+                signature = _signature(file)
+                if key in cached and signature == cached[key][:2]:
+                    try:
+                        hits[file] = json.loads(
+                            cached[key][2], object_hook=_decode_value
+                        )
+                        continue
+                    except ValueError:
+                        # Facets cached in another format are decoded again
+                        pass
+                misses[file] = signature
+        return hits, misses
+
+    def update(
+        self,
+        entries: Iterable[Tuple[Union[str, os.PathLike], Tuple[int, int], dict]],
+        decoder: str,
+    ) -> None:
+        """Cache the facets of files, given with the (size, modification time) they were decoded at.
+
+        Facets with values that cannot be written as JSON are not cached.
+        """
+        rows = list()
+        for f, (size, mtime), facets in entries:
+            try:
+                text = json.dumps(facets, default=_encode_value)
+            except TypeError as e:
+                logging.warning(f"Facets of {f} not cached: {e}")
+                continue
+            rows.append((self._key(f), decoder, size, mtime, text))
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO facets VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+    def invalidate(
+        self,
+        files: Optional[Iterable[Union[str, os.PathLike]]] = None,
+        decoder: Optional[str] = None,
+    ) -> int:
+        """Remove the facets of some files, or of all files, returning the number of entries removed.
+
+        Parameters
+        ----------
+        files : Iterable[Union[str, os.PathLike]], optional
+          Default: All files.
+        decoder : str, optional
+          Only remove the facets of this decoder. Default: Facets of all decoders.
+        """
+        where, params = "", list()
+        if decoder is not None:
+            where, params = " WHERE decoder = ?", [decoder]
+        with self._connection:
+            if files is None:
+                return self._connection.execute(
+                    f"DELETE FROM facets{where}", params
+                ).rowcount
+            removed = 0
+            for batch in _batches(files):
+                keys = [self._key(f) for f in batch]
+                condition = f"path IN ({','.join('?' * len(keys))})"
+                removed += self._connection.execute(
+                    f"DELETE FROM facets{where}{' AND ' if where else ' WHERE '}{condition}",
+                    params + keys,
+                ).rowcount
+            return removed
+
+    def prune(self) -> int:
+        """Remove the facets of files that no longer exist, returning the number of entries removed."""
+        paths = [
+            path
+            for (path,) in self._connection.execute("SELECT DISTINCT path FROM facets")
+        ]
+        deleted = [p for p in paths if not os.path.exists(p)]
+        removed = self.invalidate(deleted) if deleted else 0
+        logging.info(f"Pruned {removed} cached facets of {len(deleted)} deleted files.")
+        return removed
@@ -1,13 +1,15 @@
 import logging
 import multiprocessing as mp
 import os
+import threading
 import warnings
 from functools import partial
 from logging import config
+from multiprocessing.pool import ThreadPool
 from os import PathLike
 from pathlib import Path
 from types import GeneratorType
-from typing import Dict, List, Optional, Union
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
 import netCDF4 as nc  # noqa
 import pandas as pd
@@ -19,6 +21,7 @@ from miranda.cv import INSTITUTIONS, PROJECT_MODELS
 from miranda.scripting import LOGGING_CONFIG
 from miranda.validators import FACETS_SCHEMA
 
+from ._cache import FacetCache
 from ._time import (
     TIME_UNITS_TO_FREQUENCY,
     TIME_UNITS_TO_TIMEDELTA,
@@ -33,6 +36,9 @@ __all__ = [
     "guess_project",
 ]
 
+# The netCDF4 and HDF5 libraries are not thread-safe: netCDF files are opened by one thread at a time
+_NETCDF_LOCK = threading.Lock()
+
 
 def guess_project(file: Union[os.PathLike, str]) -> str:
     file_name = Path(file).stem
@@ -51,46 +57,53 @@ class Decoder:
 
     def __init__(self, project: Optional[str]):
         self.project = project
+        self._file_facets = dict()
 
     @staticmethod
     def _decoder(
-        d: dict,
         m: str,
         fail_early: bool,
         proj: str,
-        lock,
         file: Union[str, Path],
-    ) -> None:
-        """lock is a threading lock object"""
-        with lock:
-            if proj is None:
-                try:
-                    proj = guess_project(file)
-                except DecoderError:
-                    print(
-                        f"Unable to determine 'project': Signature for 'project' must be set manually for file: {file}."
-                    )
-                    if fail_early:
-                        raise
-
-            decode_function_name = f"decode_{proj.lower().replace('-','_')}_{m}"
+    ) -> Tuple[Union[str, Path], Optional[dict]]:
+        """Decode the facets of a file, returning the file along with its facets, or None if they could not be decoded.
+
+        No state is shared between calls, so that files can be decoded concurrently.
+        """
+        if proj is None:
             try:
-                _deciphered = getattr(Decoder, decode_function_name)(Path(file))
-                FACETS_SCHEMA.validate(_deciphered)
+                proj = guess_project(file)
+            except DecoderError:
                 print(
-                    f"Deciphered the following from {Path(file).name}: {_deciphered.items()}"
+                    f"Unable to determine 'project': Signature for 'project' must be set manually for file: {file}."
                 )
-                d[file] = _deciphered
-            except AttributeError as e:
-                print(f"Unable to read data from {Path(file).name}: {e}")
-            except schema.SchemaError as e:
-                print(f"Decoded facets from {Path(file).name} are not valid: {e}")
+                if fail_early:
+                    raise
+                return file, None
+
+        decode_function_name = f"decode_{proj.lower().replace('-','_')}_{m}"
+        try:
+            _deciphered = getattr(Decoder, decode_function_name)(Path(file))
+            FACETS_SCHEMA.validate(_deciphered)
+            print(
+                f"Deciphered the following from {Path(file).name}: {_deciphered.items()}"
+            )
+            return file, _deciphered
+        except AttributeError as e:
+            print(f"Unable to read data from {Path(file).name}: {e}")
+        except schema.SchemaError as e:
+            print(f"Decoded facets from {Path(file).name} are not valid: {e}")
+        return file, None
 
     def decode(
         self,
         files: Union[os.PathLike, str, List[Union[str, os.PathLike]], GeneratorType],
         method: str = "data",
         raise_error: bool = False,
+        processes: Optional[int] = None,
+        chunksize: int = 10,
+        backend: str = "process",
+        cache: Optional[Union[str, os.PathLike, FacetCache]] = None,
     ):
         """Decode facets from file or list of files.
 
@@ -99,6 +112,17 @@ class Decoder:
         files: Union[str, Path, List[Union[str, Path]]]
         method: {"data", "name"}
         raise_error: bool
+        processes: int, optional
+          Number of workers decoding files concurrently. Default: The number of CPUs. With 1, files are decoded in
+          the calling process.
+        chunksize: int
+          Number of files sent to a worker at once.
+        backend: {"process", "thread"}
+          Decode files in a pool of (spawned) processes, or in a pool of threads for I/O-bound decoding (e.g. file
+          names, or zarr headers on network storage). Threads read netCDF headers one at a time.
+        cache: Union[str, Path, FacetCache], optional
+          Facet cache (or its SQLite file) consulted before decoding a file. Only the files that are not cached, or
+          that changed size or modification time since, are decoded, their facets being cached in turn.
         """
 
         if isinstance(files, (str, os.PathLike)):
@@ -109,19 +133,67 @@ class Decoder:
             )
         else:
             logging.info(f"Deciphering metadata with project = '{self.project}'")
-        manager = mp.Manager()
-        _file_facets = manager.dict()
-        lock = manager.Lock()
-        func = partial(
-            self._decoder, _file_facets, method, raise_error, self.project, lock
-        )
+        if backend not in ["process", "thread"]:
+            raise ValueError(f"Unknown backend: '{backend}'.")
 
-        with mp.Pool() as pool:
-            pool.imap(func, files, chunksize=10)
-            pool.close()
-            pool.join()
+        func = partial(self._decoder, method, raise_error, self.project)
 
-        self._file_facets.update(_file_facets)
+        close_cache = cache is not None and not isinstance(cache, FacetCache)
+        if close_cache:
+            cache = FacetCache(cache)
+        try:
+            signatures = None
+            if cache is not None:
+                hits, signatures = cache.lookup(files, self._cache_key(method))
+                logging.info(f"Found the facets of {len(hits)} files in the cache.")
+                self._file_facets.update(hits)
+                files = list(signatures)
+                if not files:
+                    return
+
+            if processes == 1:
+                self._store(map(func, files), method, cache, signatures)
+                return
+
+            if backend == "process":
+                pool = mp.get_context("spawn").Pool(processes=processes)
+            else:
+                pool = ThreadPool(processes=processes)
+            with pool:
+                self._store(
+                    pool.imap_unordered(func, files, chunksize=chunksize),
+                    method,
+                    cache,
+                    signatures,
+                )
+        finally:
+            if close_cache:
+                cache.close()
+
+    def _cache_key(self, method: str) -> str:
+        """Name of the facets decoded by this decoder in a cache."""
+        return f"{self.project or 'guessed'}_{method}"
+
+    def _store(
+        self,
+        results: Iterable[Tuple[Union[str, Path], Optional[dict]]],
+        method: str,
+        cache: Optional[FacetCache] = None,
+        signatures: Optional[Dict] = None,
+    ):
+        """Keep the facets of the decoded files as they are returned by the workers, caching them in batches."""
+        pending = list()
+        for file, facets in results:
+            if facets is None:
+                continue
+            self._file_facets[file] = facets
+            if cache is not None and signatures.get(file) is not None:
+                pending.append((file, signatures[file], facets))
+                if len(pending) >= 1000:
+                    cache.update(pending, self._cache_key(method))
+                    pending = list()
+        if pending:
+            cache.update(pending, self._cache_key(method))
 
     def facets_table(self):
         raise NotImplementedError()
@@ -139,23 +211,53 @@ class Decoder:
                 return project
         raise DecoderError("Unable to determine project from file name.")
 
-    @classmethod
-    def _from_dataset(cls, file: Union[Path, str]) -> (str, str, Dict):
-        file_name = Path(file).stem
+    @staticmethod
+    def _read_header(
+        file: Union[Path, str], variable_attrs: Sequence[str] = ()
+    ) -> Tuple[List[str], Dict, Dict[str, Dict]]:
+        """Read the header of a netCDF file or zarr store, opening it once.
 
-        variable_name = cls._decode_primary_variable(file)
-        variable_date = file_name.split("_")[-1]
+        Parameters
+        ----------
+        file: Union[Path, str]
+        variable_attrs: Sequence[str]
+          Variables whose attributes are read. Default: No variable.
 
-        if file.is_file() and file.suffix in [".nc", ".nc4"]:
-            ds = nc.Dataset(file)
-            data = dict()
-            for k in ds.ncattrs():
-                data[k] = getattr(ds, k)
-        elif file.is_dir() and file.suffix == ".zarr":
-            ds = zarr.open(file, mode="r")
+        Returns
+        -------
+        list of str
+          Names of the variables.
+        dict
+          Global attributes.
+        dict
+          Attributes of the requested variables found.
+        """
+        file = Path(file)
+        if file.suffix in [".nc", ".nc4"]:
+            with _NETCDF_LOCK, nc.Dataset(file, mode="r") as ds:
+                variables = list(ds.variables)
+                data = dict(ds.__dict__)
+                attrs = {
+                    v: dict(ds.variables[v].__dict__)
+                    for v in variable_attrs
+                    if v in ds.variables
+                }
+        elif file.suffix == ".zarr" and file.is_dir():
+            ds = zarr.open(str(file), mode="r")
+            variables = list(ds.array_keys())
             data = ds.attrs.asdict()
+            attrs = {v: ds[v].attrs.asdict() for v in variable_attrs if v in variables}
         else:
             raise DecoderError("Unable to read dataset.")
+        return variables, data, attrs
+
+    @classmethod
+    def _from_dataset(cls, file: Union[Path, str]) -> (str, str, Dict):
+        file = Path(file)
+        variables, data, _ = cls._read_header(file)
+
+        variable_name = cls._decode_primary_variable(file, variables)
+        variable_date = file.stem.split("_")[-1]
         return variable_name, variable_date, data
 
     @staticmethod
@@ -164,39 +266,31 @@ class Decoder:
         decode_file = file_name.split("_")
         return decode_file
 
-    @staticmethod
-    def _decode_primary_variable(file: Path) -> str:
+    @classmethod
+    def _decode_primary_variable(
+        cls, file: Path, variables: Optional[List[str]] = None
+    ) -> str:
         """Attempts to find the primary variable of a netCDF
 
         Parameters
         ----------
         file: Union[Path, str]
+        variables: List[str], optional
+          Names of the variables of the file. Default: Read from the file.
 
         Returns
         -------
         str
         """
-        dimsvar_dict = dict()
         coords = ("time", "lat", "lon", "rlat", "rlon", "height", "lev", "rotated_pole")
-        suggested_variable = file.name.split("_")[0]
-
-        if file.is_file() and file.suffix in [".nc", ".nc4"]:
-            data = nc.Dataset(file, mode="r")
-            for var_name, var_attrs in data.variables.items():
-                dimsvar_dict[var_name] = {
-                    k: var_attrs.getncattr(k) for k in var_attrs.ncattrs()
-                }
-            for k in dimsvar_dict.keys():
-                if not str(k).startswith(coords) and suggested_variable == k:
-                    return str(k)
-
-        elif file.is_dir() and file.suffix == ".zarr":
-            data = zarr.open(str(file), mode="r")
-            for k in data.array_keys():
-                if not str(k).startswith(coords) and suggested_variable == k:
-                    return str(k)
-        else:
-            raise NotImplementedError()
+        suggested_variable = Path(file).name.split("_")[0]
+
+        if variables is None:
+            variables, _, _ = cls._read_header(file)
+        if suggested_variable in variables and not suggested_variable.startswith(
+            coords
+        ):
+            return suggested_variable
 
     @staticmethod
     def _decode_time_info(
@@ -1,3 +1,4 @@
 from ._homogenized import *
+from ._ragged import *
 from ._raw import *
 from ._summaries import *
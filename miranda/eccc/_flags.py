@@ -0,0 +1,108 @@
+import logging
+from logging import config
+from typing import Dict, Union
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from miranda.scripting import LOGGING_CONFIG
+
+config.dictConfig(LOGGING_CONFIG)
+
+__all__ = ["decode_flags", "encode_flags", "flag_attributes", "restore_flag_codes"]
+
+# Flags are coded by their ASCII code, 0 meaning that no flag is set. Characters outside ASCII get codes above 127.
+_NON_ASCII_CODES = {"‡": 128}
+
+# Meanings of the flags documented by ECCC, as CF `flag_meanings` words
+_FLAG_MEANINGS = {
+    0: "no_flag",
+    ord("A"): "accumulated",
+    ord("C"): "precipitation_occurred_amount_uncertain",
+    ord("E"): "estimated",
+    ord("F"): "accumulated_and_estimated",
+    ord("L"): "precipitation_may_or_may_not_have_occurred",
+    ord("M"): "missing",
+    ord("N"): "temperature_missing_but_known_to_be_above_zero",
+    ord("S"): "more_than_one_occurrence",
+    ord("T"): "trace",
+    ord("Y"): "temperature_missing_but_known_to_be_below_zero",
+    ord("^"): "based_on_incomplete_data",
+    _NON_ASCII_CODES["‡"]: "partner_data_not_reviewed_by_national_climate_archives",
+}
+
+_CHARACTERS = np.array(
+    [""] + [chr(code) for code in range(1, 128)] + [""] * 128, dtype=object
+)
+for _character, _code in _NON_ASCII_CODES.items():
+    _CHARACTERS[_code] = _character
+
+
+def _flag_code(flag) -> int:
+    if pd.isna(flag):
+        return 0
+    flag = str(flag).strip()
+    if not flag:
+        return 0
+    if flag in _NON_ASCII_CODES:
+        return _NON_ASCII_CODES[flag]
+    if len(flag) == 1 and ord(flag) < 128:
+        return ord(flag)
+    logging.warning(f"Flag `{flag}` cannot be coded. Discarding.")
+    return 0
+
+
+def encode_flags(flags: np.ndarray) -> np.ndarray:
+    """Code string flags as uint8 integers: the ASCII code of the flag, or 0 where no flag is set.
+
+    Flags that are already uint8 codes (such as the flags decoded from flat files) are returned as is.
+    """
+    flags = np.asarray(flags)
+    if flags.dtype == np.uint8:
+        return flags
+
+    # Only code the distinct flags, then map them back onto the array
+    inverse, uniques = pd.factorize(flags.ravel())
+    table = np.array([_flag_code(u) for u in uniques] + [0], dtype=np.uint8)
+    return table[inverse].reshape(flags.shape)
+
+
+def decode_flags(codes: np.ndarray) -> np.ndarray:
+    """Decode uint8 flag codes back to strings, with empty strings where no flag is set."""
+    return _CHARACTERS[np.asarray(codes, dtype=np.uint8)]
+
+
+def flag_attributes(codes: Union[np.ndarray, xr.DataArray]) -> Dict[str, object]:
+    """CF `flag_values` and `flag_meanings` attributes of uint8 flag codes.
+
+    All documented flags are listed, so that datasets coded separately can be combined without conflicting
+    attributes. Undocumented flags found in the codes are added after them.
+    """
+    found = np.flatnonzero(np.bincount(np.asarray(codes).ravel(), minlength=256))
+    values = sorted(set(_FLAG_MEANINGS) | set(found.tolist()))
+    meanings = list()
+    for value in values:
+        if value in _FLAG_MEANINGS:
+            meanings.append(_FLAG_MEANINGS[value])
+        elif _CHARACTERS[value].isalnum():
+            meanings.append(f"undocumented_{_CHARACTERS[value]}")
+        else:
+            meanings.append(f"undocumented_{value}")
+    return dict(
+        flag_values=np.array(values, dtype=np.uint8),
+        flag_meanings=" ".join(meanings),
+    )
+
+
+def restore_flag_codes(da: xr.DataArray) -> xr.DataArray:
+    """Cast flag codes promoted to floats by the alignment or concatenation of datasets back to uint8.
+
+    Time steps and stations introduced by the alignment get the code of absent flags (0).
+    """
+    if da.dtype == np.uint8:
+        return da
+    attrs = da.attrs
+    da = da.fillna(0).astype(np.uint8)
+    da.attrs = attrs
+    return da
@@ -0,0 +1,276 @@
+import logging
+from logging import config
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+from miranda.scripting import LOGGING_CONFIG
+
+config.dictConfig(LOGGING_CONFIG)
+
+__all__ = [
+    "FlatFileRecords",
+    "partition_records",
+    "read_flat_file",
+    "records_time_axis",
+]
+
+# Fixed-width layouts of the ECCC flat files: header fields, followed by `steps` x (6-character value, 1-character flag)
+_LAYOUTS = dict(
+    hourly=dict(header=dict(station=7, year=4, month=2, day=2, element=3), steps=24),
+    daily=dict(header=dict(station=7, year=4, month=2, element=3), steps=31),
+)
+
+_VALUE_WIDTH = 6
+_FLAG_WIDTH = 1
+
+# Number of records decoded at once; bounds the memory used by the intermediate arrays
+_BLOCK_SIZE = 2**16
+
+
+class FlatFileRecords(NamedTuple):
+    """Typed arrays decoded from an ECCC HLY/DLY flat file, one row per record."""
+
+    station: np.ndarray  # str, station (climate) identifier
+    year: np.ndarray  # int16
+    month: np.ndarray  # int8
+    day: Optional[np.ndarray]  # int8, `None` for daily files
+    element: np.ndarray  # int16, element (variable) code
+    values: np.ndarray  # int32, shape (records, 24 or 31)
+    flags: np.ndarray  # uint8 ASCII codes, shape (records, 24 or 31), 0 where no flag is set
+
+
+def _layout(time_step: str) -> dict:
+    if time_step.lower() in ["h", "hour", "hourly"]:
+        return _LAYOUTS["hourly"]
+    elif time_step.lower() in ["d", "day", "daily"]:
+        return _LAYOUTS["daily"]
+    raise ValueError("Time step must be `h` / `hourly` or `d` / `daily`.")
+
+
+# Lookup tables from ASCII codes to digit values and to character kinds (1: digit, 2: minus sign, 4: invalid)
+_DIGITS = np.zeros(256, dtype=np.int32)
+_DIGITS[48:58] = np.arange(10)
+_KINDS = np.full(256, 4, dtype=np.uint8)
+_KINDS[48:58] = 1
+_KINDS[45] = 2
+_KINDS[[32, 43]] = 0
+
+
+def _decode_integers(fields: np.ndarray, missing_value: int) -> np.ndarray:
+    """Decode right-aligned, optionally signed, ASCII integers stored along the last axis of a uint8 array."""
+    digits = _DIGITS[fields]
+    decoded = digits[..., 0]
+    for i in range(1, fields.shape[-1]):
+        decoded = decoded * 10 + digits[..., i]
+
+    kinds = np.bitwise_or.reduce(_KINDS[fields], axis=-1)
+    decoded[(kinds & 2) > 0] *= -1
+
+    invalid = (kinds & 4) > 0
+    if invalid.any():
+        logging.warning(
+            f"{invalid.sum()} field(s) could not be decoded. Setting to {missing_value}."
+        )
+    decoded[invalid | ((kinds & 1) == 0)] = missing_value
+    return decoded
+
+
+def _records_array(buffer: np.ndarray, record_length: int) -> np.ndarray:
+    """Arrange the lines of a byte buffer as a (records, record_length) array, padding short lines with blanks."""
+    if buffer.size == 0:
+        return np.empty((0, record_length), dtype=np.uint8)
+
+    ends = np.flatnonzero(buffer == 10)
+    if buffer[-1] != 10:
+        ends = np.append(ends, buffer.size)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    lengths = ends - starts
+    # Discard carriage returns from Windows-style line endings
+    lengths[(lengths > 0) & (buffer[np.maximum(ends - 1, 0)] == 13)] -= 1
+
+    keep = lengths > 0
+    starts, lengths = starts[keep], lengths[keep]
+    if starts.size == 0:
+        return np.empty((0, record_length), dtype=np.uint8)
+
+    # Fast path: evenly spaced records of the expected length can be viewed without copying the buffer
+    stride = int(starts[1] - starts[0]) if starts.size > 1 else record_length
+    if (lengths == record_length).all() and (np.diff(starts) == stride).all():
+        return np.lib.stride_tricks.as_strided(
+            buffer[starts[0] :],
+            shape=(starts.size, record_length),
+            strides=(stride, 1),
+            writeable=False,
+        )
+
+    records = np.full((starts.size, record_length), 32, dtype=np.uint8)
+    columns = np.arange(record_length)
+    for block in range(0, starts.size, _BLOCK_SIZE):
+        block_starts = starts[block : block + _BLOCK_SIZE, np.newaxis]
+        block_lengths = np.minimum(lengths[block : block + _BLOCK_SIZE], record_length)
+        valid = columns < block_lengths[:, np.newaxis]
+        records[block : block + _BLOCK_SIZE][valid] = buffer[
+            (block_starts + columns)[valid]
+        ]
+    return records
+
+
+def read_flat_file(
+    file: Union[str, Path],
+    time_step: str,
+    missing_value: int = -9999,
+) -> FlatFileRecords:
+    """Decode an ECCC hourly (HLY) or daily (DLY) fixed-width flat file.
+
+    The file is memory-mapped and its records are sliced as uint8 arrays, so that the station codes, dates,
+    element codes, values and flags are decoded with NumPy rather than parsed line by line.
+
+    Parameters
+    ----------
+    file : Union[str, Path]
+    time_step : {"hourly", "daily"}
+    missing_value : int
+      Value given to blank value fields.
+
+    Returns
+    -------
+    FlatFileRecords
+    """
+    layout = _layout(time_step)
+    header_length = sum(layout["header"].values())
+    steps = layout["steps"]
+    record_length = header_length + steps * (_VALUE_WIDTH + _FLAG_WIDTH)
+
+    if Path(file).stat().st_size == 0:
+        buffer = np.empty(0, dtype=np.uint8)
+    else:
+        buffer = np.memmap(file, dtype=np.uint8, mode="r")
+    records = _records_array(buffer, record_length)
+    n = records.shape[0]
+
+    decoded = dict()
+    dtypes = dict(year=np.int16, month=np.int8, day=np.int8, element=np.int16)
+    position = 0
+    for field, width in layout["header"].items():
+        if field == "station":
+            codes = np.ascontiguousarray(records[:, position : position + width])
+            decoded[field] = np.char.strip(codes.view(f"S{width}").ravel()).astype(str)
+        else:
+            decoded[field] = np.empty(n, dtype=dtypes[field])
+        position += width
+
+    values = np.empty((n, steps), dtype=np.int32)
+    flags = np.empty((n, steps), dtype=np.uint8)
+    for block in range(0, n, _BLOCK_SIZE):
+        rows = records[block : block + _BLOCK_SIZE]
+
+        position = 0
+        for field, width in layout["header"].items():
+            if field != "station":
+                decoded[field][block : block + _BLOCK_SIZE] = _decode_integers(
+                    rows[:, position : position + width], -1
+                )
+            position += width
+
+        data = rows[:, header_length:].reshape(
+            rows.shape[0], steps, _VALUE_WIDTH + _FLAG_WIDTH
+        )
+        values[block : block + _BLOCK_SIZE] = _decode_integers(
+            data[..., :_VALUE_WIDTH], missing_value
+        )
+        block_flags = data[..., _VALUE_WIDTH]
+        flags[block : block + _BLOCK_SIZE] = np.where(block_flags == 32, 0, block_flags)
+
+    return FlatFileRecords(
+        station=decoded["station"],
+        year=decoded["year"],
+        month=decoded["month"],
+        day=decoded.get("day"),
+        element=decoded["element"],
+        values=values,
+        flags=flags,
+    )
+
+
+def partition_records(records: FlatFileRecords) -> Dict[str, Dict[int, np.ndarray]]:
+    """Group the records of a flat file by station and element code.
+
+    The records are sorted once on (station, element); every group is then a contiguous run of the sorted order,
+    so no boolean mask needs to be computed per station or per element.
+
+    Parameters
+    ----------
+    records : FlatFileRecords
+
+    Returns
+    -------
+    Dict[str, Dict[int, np.ndarray]]
+      Record indices, in file order, for every element code of every station.
+    """
+    partitions = dict()
+    if records.year.size == 0:
+        return partitions
+
+    order = np.lexsort((records.element, records.station))
+    station = records.station[order]
+    element = records.element[order]
+
+    breaks = np.flatnonzero(
+        (station[1:] != station[:-1]) | (element[1:] != element[:-1])
+    )
+    starts = np.concatenate([[0], breaks + 1])
+    ends = np.concatenate([breaks + 1, [order.size]])
+
+    for start, end in zip(starts, ends):
+        station_partitions = partitions.setdefault(str(station[start]), dict())
+        station_partitions[int(element[start])] = order[start:end]
+    return partitions
+
+
+def records_time_axis(
+    year: np.ndarray, month: np.ndarray, day: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Build the time axis of monthly (31 daily values) or daily (24 hourly values) records.
+
+    Parameters
+    ----------
+    year : np.ndarray
+    month : np.ndarray
+    day : np.ndarray, optional
+      If given, records hold 24 hourly values for the given day. Otherwise, they hold 31 daily values for the month.
+
+    Returns
+    -------
+    np.ndarray
+      datetime64 timestamps of every value, shaped (records, 24 or 31).
+    np.ndarray
+      Boolean mask that is False for days beyond the end of the month and for invalid dates.
+
+    Notes
+    -----
+    Indexing the timestamps, values and flags of the records with the mask flattens them to matching 1D series.
+    """
+    year = np.asarray(year, dtype=np.int64)
+    month = np.asarray(month, dtype=np.int64)
+
+    valid_month = (month >= 1) & (month <= 12)
+    months = np.where(valid_month, (year - 1970) * 12 + month - 1, 0)
+    first_day = months.astype("datetime64[M]").astype("datetime64[D]")
+    days_in_month = (
+        (months + 1).astype("datetime64[M]").astype("datetime64[D]") - first_day
+    ).astype(np.int64)
+
+    if day is None:
+        offsets = np.arange(31)
+        times = first_day[:, np.newaxis] + offsets.astype("timedelta64[D]")
+        valid = (offsets < days_in_month[:, np.newaxis]) & valid_month[:, np.newaxis]
+    else:
+        day = np.asarray(day, dtype=np.int64)
+        valid_day = valid_month & (day >= 1) & (day <= days_in_month)
+        start = (first_day + np.where(valid_day, day - 1, 0)).astype("datetime64[h]")
+        times = start[:, np.newaxis] + np.arange(24).astype("timedelta64[h]")
+        valid = np.repeat(valid_day[:, np.newaxis], 24, axis=1)
+
+    return times.astype("datetime64[ns]"), valid
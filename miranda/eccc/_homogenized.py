@@ -1,4 +1,3 @@
-import calendar
 import logging.config
 from pathlib import Path
 from typing import List, Optional, Tuple, Union
@@ -6,10 +5,13 @@ from typing import List, Optional, Tuple, Union
 import numpy as np
 import pandas as pd
 import xarray as xr
-from dask.diagnostics import ProgressBar
 
+from miranda._parallel import batch_pool, run_batches
 from miranda.utils import scripting
 
+from ._flags import encode_flags, flag_attributes, restore_flag_codes
+from ._flat_files import records_time_axis
+from ._inventory import StationInventory
 from ._utils import ahccd_metadata
 
 logging.config.dictConfig(scripting.LOGGING_CONFIG)
@@ -24,9 +26,35 @@ def convert_ahccd(
     output_dir: Union[str, Path],
     variable: str,
     generation: Optional[int] = None,
+    flag_codes: bool = False,
+    processes: int = 1,
+    write_stations: bool = False,
 ):
+    """Convert the AHCCD station files of a variable, merging the stations into a single NetCDF file.
+
+    Parameters
+    ----------
+    data_source : Union[str, Path]
+      Folder of the fixed-width station files.
+    output_dir : Union[str, Path]
+      The merged file is written to `output_dir`/merged_stations/ahccd_gen{generation}_{variable}.nc.
+    variable : str
+    generation : int, optional
+    flag_codes : bool
+      Whether to store the flags as integer codes following the CF flag conventions.
+    processes : int
+      Number of stations converted concurrently.
+    write_stations : bool
+      Whether to also write the NetCDF file of every station, to `output_dir`/{variable}. Existing station files
+      are kept.
+
+    Returns
+    -------
+    None
+    """
     output_dir = Path(output_dir).expanduser().joinpath(variable)
-    output_dir.mkdir(parents=True, exist_ok=True)
+    if write_stations:
+        output_dir.mkdir(parents=True, exist_ok=True)
 
     code = dict(tasmax="dx", tasmin="dn", tas="dm", pr="dt", prsn="ds", prlp="dr").get(
         variable
@@ -53,86 +81,125 @@ def convert_ahccd(
         metadata = pd.read_csv(metadata_source, header=3)
         metadata.columns = col_names.keys()
         cols_specs = col_spaces
-        for index, row in metadata.iterrows():
-            if isinstance(row["stnid"], str):
-                metadata.loc[index, "stnid"] = metadata.loc[index, "stnid"].replace(
-                    " ", ""
-                )
+        if metadata["stnid"].dtype == object:
+            metadata["stnid"] = metadata["stnid"].astype(str).str.replace(" ", "")
     else:
         raise KeyError(f"{variable} does not include 'pr' or 'tas'.")
+    inventory = StationInventory(metadata, id_column="stnid")
+
+    # Convert the station .txt files, keeping the converted stations in memory
+    combinations = list()
+    for ff in sorted(Path(data_source).glob("*d*.txt")):
+        stid = ff.name.replace(code, "").split(".txt")[0]
+        if stid not in inventory:
+            logger.warning(f"metadata info for station {ff.name} not found : skipping")
+            continue
+        station_file = None
+        if write_stations:
+            station_file = output_dir.joinpath(ff.name.replace(".txt", ".nc"))
+        combinations.append(
+            (
+                ff,
+                inventory.to_frame([stid]),
+                variable,
+                generation,
+                cols_specs,
+                var,
+                flag_codes,
+                global_attrs,
+                station_file,
+            )
+        )
 
-    # Convert station .txt files to netcdf
-    for ff in Path(data_source).glob("*d*.txt"):
-        outfile = output_dir.joinpath(ff.name.replace(".txt", ".nc"))
-        if not outfile.exists():
-            logger.info(ff.name)
-
-            stid = ff.name.replace(code, "").split(".txt")[0]
-            try:
-                metadata_st = metadata[metadata["stnid"] == int(stid)]
-            except ValueError:
-                metadata_st = metadata[metadata["stnid"] == stid]
-
-            if len(metadata_st) == 1:
-                ds_out = convert_ahccd_fwf_files(
-                    ff, metadata_st, variable, generation, cols_specs, var
-                )
-                ds_out.attrs = global_attrs
-
-                ds_out.to_netcdf(outfile)
-            else:
-                logger.warning(
-                    f"metadata info for station {ff.name} not found : skipping"
-                )
-
-    # merge individual stations to single .nc file
-    # variable
-    ncfiles = list(output_dir.glob("*.nc"))
     outfile = output_dir.parent.joinpath(
         "merged_stations", f"ahccd_gen{generation}_{variable}.nc"
     )
+    if outfile.exists() and not write_stations:
+        logger.info(f"{outfile} exists: skipping")
+        return
+
+    pool = batch_pool(processes)
+    try:
+        stations = run_batches(_convert_ahccd_station, combinations, pool)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
+    # merge individual stations to single .nc file
+    # variable
     if not outfile.exists():
-        logger.info("merging stations :", variable)
-        with ProgressBar():
-            ds_ahccd = xr.open_mfdataset(
-                ncfiles, concat_dim="station", combine="nested"
-            ).load()
-
-            for coord in ds_ahccd.coords:
-                # xarray object datatypes mix string and int (e.g. stnid) convert to string for merged nc files
-                # Do not apply to datetime object
-                if coord != "time" and ds_ahccd[coord].dtype == "O":
-                    ds_ahccd[coord] = ds_ahccd[coord].astype(str)
-
-            for v in ds_ahccd.data_vars:
-                # xarray object datatypes mix string and int (e.g. stnid) convert to string for merged nc files
-                # Do not apply to flag timeseries
-                if ds_ahccd[v].dtype == "O" and "flag" not in v:
-                    logger.info(v)
-                    ds_ahccd[v] = ds_ahccd[v].astype(str)
-
-            ds_ahccd[f"{variable}_flag"].attrs[
-                "long_name"
-            ] = f"{ds_ahccd[f'{variable}'].attrs['long_name']} flag"
-            ds_ahccd.lon.attrs["units"] = "degrees_east"
-            ds_ahccd.lon.attrs["long_name"] = "longitude"
-            ds_ahccd.lat.attrs["units"] = "degrees_north"
-            ds_ahccd.lat.attrs["long_name"] = "latitude"
-
-            for clean_name, orig_name in col_names.items():
-                if clean_name in ["lat", "long"]:
-                    continue
-                ds_ahccd[clean_name].attrs["long_name"] = orig_name
-
-            outfile.parent.mkdir(parents=True, exist_ok=True)
-            ds_ahccd.to_netcdf(outfile, format="NETCDF4_CLASSIC", mode="w")
-
-            del ds_ahccd
+        logger.info(f"merging stations : {variable}")
+        ds_ahccd = xr.concat(stations, dim="station")
+        del stations
+
+        for coord in ds_ahccd.coords:
+            # xarray object datatypes mix string and int (e.g. stnid) convert to string for merged nc files
+            # Do not apply to datetime object
+            if coord != "time" and ds_ahccd[coord].dtype == "O":
+                ds_ahccd[coord] = ds_ahccd[coord].astype(str)
+
+        for v in ds_ahccd.data_vars:
+            # xarray object datatypes mix string and int (e.g. stnid) convert to string for merged nc files
+            # Do not apply to flag timeseries
+            if ds_ahccd[v].dtype == "O" and "flag" not in v:
+                logger.info(v)
+                ds_ahccd[v] = ds_ahccd[v].astype(str)
+
+        if "flag_values" in ds_ahccd[f"{variable}_flag"].attrs:
+            ds_ahccd[f"{variable}_flag"] = restore_flag_codes(
+                ds_ahccd[f"{variable}_flag"]
+            )
+        ds_ahccd[f"{variable}_flag"].attrs[
+            "long_name"
+        ] = f"{ds_ahccd[f'{variable}'].attrs['long_name']} flag"
+        ds_ahccd.lon.attrs["units"] = "degrees_east"
+        ds_ahccd.lon.attrs["long_name"] = "longitude"
+        ds_ahccd.lat.attrs["units"] = "degrees_north"
+        ds_ahccd.lat.attrs["long_name"] = "latitude"
+
+        for clean_name, orig_name in col_names.items():
+            if clean_name in ["lat", "long"]:
+                continue
+            ds_ahccd[clean_name].attrs["long_name"] = orig_name
+
+        outfile.parent.mkdir(parents=True, exist_ok=True)
+        # The classic data model has no unsigned integers for the flag codes
+        ds_ahccd.to_netcdf(
+            outfile, format="NETCDF4" if flag_codes else "NETCDF4_CLASSIC", mode="w"
+        )
+
+        del ds_ahccd
     for nc in outfile.parent.glob("*.nc"):
         logger.info(nc)
-        ds = xr.open_dataset(nc)
-        logger.info(ds)
+        with xr.open_dataset(nc) as ds:
+            logger.info(ds)
+
+
+def _convert_ahccd_station(
+    ff: Path,
+    metadata: pd.DataFrame,
+    variable: str,
+    generation: int,
+    cols_specs: List[Tuple[int, int]],
+    attrs: dict,
+    flag_codes: bool,
+    global_attrs: dict,
+    station_file: Optional[Path] = None,
+) -> xr.Dataset:
+    """Convert the file of a station, also writing it to `station_file` if given and not existing yet."""
+    if station_file is not None and station_file.exists():
+        with xr.open_dataset(station_file) as ds:
+            return ds.load()
+
+    logger.info(ff.name)
+    ds_out = convert_ahccd_fwf_files(
+        ff, metadata, variable, generation, cols_specs, attrs, flag_codes
+    )
+    ds_out.attrs = global_attrs
+    if station_file is not None:
+        ds_out.to_netcdf(station_file)
+    return ds_out
 
 
 def convert_ahccd_fwf_files(
@@ -142,6 +209,7 @@ def convert_ahccd_fwf_files(
     generation: int = None,
     cols_specs: Optional[List[Tuple[int, int]]] = None,
     attrs: Optional[dict] = None,
+    flag_codes: bool = False,
 ) -> xr.Dataset:
 
     code = dict(tasmax="dx", tasmin="dn", tas="dm", pr="dt", prsn="ds", prlp="dr").get(
@@ -166,66 +234,42 @@ def convert_ahccd_fwf_files(
         flags = [c for c in df.columns if "Unnamed" in c]
         dfflags = df[flags[2:]]
 
-    df = df[cols]
-    df.replace(attrs["NaN_value"], np.NaN, inplace=True)
-
-    for i, j in enumerate(["Year", "Month"]):
-        df = df.rename(columns={df.columns[i]: j})
-    start_date = f"{df['Year'][0]}-{str(df['Month'][0]).zfill(2)}-01"
-
-    _, ndays = calendar.monthrange(df["Year"].iloc[-1], df["Month"].iloc[-1])
-    end_date = f"{df['Year'].iloc[-1]}-{str(df['Month'].iloc[-1]).zfill(2)}-{str(ndays).zfill(2)}"
-    time1 = pd.date_range(start=start_date, end=end_date)
-
-    index = pd.MultiIndex.from_arrays([df["Year"], df["Month"]])
-    df.index = index
-    dfflags.index = index
-    cols = [c for c in df.columns if "Year" not in c and "Month" not in c]
-    df = df[cols]
-    df.columns = np.arange(1, 32)
-    dfflags.columns = np.arange(1, 32)
-    ds = df.stack().to_frame()
-    ds = ds.rename(columns={0: variable})
-    ds_flag = dfflags.stack().to_frame()
-    ds_flag = ds_flag.rename(columns={0: "flag"})
-    ds.index.names = ["Year", "Month", "Day"]
-    ds_flag.index.names = ["Year", "Month", "Day"]
-    ds[f"{variable}_flag"] = ds_flag["flag"]
-    del ds_flag
-
-    # find invalid dates
-    for y in time1.year.unique():
-        for m in (
-            ds[ds.index.get_level_values("Year") == y]
-            .index.get_level_values("Month")
-            .unique()
-        ):
-            _, exp_ndays = calendar.monthrange(y, m)
-            ndays = (
-                (ds.index.get_level_values("Year") == y)
-                & (ds.index.get_level_values("Month") == m)
-            ).sum()
-            if ndays > np.int(exp_ndays):
-                print(f"year {y}, month {m}, ndays={ndays}, exp_ndays={exp_ndays}")
-                raise RuntimeError("Unknown days present.")
-
-    time_ds = pd.DataFrame(
-        {
-            "year": ds.index.get_level_values("Year"),
-            "month": ds.index.get_level_values("Month"),
-            "day": ds.index.get_level_values("Day"),
-        }
-    )
-
-    ds.index = pd.to_datetime(time_ds)
-
-    ds = ds.to_xarray().rename({"index": "time"})
+    # (year, month) x 31 days arrays of the values and flags
+    year = df[cols[0]].to_numpy()
+    month = df[cols[1]].to_numpy()
+    values = df[cols[2:]].to_numpy(dtype=float)
+    values[values == attrs["NaN_value"]] = np.nan
+    flag_values = dfflags.to_numpy()
+
+    times, valid = records_time_axis(year, month)
+    present = ~np.isnan(values)
+    invalid = present & ~valid
+    if invalid.any():
+        rows = invalid.any(axis=1)
+        for y, m in zip(year[rows], month[rows]):
+            logger.error(f"{ff}: values found beyond the days of year {y}, month {m}.")
+        raise RuntimeError("Unknown days present.")
+
+    # Daily axis from the first to the last month of the file, in whichever order its rows are, with the days
+    # found placed by their offset
+    start, end = times[valid].min(), times[valid].max()
+    time1 = pd.date_range(start=start, end=end)
+    index = ((times[present] - start) // np.timedelta64(1, "D")).astype(int)
+
+    data = np.full(time1.size, np.nan)
+    data[index] = values[present]
+    flag_data = np.full(time1.size, np.nan, dtype=flag_values.dtype)
+    flag_data[index] = flag_values[present]
 
     ds_out = xr.Dataset(coords={"time": time1})
-    for v in ds.data_vars:
-        ds_out[v] = ds[v]
+    ds_out[variable] = ("time", data)
+    ds_out[f"{variable}_flag"] = ("time", flag_data)
 
     ds_out[variable].attrs = attrs
+    if flag_codes:
+        codes = encode_flags(ds_out[f"{variable}_flag"].values)
+        ds_out[f"{variable}_flag"] = ds_out[f"{variable}_flag"].copy(data=codes)
+        ds_out[f"{variable}_flag"].attrs.update(flag_attributes(codes))
     # ds_out
     metadata = metadata.to_xarray().rename({"index": "station"}).drop_vars("station")
     metadata = metadata.assign_coords(
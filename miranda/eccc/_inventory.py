@@ -0,0 +1,174 @@
+import logging
+from functools import lru_cache
+from logging import config
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from miranda.scripting import LOGGING_CONFIG
+
+config.dictConfig(LOGGING_CONFIG)
+
+__all__ = ["StationInventory"]
+
+# Projected x,y station coordinates found in the ECCC inventory. Need to know prj to potentially rename
+_ECCC_PROJECTED_COLUMNS = ["Longitude", "Latitude"]
+_ECCC_COORDINATE_COLUMNS = {
+    "Latitude (Decimal Degrees)": "lat",
+    "Longitude (Decimal Degrees)": "lon",
+}
+
+
+class StationInventory:
+    """Station metadata indexed by station identifier.
+
+    The inventory is kept as a columnar copy (one NumPy array per column), so that stations can be looked up,
+    rejected and aligned with vectorized operations, whatever the number of stations.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+      Station metadata, one row per station. Only the first row of duplicated identifiers is kept.
+    id_column : str
+      Column holding the station identifiers. Identifiers are compared as strings, without surrounding blanks.
+    """
+
+    def __init__(self, data: pd.DataFrame, id_column: str = "Climate ID"):
+        if id_column not in data.columns:
+            raise KeyError(f"Station identifier column `{id_column}` not found.")
+
+        ids = data[id_column].astype(str).str.strip()
+        unique = ~ids.duplicated().to_numpy()
+        if not unique.all():
+            logging.warning(
+                f"{(~unique).sum()} duplicated station(s) found in inventory. Keeping first entries."
+            )
+
+        self.id_column = id_column
+        self.index = pd.Index(ids.to_numpy()[unique])
+        self.columns = {
+            column: data[column].to_numpy()[unique] for column in data.columns
+        }
+
+    @classmethod
+    def from_csv(
+        cls,
+        path: Union[str, Path],
+        id_column: str = "Climate ID",
+        header: int = 3,
+        names: Optional[Sequence[str]] = None,
+    ) -> "StationInventory":
+        """Read a station inventory CSV file.
+
+        Inventories are cached: reading the same, unmodified, file again returns the same inventory.
+        """
+        path = Path(path).expanduser().absolute()
+        return _read_inventory(
+            str(path),
+            path.stat().st_mtime,
+            id_column,
+            header,
+            None if names is None else tuple(names),
+        )
+
+    def __len__(self) -> int:
+        return self.index.size
+
+    def __contains__(self, station_id) -> bool:
+        return str(station_id).strip() in self.index
+
+    def positions(self, station_ids: Sequence) -> np.ndarray:
+        """Rows of the given stations in the inventory, -1 where stations are not found."""
+        station_ids = pd.Index(np.asarray(station_ids).astype(str)).str.strip()
+        return self.index.get_indexer(station_ids)
+
+    def contains(self, station_ids: Sequence) -> np.ndarray:
+        """Boolean mask of the given stations that are found in the inventory."""
+        return self.positions(station_ids) >= 0
+
+    def rejected(self, station_ids: Sequence) -> List[str]:
+        """Sorted unique identifiers of the given stations that are missing from the inventory."""
+        station_ids = np.asarray(station_ids).astype(str)
+        return sorted(set(station_ids[~self.contains(station_ids)]))
+
+    def select(
+        self, station_ids: Sequence, columns: Optional[Sequence[str]] = None
+    ) -> Dict[str, np.ndarray]:
+        """Metadata columns aligned on the given stations.
+
+        Raises
+        ------
+        KeyError
+          If stations are missing from the inventory. Reject them beforehand.
+        """
+        positions = self.positions(station_ids)
+        if (positions < 0).any():
+            missing = self.rejected(station_ids)
+            raise KeyError(f"Stations not found in inventory: {', '.join(missing)}.")
+        if columns is None:
+            columns = list(self.columns)
+        return {column: self.columns[column][positions] for column in columns}
+
+    def to_frame(
+        self, station_ids: Sequence, columns: Optional[Sequence[str]] = None
+    ) -> pd.DataFrame:
+        """Metadata rows aligned on the given stations."""
+        return pd.DataFrame(self.select(station_ids, columns))
+
+    def join(
+        self,
+        ds: xr.Dataset,
+        id_coord: str = "station_id",
+        dim: str = "station",
+        columns: Optional[Sequence[str]] = None,
+        rename: Optional[Dict[str, str]] = None,
+    ) -> xr.Dataset:
+        """Add the metadata of the stations of a Dataset as variables along its station dimension.
+
+        Parameters
+        ----------
+        ds : xr.Dataset
+        id_coord : str
+          Variable holding the station identifiers of the Dataset.
+        dim : str
+          Station dimension of the Dataset.
+        columns : Sequence[str], optional
+          Metadata columns to add, in order. Default: All columns.
+        rename : Dict[str, str], optional
+          New names of the added variables.
+
+        Returns
+        -------
+        xr.Dataset
+        """
+        rename = rename or dict()
+        meta = self.select(ds[id_coord].values, columns)
+        variables = {rename.get(k, k): xr.Variable(dim, v) for k, v in meta.items()}
+        return ds.assign(variables)
+
+    def eccc_columns(self) -> Tuple[List[str], Dict[str, str]]:
+        """Metadata columns of an ECCC inventory, starting with lat, lon and elevation, along with their new names.
+
+        The projected station coordinates are left out.
+        """
+        first = list(_ECCC_COORDINATE_COLUMNS) + ["Elevation (m)"]
+        columns = first + [
+            c for c in self.columns if c not in first + _ECCC_PROJECTED_COLUMNS
+        ]
+        return columns, _ECCC_COORDINATE_COLUMNS
+
+
+@lru_cache(maxsize=8)
+def _read_inventory(
+    path: str,
+    mtime: float,
+    id_column: str,
+    header: int,
+    names: Optional[Tuple[str]],
+) -> StationInventory:
+    logging.info(f"Reading station inventory: {path}.")
+    data = pd.read_csv(path, header=header, names=names)
+    return StationInventory(data, id_column=id_column)
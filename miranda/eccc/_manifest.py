@@ -0,0 +1,167 @@
+import hashlib
+import json
+import logging
+from logging import config
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+from miranda.scripting import LOGGING_CONFIG
+
+config.dictConfig(LOGGING_CONFIG)
+
+__all__ = ["ConversionManifest"]
+
+_MANIFEST_VERSION = 1
+
+
+class ConversionManifest:
+    """Persistent record of the source files converted, and of the outputs that every source produced.
+
+    Sources are recorded per variable (element code), along with their size and modification time (or content
+    checksum). A source is current for a variable if it is unchanged since it was recorded and all the outputs
+    recorded for it still exist.
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+      JSON file of the manifest. Created when saved if it does not exist.
+    root : Union[str, Path], optional
+      Folder of the sources. Sources under it are recorded relative to it, so that a new delivery of the
+      same tree in another location can be compared to a previous one. Default: Absolute paths are recorded.
+    checksums : bool
+      Compare the SHA-256 checksums of the sources, rather than their modification times. Slower, but
+      detects unchanged files copied anew. Default: False.
+    workflow : str, optional
+      Name of the workflow recording the manifest. A manifest recorded by another workflow cannot be opened, as
+      each workflow discards the records (and outputs) that it does not recognize. Default: Any workflow.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        root: Optional[Union[str, Path]] = None,
+        checksums: bool = False,
+        workflow: Optional[str] = None,
+    ):
+        self.path = Path(path).expanduser()
+        self.root = None if root is None else Path(root).expanduser().absolute()
+        self.checksums = checksums
+        self.workflow = workflow
+        self.sources = dict()
+        self._fingerprints = dict()
+
+        if self.path.exists():
+            with open(self.path) as f:
+                manifest = json.load(f)
+            recorded = manifest.get("workflow")
+            if None not in (workflow, recorded) and recorded != workflow:
+                raise ValueError(
+                    f"Manifest {self.path} was recorded by `{recorded}`, not `{workflow}`. "
+                    "Use a separate manifest for every workflow."
+                )
+            if manifest.get("version") == _MANIFEST_VERSION:
+                self.sources = manifest["sources"]
+            else:
+                logging.warning(
+                    f"Manifest {self.path} has an unknown version. Converting all sources."
+                )
+
+    def key(self, source: Union[str, Path]) -> str:
+        """Identifier of a source in the manifest."""
+        source = Path(source).expanduser().absolute()
+        if self.root is not None:
+            try:
+                return source.relative_to(self.root).as_posix()
+            except ValueError:
+                pass
+        return source.as_posix()
+
+    def fingerprint(
+        self, source: Union[str, Path]
+    ) -> Dict[str, Union[int, float, str]]:
+        """Size and modification time of a source, along with its checksum if checksums are compared."""
+        source = Path(source)
+        if source not in self._fingerprints:
+            stat = source.stat()
+            fingerprint = dict(size=stat.st_size, mtime=stat.st_mtime)
+            if self.checksums:
+                sha256 = hashlib.sha256()
+                with open(source, "rb") as f:
+                    for block in iter(lambda: f.read(2**20), b""):
+                        sha256.update(block)
+                fingerprint["sha256"] = sha256.hexdigest()
+            self._fingerprints[source] = fingerprint
+        return self._fingerprints[source]
+
+    def is_current(self, source: Union[str, Path], variable: str) -> bool:
+        """Whether a source is unchanged for a variable since it was recorded, and its outputs still exist."""
+        record = self.sources.get(self.key(source), dict()).get(variable)
+        if record is None:
+            return False
+
+        fingerprint = self.fingerprint(source)
+        fields = ["size", "sha256"] if self.checksums else ["size", "mtime"]
+        if any(record.get(field) != fingerprint[field] for field in fields):
+            return False
+        return all(Path(output).exists() for output in record["outputs"])
+
+    def variable_sources(self, variable: str) -> List[str]:
+        """Identifiers of the sources recorded for a variable."""
+        return sorted(k for k, records in self.sources.items() if variable in records)
+
+    def outputs(self, source: Union[str, Path], variable: str) -> List[Path]:
+        """Outputs recorded for a source and a variable."""
+        record = self.sources.get(self.key(source), dict()).get(variable, dict())
+        return [Path(output) for output in record.get("outputs", list())]
+
+    def record(
+        self, source: Union[str, Path], variable: str, outputs: List[Union[str, Path]]
+    ) -> None:
+        """Record the outputs produced from a source for a variable, along with the current state of the source."""
+        record = dict(self.fingerprint(source))
+        record["outputs"] = sorted(str(Path(output).absolute()) for output in outputs)
+        self.sources.setdefault(self.key(source), dict())[variable] = record
+
+    def discard(self, key: str, variable: str) -> None:
+        """Remove the record of a source for a variable, deleting the outputs recorded for it."""
+        records = self.sources.get(key, dict())
+        record = records.pop(variable, None)
+        if not records:
+            self.sources.pop(key, None)
+        if record is not None:
+            for output in record["outputs"]:
+                output = Path(output)
+                if output.exists():
+                    logging.info(f"Removing outdated output: {output}.")
+                    output.unlink()
+
+    def prune(self, variables: Iterable[str]) -> List[str]:
+        """Discard the records of variables for the sources deleted from the root folder, deleting their outputs.
+
+        Only the sources recorded relative to the root folder are pruned: without a root folder, nothing is.
+        Returns the identifiers of the sources pruned.
+        """
+        if self.root is None:
+            return list()
+        variables = list(variables)
+        pruned = list()
+        for key in list(self.sources):
+            if Path(key).is_absolute() or self.root.joinpath(key).exists():
+                continue
+            found = [v for v in variables if v in self.sources[key]]
+            for variable in found:
+                self.discard(key, variable)
+            if found:
+                pruned.append(key)
+        return pruned
+
+    def save(self) -> None:
+        """Write the manifest, replacing the previous one."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        manifest = dict(version=_MANIFEST_VERSION, sources=self.sources)
+        if self.workflow is not None:
+            manifest["workflow"] = self.workflow
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        tmp_path.replace(self.path)
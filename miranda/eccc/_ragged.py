@@ -0,0 +1,267 @@
+import logging
+from logging import config
+from pathlib import Path
+from typing import List, Optional, Sequence, Union
+
+import dask
+import dask.array as da
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from miranda.scripting import LOGGING_CONFIG
+
+config.dictConfig(LOGGING_CONFIG)
+
+__all__ = ["ragged_to_dense"]
+
+
+def _obs_variables(ds: xr.Dataset) -> List[str]:
+    return [v for v in ds.variables if ds[v].dims == ("obs",) and v != "station_index"]
+
+
+def _tmp_ragged(
+    ii: int,
+    nc: List[Union[str, Path]],
+    tempdir: Union[str, Path],
+    batches: Optional[int] = None,
+) -> None:
+    """Write a batch of station files as a contiguous ragged array, without aligning their time steps.
+
+    Every time step of each station file is written, one station after another along the "obs" dimension, along
+    with the identifier ("station_id") and the number of observations ("row_size") of every station.
+    """
+    if batches is None:
+        batches = "X"
+    logging.info(f"Processing batch of files {ii + 1} of {batches}")
+
+    station_ids = [Path(f).name.split("_")[0] for f in nc]
+    times, row_size = list(), list()
+    data, attrs = dict(), dict()
+    for f in nc:
+        with xr.open_dataset(f) as ds:
+            times.append(ds.time.values)
+            row_size.append(ds.time.size)
+            for v in ds.data_vars:
+                if ds[v].dims != ("time",):
+                    continue
+                values = ds[v].values
+                # dask gives warnings about export 'object' data types
+                if values.dtype == object:
+                    values = values.astype(str)
+                data.setdefault(v, list()).append(values)
+                attrs.setdefault(v, ds[v].attrs)
+            global_attrs = ds.attrs
+
+    ds = xr.Dataset(
+        {v: ("obs", np.concatenate(values), attrs[v]) for v, values in data.items()},
+        coords=dict(
+            time=("obs", np.concatenate(times)),
+            station_id=("station", np.array(station_ids, dtype=str)),
+        ),
+        attrs=global_attrs,
+    )
+    ds["row_size"] = ("station", np.array(row_size, dtype=np.int32))
+
+    comp = dict(zlib=True, complevel=5)
+    encoding = {var: comp for var in ds.data_vars}
+    ds.to_netcdf(
+        Path(tempdir).joinpath(f"{str(ii).zfill(3)}.nc"),
+        engine="h5netcdf",
+        format="NETCDF4",
+        encoding=encoding,
+    )
+
+
+def _combine_ragged(tmp_files: List[Path]) -> xr.Dataset:
+    """Lazily concatenate contiguous ragged arrays: observations along "obs" and stations along "station"."""
+    pieces = [xr.open_dataset(f, chunks=dict()) for f in tmp_files]
+    obs = xr.concat(
+        [p.drop_dims("station") for p in pieces], dim="obs", combine_attrs="override"
+    )
+    stations = xr.concat(
+        [p.drop_dims("obs") for p in pieces], dim="station", combine_attrs="override"
+    )
+    return xr.merge([obs, stations], combine_attrs="override")
+
+
+def _ragged_attributes(ds: xr.Dataset) -> xr.Dataset:
+    """Add the CF attributes of a ragged array of time series features."""
+    ds.attrs["featureType"] = "timeSeries"
+    ds.station_id.attrs["cf_role"] = "timeseries_id"
+    ds.station_id.attrs["long_name"] = "station identifier"
+    if "row_size" in ds:
+        ds.row_size.attrs["long_name"] = "number of observations for this station"
+        ds.row_size.attrs["sample_dimension"] = "obs"
+    if "station_index" in ds:
+        ds.station_index.attrs["long_name"] = "which station this observation is for"
+        ds.station_index.attrs["instance_dimension"] = "station"
+
+    coordinates = " ".join(
+        c for c in ["time", "lat", "lon", "station_id"] if c in ds.variables
+    )
+    for v in _obs_variables(ds):
+        if v != "time":
+            ds[v].encoding["coordinates"] = coordinates
+    return ds
+
+
+def _gather(
+    blocks: List[np.ndarray],
+    sources: List[np.ndarray],
+    positions: List[np.ndarray],
+    size: int,
+) -> np.ndarray:
+    out = np.empty(size, dtype=blocks[0].dtype)
+    for block, source, position in zip(blocks, sources, positions):
+        out[position] = block[source]
+    return out
+
+
+def _take(data: da.Array, indices: np.ndarray) -> da.Array:
+    """Lazily take the elements of a 1D dask array at the given indices, in blocks the size of its largest chunk.
+
+    Every output block is gathered by a single task from the input chunks that it needs, whereas dask's own
+    indexing splits out-of-order indices in as many chunks.
+    """
+    bounds = np.cumsum((0,) + data.chunks[0])
+    chunks = data.to_delayed().ravel()
+    size = max(data.chunks[0])
+    blocks = list()
+    for start in range(0, indices.size, size):
+        block = indices[start : start + size]
+        source_chunks = np.searchsorted(bounds, block, side="right") - 1
+        touched = np.unique(source_chunks)
+        gathered = dask.delayed(_gather)(
+            [chunks[c] for c in touched],
+            [block[source_chunks == c] - bounds[c] for c in touched],
+            [np.flatnonzero(source_chunks == c) for c in touched],
+            block.size,
+        )
+        blocks.append(da.from_delayed(gathered, (block.size,), dtype=data.dtype))
+    return da.concatenate(blocks)
+
+
+def _contiguous_to_indexed(ds: xr.Dataset) -> xr.Dataset:
+    """Reorder the observations of a contiguous ragged array chronologically, indexing their stations.
+
+    The order is computed from the time and row sizes alone: the other observed variables are reordered lazily.
+    """
+    station_index = np.repeat(
+        np.arange(ds.station.size, dtype=np.int32), ds.row_size.values
+    )
+    time = ds.time.values
+    order = np.argsort(time, kind="stable")
+
+    ds = ds.drop_vars("row_size")
+    reordered = dict()
+    for name, variable in ds.variables.items():
+        if name == "time":
+            reordered[name] = variable.copy(data=time[order])
+        elif variable.dims == ("obs",):
+            reordered[name] = variable.copy(data=_take(variable.chunk().data, order))
+    ds = ds.assign_coords(
+        {k: v for k, v in reordered.items() if k in ds.coords}
+    ).assign({k: v for k, v in reordered.items() if k not in ds.coords})
+    ds["station_index"] = ("obs", station_index[order])
+    return ds
+
+
+def _in_period(times: np.ndarray, period: slice) -> np.ndarray:
+    """Mask of the times within a period, with the label (and partial string) semantics of `.sel(time=...)`."""
+    axis = pd.DatetimeIndex(np.unique(times))
+    selected = axis[axis.slice_indexer(period.start, period.stop)]
+    return np.isin(times, selected.values)
+
+
+def ragged_to_dense(
+    ds: xr.Dataset,
+    station_ids: Optional[Sequence[str]] = None,
+    time: Optional[slice] = None,
+) -> xr.Dataset:
+    """Densify (a subset of) a CF contiguous or indexed ragged array of station time series.
+
+    Only the observations of the selected stations and time period are read, along with the time of the
+    observations of the selected stations (of the selected period, for chronological indexed arrays).
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+      Ragged array of time series, as written by `aggregate_stations` with a "contiguous" or "indexed" layout.
+    station_ids : Sequence[str], optional
+      Stations to densify, in order. Default: All stations.
+    time : slice, optional
+      Time period to densify, with inclusive bounds, selected as with `.sel(time=slice(...))`: "2000-01-01" holds
+      all the time steps of that day. Default: All time steps.
+
+    Returns
+    -------
+    xr.Dataset
+      (station, time) arrays over the time steps found in the selected observations. Time steps without an
+      observation are filled with NaN, empty strings or 0 (flag codes).
+    """
+    n_stations = ds.station.size
+    stations = np.arange(n_stations)
+    if station_ids is not None:
+        stations = pd.Index(ds.station_id.values.astype(str)).get_indexer(
+            np.atleast_1d(station_ids).astype(str)
+        )
+        if (stations < 0).any():
+            missing = np.atleast_1d(station_ids)[stations < 0]
+            raise KeyError(f"Stations not found: {', '.join(map(str, missing))}.")
+
+    # Observations of the selected stations, along with their rows in the dense array
+    if "row_size" in ds:
+        row_size = ds.row_size.values
+        offsets = np.concatenate([[0], np.cumsum(row_size)])
+        obs = np.concatenate(
+            [np.arange(offsets[s], offsets[s + 1]) for s in stations]
+            + [np.array([], dtype=int)]
+        )
+        rows = np.repeat(np.arange(stations.size), row_size[stations])
+    elif "station_index" in ds:
+        obs = np.arange(ds.obs.size)
+        if time is not None:
+            # Only the observations of the period are indexed, when they are in chronological order
+            index = pd.DatetimeIndex(ds.time.values)
+            if index.is_monotonic_increasing:
+                obs = obs[index.slice_indexer(time.start, time.stop)]
+        new_rows = np.full(n_stations, -1)
+        new_rows[stations] = np.arange(stations.size)
+        rows = new_rows[ds.station_index.isel(obs=obs).values]
+        obs, rows = obs[rows >= 0], rows[rows >= 0]
+    else:
+        raise ValueError("Dataset is not a ragged array of time series.")
+
+    times = ds.time.isel(obs=obs).values
+    if time is not None:
+        keep = _in_period(times, time)
+        obs, rows, times = obs[keep], rows[keep], times[keep]
+    sub = ds[_obs_variables(ds)].isel(obs=obs).load()
+
+    axis = np.unique(times)
+    columns = np.searchsorted(axis, times)
+
+    out = xr.Dataset(
+        coords=dict(time=axis, station=np.arange(stations.size)),
+        attrs={k: v for k, v in ds.attrs.items() if k != "featureType"},
+    )
+    for v in sub.data_vars:
+        values = sub[v].values
+        if values.dtype.kind == "f":
+            fill = np.nan
+        elif values.dtype.kind in "iu":
+            fill = 0
+        else:
+            fill = ""
+        dense = np.full((stations.size, axis.size), fill, dtype=values.dtype)
+        dense[rows, columns] = values
+        out[v] = (("station", "time"), dense, sub[v].attrs)
+
+    for v in ds.variables:
+        if ds[v].dims == ("station",) and v != "row_size":
+            if v in ds.coords:
+                out.coords[v] = ds[v].isel(station=stations).variable
+            else:
+                out[v] = ds[v].isel(station=stations).variable
+    return out
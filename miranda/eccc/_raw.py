@@ -11,28 +11,48 @@
 #
 # obtenu via http://climate.weather.gc.ca/index_e.html en cliquant sur 'about the data'
 #######################################################################
+import hashlib
 import itertools
 import logging
+import multiprocessing
+import multiprocessing.pool
+import re
+import shutil
 import tempfile
 import time
-from calendar import monthrange
+from collections import Counter
 from datetime import datetime as dt
+from functools import partial
 from logging import config
 from pathlib import Path
-from typing import List, Optional, Tuple, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
 import xarray as xr
+import zarr
 from dask.diagnostics import ProgressBar
+from dask.utils import parse_bytes
 
+from miranda._parallel import batch_pool, run_batches
 from miranda.scripting import LOGGING_CONFIG
 
+from ._flags import flag_attributes, restore_flag_codes
+from ._flat_files import partition_records, read_flat_file, records_time_axis
+from ._inventory import StationInventory
+from ._manifest import ConversionManifest
+from ._ragged import (
+    _combine_ragged,
+    _contiguous_to_indexed,
+    _ragged_attributes,
+    _tmp_ragged,
+)
 from ._utils import cf_daily_metadata, cf_hourly_metadata
 
 config.dictConfig(LOGGING_CONFIG)
 
 __all__ = [
+    "aggregate_flat_files",
     "aggregate_stations",
     "convert_hourly_flat_files",
     "convert_daily_flat_files",
@@ -40,199 +60,439 @@ __all__ = [
 ]
 
 
-def convert_hourly_flat_files(
-    source_files: Union[str, Path],
-    output_folder: Union[str, Path, List[Union[str, int]]],
-    variables: Union[str, int, List[Union[str, int]]],
-    missing_value: int = -9999,
-) -> None:
+def _source_files(
+    source_files: Union[str, Path, List[Union[str, Path]]], pattern: str
+) -> List[Path]:
+    """Gather the flat files found in a source folder (or given explicitly)."""
+    if isinstance(source_files, list):
+        return [Path(f) for f in source_files]
+    if Path(source_files).is_file():
+        return [Path(source_files)]
+    return sorted([f for f in Path(source_files).rglob(pattern) if f.is_file()])
+
+
+def _flat_file_jobs(
+    source_files: Union[str, Path, List[Union[str, Path]]],
+    variable_codes: List[str],
+    hourly: bool,
+) -> List[Tuple[Path, List[str]]]:
+    """Pair every hourly (HLY) or daily (DLY) flat file with the variable codes to be extracted from it."""
+    if not hourly:
+        return [(f, variable_codes) for f in _source_files(source_files, "*DLY*")]
+
+    # Variables 263 to 280 are only found in the "RCS" flat files
+    list_files = _source_files(source_files, "HLY*")
+    rcs_files = set(_source_files(source_files, "HLY*RCS*"))
+    rcs_codes = {vc for vc in variable_codes if 262 < int(vc) <= 280}
+
+    jobs = list()
+    for fichier in list_files:
+        if isinstance(source_files, list) or fichier in rcs_files:
+            file_codes = list(variable_codes)
+        else:
+            file_codes = [vc for vc in variable_codes if vc not in rcs_codes]
+        if file_codes:
+            jobs.append((fichier, file_codes))
+    return jobs
+
+
+def _decode_values(
+    values: np.ndarray,
+    flags: np.ndarray,
+    missing_value: int,
+    info: dict,
+    flag_codes: bool = False,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Mask missing and flagged values, apply the unit conversion and decode the flags to strings.
+
+    With `flag_codes`, the flags are kept as their uint8 ASCII codes instead.
     """
+    val = values.astype(float)
+    val[values == missing_value] = np.nan
 
-    Parameters
-    ----------
-    source_files : str or Path
-    output_folder : str or Path
-    variables : str or List[str]
-    missing_value : int
+    # Use the flag to mask the values
+    missing_flags = np.frombuffer(info["missing_flags"].encode(), dtype=np.uint8)
+    val[np.isin(flags, missing_flags)] = np.nan
 
-    Returns
-    -------
-    None
+    # Treat according to units conversions
+    val = val * info["scale_factor"] + info["add_offset"]
+
+    if flag_codes:
+        return val, np.array(flags, dtype=np.uint8)
+
+    # Absent flags (0) become empty strings
+    flag = np.ascontiguousarray(flags).view("S1").astype(str).astype(object)
+    return val, flag
+
+
+def _dataset_attributes() -> Dict[str, str]:
+    """Global attributes of the converted ECCC station datasets."""
+    attrs = dict()
+    attrs["Conventions"] = "CF-1.7"
+
+    attrs["title"] = "Environment and Climate Change Canada (ECCC) weather eccc"
+    attrs[
+        "history"
+    ] = "{}: Merged from multiple individual station files to n-dimensional array.".format(
+        dt.now().strftime("%Y-%m-%d %X")
+    )
+    attrs["version"] = f"v{dt.now().strftime('%Y.%m')}"
+    attrs["institution"] = "Environment and Climate Change Canada (ECCC)"
+    attrs[
+        "source"
+    ] = "Weather Station data <ec.services.climatiques-climate.services.ec@canada.ca>"
+    attrs[
+        "references"
+    ] = "https://climate.weather.gc.ca/doc/Technical_Documentation.pdf"
+    attrs[
+        "comment"
+    ] = "Acquired on demand from data specialists at ECCC Climate Services / Services Climatiques"
+    attrs["redistribution"] = "Redistribution policy unknown. For internal use only."
+    return attrs
+
+
+def _write_station_dataset(
+    values: np.ndarray,
+    flags: np.ndarray,
+    time_coords: Union[list, np.ndarray],
+    code: str,
+    variable_code: str,
+    info: dict,
+    rep_nc: Path,
+    source_label: str,
+) -> Path:
+    """Build the single-station Dataset of a variable and save it in the station folder.
+
+    The output file name ends with the label of the source file that the data comes from, so that stations
+    found in many source files never produce conflicting file names (even when converted concurrently).
     """
-    func_time = time.time()
+    nc_name = info["nc_name"]
+    dates = dict(time=time_coords)
+
+    ds = xr.Dataset()
+    da_val = xr.DataArray(values, coords=dates, dims=["time"])
+    da_val = da_val.rename(nc_name)
+    da_val.attrs["units"] = info["nc_units"]
+    da_val.attrs["id"] = code
+    da_val.attrs["element_number"] = variable_code
+    da_val.attrs["standard_name"] = info["standard_name"]
+    da_val.attrs["long_name"] = info["long_name"]
+
+    da_flag = xr.DataArray(flags, coords=dates, dims=["time"])
+    da_flag.attrs["long_name"] = "data flag"
+    da_flag.attrs["note"] = "See ECCC technical documentation for details"
+    if flags.dtype == np.uint8:
+        da_flag.attrs.update(flag_attributes(flags))
+
+    ds[nc_name] = da_val
+    ds["flag"] = da_flag
+
+    # save the file in NetCDF format
+    start_year = ds.time.dt.year.values[0]
+    end_year = ds.time.dt.year.values[-1]
+
+    station_folder = rep_nc.joinpath(str(code))
+    station_folder.mkdir(parents=True, exist_ok=True)
+
+    if start_year == end_year:
+        f_nc = "{c}_{vc}_{v}_{sy}_{src}.nc".format(
+            c=code, vc=variable_code, v=nc_name, sy=start_year, src=source_label
+        )
+    else:
+        f_nc = "{c}_{vc}_{v}_{sy}_{ey}_{src}.nc".format(
+            c=code,
+            vc=variable_code,
+            v=nc_name,
+            sy=start_year,
+            ey=end_year,
+            src=source_label,
+        )
 
-    if isinstance(variables, (str, int)):
-        variables = [variables]
+    ds.attrs.update(_dataset_attributes())
+
+    outfile = station_folder.joinpath(f_nc)
+    ds.to_netcdf(outfile)
+    return outfile
+
+
+def _source_labels(files: List[Path]) -> Dict[Path, str]:
+    """Give every source file a label that is unique among the files, to be used in output file names."""
+    stems = [f.stem.replace("_", "-") for f in files]
+    counts = Counter(stems)
+    labels = dict()
+    for f, stem in zip(files, stems):
+        if counts[stem] > 1:
+            stem = f"{stem}-{hashlib.md5(str(f).encode()).hexdigest()[:8]}"
+        labels[f] = stem
+    return labels
+
+
+def _decode_flat_file(
+    fichier: Path,
+    variable_codes: List[str],
+    variable_info: Dict[str, dict],
+    time_step: str,
+    missing_value: int,
+    flag_codes: bool = False,
+) -> Optional[Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]]]:
+    """Decode the requested variables of every station found in a flat file.
+
+    Returns the values, flags and timestamps of every variable of every station,
+    or None if the flat file could not be read.
+    """
+    logging.info(f"Processing file: {fichier}.")
+
+    # Decode the fixed-width records of the file
+    try:
+        records = read_flat_file(fichier, time_step, missing_value)
+    except FileNotFoundError:
+        logging.error(f"File {fichier} was not found.")
+        return
+    except (OSError, ValueError):
+        logging.error(
+            f"File {fichier} was unable to be read. This is probably an issue with the file."
+        )
+        return
 
-    for variable_code in variables:
-        info = cf_hourly_metadata(variable_code)
-        variable_code = str(variable_code).zfill(3)
-        variable_name = info["standard_name"]
-        variable_file_name = info["nc_name"]
-
-        # Preparing the data extraction
-        col_names = "code year month day code_var ".split()
-        for i in range(1, 25):
-            col_names.append(f"D{i:0n}")
-            col_names.append(f"F{i:0n}")
-
-        rep_nc = Path(output_folder).joinpath(variable_file_name)
-        rep_nc.mkdir(parents=True, exist_ok=True)
-
-        # Loop on the files
-        list_files = list()
-        if isinstance(source_files, list) or Path(source_files).is_file():
-            list_files.append(source_files)
-        elif 262 < int(variable_code) <= 280:
-            list_files.extend(
-                [f for f in Path(source_files).rglob("HLY*RCS*") if f.is_file()]
-            )
-        else:
-            list_files.extend(
-                [f for f in Path(source_files).rglob("HLY*") if f.is_file()]
-            )
+    decoded = dict()
 
-        errored_files = list()
-        for fichier in list_files:
-            logging.info(f"Processing file: {fichier}.")
+    # Loop through the station codes
+    for code, station_elements in partition_records(records).items():
+        for variable_code in variable_codes:
+            info = variable_info[variable_code]
+            nc_name = info["nc_name"]
 
-            # Create a dataframe from the files
-            try:
-                df = pd.read_fwf(
-                    fichier,
-                    widths=[7, 4, 2, 2, 3] + [6, 1] * 24,
-                    names=col_names,
-                    dtype={"year": int, "month": int, "day": int, "code_var": str},
+            # Abort if the variable is not found
+            if int(variable_code) not in station_elements:
+                logging.info(
+                    "Variable `{}` not found for station `{}` in file {}. Continuing...".format(
+                        nc_name, code, fichier
+                    )
                 )
-            except FileNotFoundError:
-                logging.error(f"File {fichier} was not found.")
-                errored_files.append(fichier)
                 continue
 
-            except (UnicodeDecodeError, Exception):
-                logging.error(
-                    f"File {fichier} was unable to be read. This is probably an issue with the file."
+            # Treat the data
+            logging.info(f"Converting `{nc_name}` for station code: {code}")
+
+            selection = station_elements[int(variable_code)]
+            val, flag = _decode_values(
+                records.values[selection],
+                records.flags[selection],
+                missing_value,
+                info,
+                flag_codes,
+            )
+
+            # Create the time coordinate, dropping days beyond the end of the months
+            times, valid = records_time_axis(
+                records.year[selection],
+                records.month[selection],
+                None if records.day is None else records.day[selection],
+            )
+            if records.day is not None and not valid.all():
+                logging.warning(
+                    f"Dropping {(~valid).sum() // 24} record(s) with invalid dates for station code: {code}."
                 )
-                errored_files.append(fichier)
-                continue
 
-            # Loop through the station codes
-            l_codes = df["code"].unique()
-            for code in l_codes:
-                df_code = df[df["code"] == code]
+            decoded.setdefault(code, dict())[variable_code] = (
+                val[valid],
+                flag[valid],
+                times[valid],
+            )
 
-                # Abort if the variable is not found
-                if variable_code not in df_code["code_var"].unique():
-                    logging.info(
-                        "Variable `{}` not found for station code: {}. Continuing...".format(
-                            variable_file_name, code
-                        )
-                    )
-                    continue
+    return decoded
 
-                # Treat the data
-                logging.info(
-                    "Converting `{}` for station code: {}".format(
-                        variable_file_name, code
-                    )
-                )
 
-                # Dump the data into a DataFrame
-                df_var = df_code[df_code["code_var"] == variable_code].copy()
+def _decode_flat_file_job(job: Tuple[Path, List[str]], **kwargs):
+    """Unpack a (file, variable codes) job for `_decode_flat_file`."""
+    return _decode_flat_file(*job, **kwargs)
 
-                # Mask the data according to the missing values flag
-                df_var = df_var.replace(missing_value, np.nan)
 
-                # Decode the values and flags
-                dfd = df_var.loc[:, [f"D{i:0n}" for i in range(1, 25)]]
-                dff = df_var.loc[:, [f"F{i:0n}" for i in range(1, 25)]]
+def _convert_flat_file(
+    fichier: Path,
+    source_label: str,
+    variable_codes: List[str],
+    variable_info: Dict[str, dict],
+    time_step: str,
+    missing_value: int,
+    flag_codes: bool = False,
+) -> Optional[Dict[str, List[Path]]]:
+    """Convert the requested variables of every station found in a flat file.
 
-                # Remove the "NaN" flag
-                dff = dff.fillna("")
+    Returns the files written for every variable, or None if the flat file could not be read.
+    """
+    decoded = _decode_flat_file(
+        fichier, variable_codes, variable_info, time_step, missing_value, flag_codes
+    )
+    if decoded is None:
+        return
+
+    outputs = {variable_code: list() for variable_code in variable_codes}
+    for code, station_series in decoded.items():
+        for variable_code, (val, flag, times) in station_series.items():
+            info = variable_info[variable_code]
+            outputs[variable_code].append(
+                _write_station_dataset(
+                    val,
+                    flag,
+                    times,
+                    code,
+                    variable_code,
+                    info,
+                    info["rep_nc"],
+                    source_label,
+                )
+            )
 
-                # Use the flag to mask the values
-                try:
-                    val = np.asfarray(dfd.values)
-                except ValueError as e:
-                    logging.error(f"{e} raised from {dfd}, continuing...")
-                    continue
-                flag = dff.values
-                mask = np.isin(flag, info["missing_flags"])
-                val[mask] = np.nan
-
-                # Treat according to units conversions
-                val = val * info["scale_factor"] + info["add_offset"]
-
-                # Create the DataArray
-                dates = dict(time=list())
-                for index, row in df_var.iterrows():
-                    for h in range(0, 24):
-                        dates["time"].append(
-                            dt(int(row.year), int(row.month), int(row.day), h)
-                        )
+    return outputs
+
+
+def _open_manifest(
+    manifest: Optional[Union[str, Path]],
+    source_files: Union[str, Path, List[Union[str, Path]]],
+    checksums: bool,
+    workflow: str,
+) -> Optional[ConversionManifest]:
+    """Manifest of the conversions, recording sources relative to the source folder (if one is given)."""
+    if manifest is None:
+        return
+    root = None
+    if not isinstance(source_files, list) and Path(source_files).is_dir():
+        root = source_files
+    return ConversionManifest(
+        manifest, root=root, checksums=checksums, workflow=workflow
+    )
 
-                ds = xr.Dataset()
-                da_val = xr.DataArray(val.flatten(), coords=dates, dims=["time"])
-                da_val = da_val.rename(variable_file_name)
-                da_val.attrs["units"] = info["nc_units"]
-                da_val.attrs["id"] = code
-                da_val.attrs["element_number"] = variable_code
-                da_val.attrs["standard_name"] = variable_name
-                da_val.attrs["long_name"] = info["long_name"]
 
-                da_flag = xr.DataArray(flag.flatten(), coords=dates, dims=["time"])
-                da_flag.attrs["long_name"] = "data flag"
-                da_flag.attrs["note"] = "See ECCC technical documentation for details"
+def _convert_flat_files(
+    jobs: List[Tuple[Path, List[str]]],
+    variable_info: Dict[str, dict],
+    time_step: str,
+    missing_value: int,
+    processes: int,
+    flag_codes: bool = False,
+    manifest: Optional[ConversionManifest] = None,
+) -> None:
+    """Convert flat files, one after another or spread across a pool of worker processes.
 
-                ds[variable_file_name] = da_val
-                ds["flag"] = da_flag
+    With a manifest, only the variables of the sources that changed since they were last converted are converted,
+    and the outputs of the sources deleted from the source folder are removed.
+    """
+    labels = _source_labels([fichier for fichier, _ in jobs])
+    if manifest is not None:
+        pruned = manifest.prune(variable_info)
+        if pruned:
+            logging.info(
+                f"Removed the outputs of {len(pruned)} deleted source(s): {', '.join(pruned)}."
+            )
+        jobs_count = len(jobs)
+        jobs = [
+            (fichier, [vc for vc in codes if not manifest.is_current(fichier, vc)])
+            for fichier, codes in jobs
+        ]
+        jobs = [(fichier, codes) for fichier, codes in jobs if codes]
+        logging.info(
+            f"{jobs_count - len(jobs)} of {jobs_count} file(s) are unchanged since their last conversion."
+        )
+        for fichier, codes in jobs:
+            for variable_code in codes:
+                manifest.discard(manifest.key(fichier), variable_code)
+    func = partial(
+        _convert_flat_file,
+        variable_info=variable_info,
+        time_step=time_step,
+        missing_value=missing_value,
+        flag_codes=flag_codes,
+    )
+    combs = [(fichier, labels[fichier], codes) for fichier, codes in jobs]
+
+    pool = batch_pool(processes)
+    try:
+        results = run_batches(func, combs, pool)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    errored_files = [str(c[0]) for c, r in zip(combs, results) if r is None]
+    if manifest is not None:
+        for (fichier, _, _), outputs in zip(combs, results):
+            if outputs is not None:
+                for variable_code, files in outputs.items():
+                    manifest.record(fichier, variable_code, files)
+        manifest.save()
+    if errored_files:
+        logging.warning(
+            f"{len(errored_files)} file(s) could not be converted: {', '.join(errored_files)}."
+        )
 
-                # save the file in NetCDF format
-                start_year = ds.time.dt.year.values[0]
-                end_year = ds.time.dt.year.values[-1]
 
-                station_folder = rep_nc.joinpath(str(code))
-                station_folder.mkdir(parents=True, exist_ok=True)
+def convert_hourly_flat_files(
+    source_files: Union[str, Path],
+    output_folder: Union[str, Path, List[Union[str, int]]],
+    variables: Union[str, int, List[Union[str, int]]],
+    missing_value: int = -9999,
+    processes: int = 1,
+    flag_codes: bool = False,
+    manifest: Optional[Union[str, Path]] = None,
+    checksums: bool = False,
+) -> None:
+    """
 
-                if start_year == end_year:
-                    f_nc = "{c}_{vc}_{v}_{sy}.nc".format(
-                        c=code, vc=variable_code, v=variable_file_name, sy=start_year
-                    )
-                else:
-                    f_nc = "{c}_{vc}_{v}_{sy}_{ey}.nc".format(
-                        c=code,
-                        vc=variable_code,
-                        v=variable_file_name,
-                        sy=start_year,
-                        ey=end_year,
-                    )
+    Parameters
+    ----------
+    source_files : str or Path
+    output_folder : str or Path
+    variables : str or List[str]
+    missing_value : int
+    processes : int
+      Number of worker processes across which the source files are spread. Default: 1.
+    flag_codes : bool
+      Store the flags as uint8 codes with CF `flag_values` / `flag_meanings` attributes, rather than as strings.
+      Default: False.
+    manifest : Union[str, Path], optional
+      JSON file recording the source files converted and their outputs. If given, only the variables of the
+      source files that changed since they were recorded are converted again. When converting a source folder,
+      the outputs of the recorded source files deleted from it are removed. A manifest cannot be shared with
+      `aggregate_stations`. Default: Convert all files.
+    checksums : bool
+      Detect changed source files with checksums of their content, rather than modification times. Default: False.
 
-                ds.attrs["Conventions"] = "CF-1.7"
+    Returns
+    -------
+    None
 
-                ds.attrs[
-                    "title"
-                ] = "Environment and Climate Change Canada (ECCC) weather eccc"
-                ds.attrs[
-                    "history"
-                ] = "{}: Merged from multiple individual station files to n-dimensional array.".format(
-                    dt.now().strftime("%Y-%m-%d %X")
-                )
-                ds.attrs["version"] = f"v{dt.now().strftime('%Y.%m')}"
-                ds.attrs["institution"] = "Environment and Climate Change Canada (ECCC)"
-                ds.attrs[
-                    "source"
-                ] = "Weather Station data <ec.services.climatiques-climate.services.ec@canada.ca>"
-                ds.attrs[
-                    "references"
-                ] = "https://climate.weather.gc.ca/doc/Technical_Documentation.pdf"
-                ds.attrs[
-                    "comment"
-                ] = "Acquired on demand from data specialists at ECCC Climate Services / Services Climatiques"
-                ds.attrs[
-                    "redistribution"
-                ] = "Redistribution policy unknown. For internal use only."
-
-                ds.to_netcdf(station_folder.joinpath(f_nc))
+    Notes
+    -----
+    Every source file is only read once: all requested variables are extracted from the same parsed file
+    and sent to their own output folder. Output file names end with the name of their source file, so a
+    station found in many source files is written to distinct files that are later joined by
+    `merge_converted_variables`.
+    """
+    func_time = time.time()
+
+    if isinstance(variables, (str, int)):
+        variables = [variables]
+
+    # Prepare the output folders of every requested variable
+    variable_info = dict()
+    for variable_code in variables:
+        info = cf_hourly_metadata(variable_code)
+        variable_code = str(variable_code).zfill(3)
+        info["rep_nc"] = Path(output_folder).joinpath(info["nc_name"])
+        info["rep_nc"].mkdir(parents=True, exist_ok=True)
+        variable_info[variable_code] = info
+
+    jobs = _flat_file_jobs(source_files, list(variable_info.keys()), hourly=True)
+    _convert_flat_files(
+        jobs,
+        variable_info,
+        "hourly",
+        missing_value,
+        processes,
+        flag_codes,
+        _open_manifest(manifest, source_files, checksums, "convert_flat_files"),
+    )
 
     logging.warning(f"Process completed in {time.time() - func_time:.2f} seconds")
 
@@ -242,6 +502,10 @@ def convert_daily_flat_files(
     output_folder: Union[str, Path],
     variables: Union[str, int, List[Union[str, int]]],
     missing_value: int = -9999,
+    processes: int = 1,
+    flag_codes: bool = False,
+    manifest: Optional[Union[str, Path]] = None,
+    checksums: bool = False,
 ) -> None:
     """
 
@@ -252,185 +516,486 @@ def convert_daily_flat_files(
     variables : Union[str, int, List[Union[str, int]]
       Variable codes (001, 002, 103, etc.)
     missing_value : int
+    processes : int
+      Number of worker processes across which the source files are spread. Default: 1.
+    flag_codes : bool
+      Store the flags as uint8 codes with CF `flag_values` / `flag_meanings` attributes, rather than as strings.
+      Default: False.
+    manifest : Union[str, Path], optional
+      JSON file recording the source files converted and their outputs. If given, only the variables of the
+      source files that changed since they were recorded are converted again. When converting a source folder,
+      the outputs of the recorded source files deleted from it are removed. A manifest cannot be shared with
+      `aggregate_stations`. Default: Convert all files.
+    checksums : bool
+      Detect changed source files with checksums of their content, rather than modification times. Default: False.
 
     Returns
     -------
     None
+
+    Notes
+    -----
+    Every source file is only read once: all requested variables are extracted from the same parsed file
+    and sent to their own output folder. Output file names end with the name of their source file, so a
+    station found in many source files is written to distinct files that are later joined by
+    `merge_converted_variables`.
     """
     func_time = time.time()
 
     if isinstance(variables, (str, int)):
         variables = [variables]
 
+    # Create the output directory of every requested variable
+    variable_info = dict()
     for variable_code in variables:
         info = cf_daily_metadata(variable_code)
         variable_code = str(variable_code).zfill(3)
-        nc_name = info["nc_name"]
-
-        # Prepare the data extraction
-        titre_colonnes = "code year month code_var".split()
-        for i in range(1, 32):
-            titre_colonnes.append(f"D{i:0n}")
-            titre_colonnes.append(f"F{i:0n}")
-
-        # Create the output directory
-        rep_nc = Path(output_folder).joinpath(nc_name)
-        rep_nc.mkdir(parents=True, exist_ok=True)
-
-        # Loop on the files
-        list_files = list()
-        if isinstance(source_files, list) or Path(source_files).is_file():
-            list_files.append(source_files)
-        else:
-            list_files.extend(
-                [f for f in Path(source_files).rglob("*DLY*") if f.is_file()]
-            )
+        info["rep_nc"] = Path(output_folder).joinpath(info["nc_name"])
+        info["rep_nc"].mkdir(parents=True, exist_ok=True)
+        variable_info[variable_code] = info
+
+    jobs = _flat_file_jobs(source_files, list(variable_info.keys()), hourly=False)
+    _convert_flat_files(
+        jobs,
+        variable_info,
+        "daily",
+        missing_value,
+        processes,
+        flag_codes,
+        _open_manifest(manifest, source_files, checksums, "convert_flat_files"),
+    )
 
-        errored_files = list()
-        for fichier in list_files:
-            logging.info(f"Processing file: {fichier}.")
+    logging.warning(f"Process completed in {time.time() - func_time:.2f} seconds")
 
-            # Create a Pandas DataFrame from the files
-            try:
-                df = pd.read_fwf(
-                    fichier,
-                    widths=[7, 4, 2, 3] + [6, 1] * 31,
-                    names=titre_colonnes,
-                    dtype={"year": int, "month": int, "code_var": str},
-                )
-            except ValueError:
-                logging.error(
-                    "File {} was unable to be read. This is probably an issue with the file.".format(
-                        fichier
-                    )
-                )
-                errored_files.append(fichier)
-                continue
 
-            # Loop through the station codes
-            l_codes = df["code"].unique()
-            for code in l_codes:
-                df_code = df[df["code"] == code]
+# Default (station, time) chunks of the aggregated stores: one station by a few years (hourly) or decades (daily)
+_AGGREGATE_CHUNKS = dict(
+    hourly=dict(station=1, time=24 * 366 * 4),
+    daily=dict(station=1, time=366 * 40),
+)
 
-                # Abort if the variable is not present
-                if variable_code not in df_code["code_var"].unique():
-                    logging.info(
-                        "Variable `{}` not found for station `{}` in file {}. Continuing...".format(
-                            nc_name, code, fichier
-                        )
-                    )
-                    continue
 
-                # Perform the data treatment
-                logging.info(f"Converting {nc_name} for station code: {code}")
+class _StationTimeStore:
+    """Chunked (station, time) zarr store of a variable, filled one station series at a time.
 
-                # Dump the values into a DataFrame
-                df_var = df_code[df_code["code_var"] == variable_code].copy()
+    Stations are given a row the first time they are seen and time steps are allocated a calendar year at a
+    time, as data for new years is found. Years found earlier than the first allocated year are appended at
+    the end of the time axis, then moved to their place when the store is closed.
+    """
 
-                # Apply the mask according to the NaN value
-                df_var = df_var.replace(missing_value, np.nan)
+    def __init__(
+        self,
+        path: Path,
+        variable_code: str,
+        info: dict,
+        hourly: bool,
+        include_flags: bool,
+        chunks: Dict[str, int],
+        flag_codes: bool = False,
+    ):
+        self.path = path
+        self.unit = "h" if hourly else "D"
+        self.stations = dict()
+        self.years = dict()
+        self.time = dict()
+        self.size = 0
+        self.flags_found = np.zeros(256, dtype=bool) if flag_codes else None
+
+        root = zarr.open_group(str(path), mode="w")
+        root.attrs.update(_dataset_attributes())
+        chunks = (chunks["station"], chunks["time"])
+
+        self.arrays = dict()
+        self.arrays["values"] = root.create_dataset(
+            info["nc_name"],
+            shape=(0, 0),
+            chunks=chunks,
+            dtype=np.float64,
+            fill_value=np.nan,
+        )
+        self.arrays["values"].attrs.update(
+            _ARRAY_DIMENSIONS=["station", "time"],
+            units=info["nc_units"],
+            element_number=variable_code,
+            standard_name=info["standard_name"],
+            long_name=info["long_name"],
+        )
+        if include_flags:
+            self.arrays["flags"] = root.create_dataset(
+                "flag",
+                shape=(0, 0),
+                chunks=chunks,
+                dtype=np.uint8 if flag_codes else "<U1",
+                fill_value=None,
+            )
+            self.arrays["flags"].attrs.update(
+                _ARRAY_DIMENSIONS=["station", "time"],
+                long_name="data flag",
+                note="See ECCC technical documentation for details",
+            )
 
-                # Decoding the values and flags
-                dfd = df_var.loc[:, [f"D{i:0n}" for i in range(1, 32)]]
-                dff = df_var.loc[:, [f"F{i:0n}" for i in range(1, 32)]]
+    def _resize(self) -> None:
+        for array in self.arrays.values():
+            array.resize(len(self.stations), self.size)
+
+    def _fill_unwritten_chunks(self) -> None:
+        """Write the code of absent flags (0) to the flag chunks that were never written.
+
+        Without a fill value (which xarray would mask), unwritten chunks are undefined. Chunks that were written are
+        initialized with zeros by zarr, so only the chunks never written are filled, once.
+        """
+        array = self.arrays.get("flags")
+        if array is None or array.dtype != np.uint8:
+            return
+        grid = [
+            range(-(-size // chunk)) for size, chunk in zip(array.shape, array.chunks)
+        ]
+        for i, j in itertools.product(*grid):
+            if f"{array.path}/{i}.{j}" not in array.store:
+                rows, columns = array.chunks
+                array[i * rows : (i + 1) * rows, j * columns : (j + 1) * columns] = 0
+
+    def _row(self, code: str) -> int:
+        if code not in self.stations:
+            self.stations[code] = len(self.stations)
+            self._resize()
+        return self.stations[code]
+
+    def _allocate(self, years: np.ndarray) -> None:
+        one_year = np.timedelta64(1, "Y")
+        new_years = [y for y in years if y not in self.years]
+        if not new_years:
+            return
+
+        # Keep the time axis continuous, from the earliest to the latest year found
+        if self.years:
+            first, last = min(self.years), max(self.years)
+        else:
+            first, last = min(new_years), min(new_years) - one_year
+        allocated = list()
+        if min(new_years) < first:
+            allocated.extend(np.arange(min(new_years), first))
+        if max(new_years) > last:
+            allocated.extend(np.arange(last + one_year, max(new_years) + one_year))
+
+        for year in allocated:
+            axis = np.arange(
+                year.astype(f"datetime64[{self.unit}]"),
+                (year + one_year).astype(f"datetime64[{self.unit}]"),
+            )
+            self.years[year] = self.size
+            self.time[year] = axis
+            self.size += axis.size
+        self._resize()
+
+    def _sort_time(self) -> None:
+        """Move the years appended out of order to their place on the time axis, a chunk of stations at a time."""
+        years = sorted(self.time)
+        if years == list(self.time):
+            return
+        columns = np.concatenate(
+            [self.years[y] + np.arange(self.time[y].size) for y in years]
+        )
+        for array in self.arrays.values():
+            step = array.chunks[0]
+            for start in range(0, array.shape[0], step):
+                array[start : start + step] = array[start : start + step][:, columns]
+
+        self.time = {y: self.time[y] for y in years}
+        offsets = np.cumsum([0] + [axis.size for axis in self.time.values()])
+        self.years = dict(zip(years, offsets[:-1].tolist()))
+
+    def _columns(self, times: np.ndarray) -> np.ndarray:
+        years = times.astype("datetime64[Y]")
+        unique_years, inverse = np.unique(years, return_inverse=True)
+        self._allocate(unique_years)
+        offsets = np.array([self.years[y] for y in unique_years], dtype=np.int64)
+        steps = (times - years.astype(times.dtype)) // np.timedelta64(1, self.unit)
+        return offsets[inverse] + steps.astype(np.int64)
+
+    def write(
+        self, code: str, values: np.ndarray, flags: np.ndarray, times: np.ndarray
+    ) -> None:
+        """Write the series of a station at the rows and columns of its code and timestamps."""
+        if times.size == 0:
+            return
+        row = self._row(code)
+        columns = self._columns(times)
+        start, end = int(columns.min()), int(columns.max()) + 1
+        contiguous = columns.size == end - start and (np.diff(columns) == 1).all()
+
+        if self.flags_found is not None:
+            self.flags_found[flags] = True
+        else:
+            flags = flags.astype("<U1")
+        data = dict(values=values, flags=flags)
+        for name, array in self.arrays.items():
+            if contiguous:
+                array[row, start:end] = data[name]
+            else:
+                block = array[row, start:end]
+                block[columns - start] = data[name]
+                array[row, start:end] = block
+
+    def close(self, inventory: StationInventory) -> None:
+        """Sort the time axis, write the time and station coordinates and metadata, and consolidate the store."""
+        self._fill_unwritten_chunks()
+        self._sort_time()
+        coords = dict(
+            time=np.concatenate(list(self.time.values())).astype("datetime64[ns]"),
+            station_id=("station", np.array(list(self.stations), dtype=str)),
+        )
+        columns, rename = inventory.eccc_columns()
+        meta = dict()
+        for column, values in inventory.select(list(self.stations), columns).items():
+            if values.dtype == object:
+                values = pd.Series(values).fillna("").astype(str).to_numpy()
+            meta[rename.get(column, column)] = ("station", values)
+        if self.flags_found is not None and "flags" in self.arrays:
+            attrs = flag_attributes(np.flatnonzero(self.flags_found).astype(np.uint8))
+            attrs["flag_values"] = attrs["flag_values"].tolist()
+            self.arrays["flags"].attrs.update(attrs)
+        xr.Dataset(meta, coords=coords).to_zarr(self.path, mode="a")
+        zarr.consolidate_metadata(str(self.path))
+
+
+def aggregate_flat_files(
+    source_files: Union[str, Path, List[Union[str, Path]]],
+    output_folder: Union[str, Path],
+    station_metadata: Union[str, Path],
+    time_step: str = "h",
+    variables: Optional[Union[str, int, List[Union[str, int]]]] = None,
+    include_flags: bool = True,
+    missing_value: int = -9999,
+    output_format: str = "zarr",
+    chunks: Optional[Dict[str, int]] = None,
+    intermediate_folder: Optional[Union[str, Path]] = None,
+    processes: int = 1,
+    temp_directory: Optional[Union[str, Path]] = None,
+    flag_codes: bool = False,
+) -> None:
+    """Aggregate ECCC flat files directly to (station, time) arrays, in a single pass over the source files.
 
-                # Remove the "NaN" flag
-                dff = dff.fillna("")
+    Parameters
+    ----------
+    source_files : Union[str, Path, List[Union[str, Path]]]
+    output_folder : Union[str, Path]
+    station_metadata : Union[str, Path]
+      ECCC station inventory. Stations missing from the inventory are rejected.
+    time_step : {"h", "d"}
+    variables : Optional[Union[str, int, List[Union[str, int]]]]
+    include_flags : bool
+    missing_value : int
+    output_format : {"zarr", "netcdf"}
+    chunks : Dict[str, int], optional
+      Chunk sizes along the "station" and "time" dimensions.
+    intermediate_folder : Union[str, Path], optional
+      If given, the single-station files of `convert_hourly_flat_files` / `convert_daily_flat_files` are also
+      written to this folder.
+    processes : int
+      Number of worker processes decoding the source files. Default: 1.
+    temp_directory : Union[str, Path], optional
+      Location of the intermediary zarr stores when `output_format` is "netcdf".
+    flag_codes : bool
+      Store the flags as uint8 codes with CF `flag_values` / `flag_meanings` attributes, rather than as strings.
+      Default: False.
 
-                try:
-                    # Use the flag to mask the values
-                    val = np.asfarray(dfd.values)
-                    flag = dff.values
-                    mask = np.isin(flag, info["missing_flags"])
-                    val[mask] = np.nan
-                except ValueError:
-                    continue
+    Returns
+    -------
+    None
 
-                # Adjust units
-                val = val * info["scale_factor"] + info["add_offset"]
-
-                # Create the DataArray and concatenate values and flags based on day-length of months
-                date_range = dict(time=list())
-                value_days = list()
-                flag_days = list()
-                for i, (index, row) in enumerate(df_var.iterrows()):
-                    period = pd.Period(year=row.year, month=row.month, freq="M")
-                    dates = pd.Series(
-                        pd.date_range(
-                            start=period.start_time, end=period.end_time, freq="D"
-                        )
-                    )
-                    date_range["time"].extend(dates)
+    Notes
+    -----
+    The records decoded from each source file are written straight into one chunked zarr store per variable,
+    instead of going through the single-station files, `merge_converted_variables` and `aggregate_stations`.
+    Stations are ordered by first appearance in the source files. NetCDF outputs are exported from the
+    completed zarr stores.
+    """
+    func_time = time.time()
 
-                    value_days.extend(val[i][range(monthrange(row.year, row.month)[1])])
-                    flag_days.extend(flag[i][range(monthrange(row.year, row.month)[1])])
+    if time_step.lower() in ["h", "hour", "hourly"]:
+        hourly = True
+    elif time_step.lower() in ["d", "day", "daily"]:
+        hourly = False
+    else:
+        raise ValueError("Time step must be `h` / `hourly` or `d` / `daily`.")
+    frequency = "hourly" if hourly else "daily"
+
+    if output_format == "netcdf":
+        suffix = ".nc"
+    elif output_format == "zarr":
+        suffix = ".zarr"
+    else:
+        raise NotImplementedError(f"`output_format`: '{output_format}")
+
+    if isinstance(variables, (str, int)):
+        variables = [variables]
+    elif variables is None:
+        variables = _default_variables(hourly)
+    if chunks is None:
+        chunks = _AGGREGATE_CHUNKS[frequency]
 
-                ds = xr.Dataset()
-                da_val = xr.DataArray(value_days, coords=date_range, dims=["time"])
-                da_val = da_val.rename(nc_name)
-                da_val.attrs["units"] = info["nc_units"]
-                da_val.attrs["id"] = code
-                da_val.attrs["element_number"] = variable_code
-                da_val.attrs["standard_name"] = info["standard_name"]
-                da_val.attrs["long_name"] = info["long_name"]
+    # Find the ECCC stations where we have available metadata
+    inventory = StationInventory.from_csv(station_metadata)
 
-                da_flag = xr.DataArray(flag_days, coords=date_range, dims=["time"])
-                da_flag.attrs["long_name"] = "data flag"
-                da_flag.attrs["note"] = "See ECCC technical documentation for details"
+    variable_info = dict()
+    for variable_code in variables:
+        if hourly:
+            info = cf_hourly_metadata(variable_code)
+        else:
+            info = cf_daily_metadata(variable_code)
+        variable_code = str(variable_code).zfill(3)
+        if intermediate_folder is not None:
+            info["rep_nc"] = Path(intermediate_folder).joinpath(info["nc_name"])
+            info["rep_nc"].mkdir(parents=True, exist_ok=True)
+        variable_info[variable_code] = info
+
+    jobs = _flat_file_jobs(source_files, list(variable_info.keys()), hourly=hourly)
+    labels = _source_labels([fichier for fichier, _ in jobs])
+
+    output_folder = Path(output_folder)
+    output_folder.mkdir(parents=True, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(prefix="eccc", dir=temp_directory) as temp_dir:
+        store_folder = output_folder if output_format == "zarr" else Path(temp_dir)
+        stores = dict()
+        for variable_code, info in variable_info.items():
+            stores[variable_code] = _StationTimeStore(
+                store_folder.joinpath(f"{info['nc_name']}_eccc_{frequency}.zarr"),
+                variable_code,
+                info,
+                hourly,
+                include_flags,
+                chunks,
+                flag_codes,
+            )
 
-                ds[nc_name] = da_val
-                ds["flag"] = da_flag
+        func = partial(
+            _decode_flat_file_job,
+            variable_info=variable_info,
+            time_step=frequency,
+            missing_value=missing_value,
+            flag_codes=flag_codes,
+        )
+        # Decoded files are consumed in order as they come, so that they are not all held in memory
+        pool = batch_pool(processes)
+        try:
+            if pool is not None:
+                decoded_files = pool.imap(func, jobs)
+            else:
+                decoded_files = map(func, jobs)
 
-                # Save as a NetCDF file
-                start_year = ds.time.dt.year.values[0]
-                end_year = ds.time.dt.year.values[-1]
+            errored_files = list()
+            rejected_stations = set()
+            for (fichier, _), decoded in zip(jobs, decoded_files):
+                if decoded is None:
+                    errored_files.append(str(fichier))
+                    continue
+                for code, station_series in decoded.items():
+                    if code not in inventory:
+                        rejected_stations.add(code)
+                        continue
+                    for variable_code, (val, flag, times) in station_series.items():
+                        stores[variable_code].write(code, val, flag, times)
+                        if intermediate_folder is not None:
+                            info = variable_info[variable_code]
+                            _write_station_dataset(
+                                val,
+                                flag,
+                                times,
+                                code,
+                                variable_code,
+                                info,
+                                info["rep_nc"],
+                                labels[fichier],
+                            )
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        if errored_files:
+            logging.warning(
+                f"{len(errored_files)} file(s) could not be converted: {', '.join(errored_files)}."
+            )
+        if rejected_stations:
+            logging.warning(
+                f"{len(rejected_stations)} rejected due to missing metadata. "
+                f"Rejected station codes are the following: {', '.join(sorted(rejected_stations))}."
+            )
 
-                station_folder = rep_nc.joinpath(str(code))
-                station_folder.mkdir(parents=True, exist_ok=True)
+        for variable_code, store in stores.items():
+            variable_name = variable_info[variable_code]["nc_name"]
+            if not store.stations:
+                logging.error(
+                    f"No stations were found containing variable `{variable_name}`."
+                )
+                shutil.rmtree(store.path)
+                continue
 
-                if start_year == end_year:
-                    f_nc = "{c}_{vc}_{v}_{sy}.nc".format(
-                        c=code, vc=variable_code, v=nc_name, sy=start_year
-                    )
+            store.close(inventory)
+            years = sorted(store.years)
+            path = output_folder.joinpath(
+                f"{variable_name}_eccc_{frequency}_{years[0]}-{years[-1]}_"
+                f'created{dt.now().strftime("%Y%m%d")}{suffix}'
+            )
+            if path.exists():
+                logging.warning(f"Replacing existing output: {path}.")
+                if path.is_dir():
+                    shutil.rmtree(path)
                 else:
-                    f_nc = "{c}_{vc}_{v}_{sy}_{ey}.nc".format(
-                        c=code,
-                        vc=variable_code,
-                        v=nc_name,
-                        sy=start_year,
-                        ey=end_year,
-                    )
+                    path.unlink()
 
-                ds.attrs["Conventions"] = "CF-1.7"
-
-                ds.attrs[
-                    "title"
-                ] = "Environment and Climate Change Canada (ECCC) weather eccc"
-                ds.attrs[
-                    "history"
-                ] = "{}: Merged from multiple individual station files to n-dimensional array.".format(
-                    dt.now().strftime("%Y-%m-%d %X")
+            logging.info(
+                "Number of ECCC stations: {}, time steps: {}.".format(
+                    len(store.stations), store.size
                 )
-                ds.attrs["version"] = "v{}".format(dt.now().strftime("%Y.%m"))
-                ds.attrs["institution"] = "Environment and Climate Change Canada (ECCC)"
-                ds.attrs[
-                    "source"
-                ] = "Weather Station data <ec.services.climatiques-climate.services.ec@canada.ca>"
-                ds.attrs[
-                    "references"
-                ] = "https://climate.weather.gc.ca/doc/Technical_Documentation.pdf"
-                ds.attrs[
-                    "comment"
-                ] = "Acquired on demand from data specialists at ECCC Climate Services / Services Climatiques"
-                ds.attrs[
-                    "redistribution"
-                ] = "Redistribution policy unknown. For internal use only."
-
-                ds.to_netcdf(station_folder.joinpath(f_nc))
+            )
+            if output_format == "zarr":
+                store.path.rename(path)
+            else:
+                with xr.open_zarr(store.path) as ds:
+                    if "flag" in ds and "flag_values" in ds.flag.attrs:
+                        ds.flag.attrs["flag_values"] = np.array(
+                            ds.flag.attrs["flag_values"], dtype=np.uint8
+                        )
+                    comp = dict(
+                        zlib=True,
+                        complevel=5,
+                        chunksizes=(
+                            min(chunks["station"], ds.station.size),
+                            min(chunks["time"], ds.time.size),
+                        ),
+                    )
+                    encoding = {
+                        var: comp
+                        for var in ds.data_vars
+                        if ds[var].dims == ("station", "time")
+                    }
+                    with ProgressBar():
+                        ds.to_netcdf(
+                            path, engine="h5netcdf", format="NETCDF4", encoding=encoding
+                        )
 
     logging.warning(f"Process completed in {time.time() - func_time:.2f} seconds")
 
 
+def _default_variables(hourly: bool) -> List[int]:
+    """Variable codes aggregated when none are requested."""
+    if hourly:
+        variables = [
+            89,
+            94,
+            123,
+        ]
+        variables.extend(range(76, 81))
+        variables.extend(range(262, 281))
+    else:
+        variables = [1, 2, 3]
+        variables.extend(range(10, 26))
+    return variables
+
+
 def aggregate_stations(
     source_files: Optional[Union[str, Path]] = None,
     output_folder: Optional[Union[str, Path]] = None,
@@ -441,6 +1006,12 @@ def aggregate_stations(
     groups: int = 5,
     mf_dataset_freq: Optional[str] = None,
     temp_directory: Optional[Union[str, Path]] = None,
+    processes: int = 1,
+    memory_limit: Optional[Union[int, str]] = None,
+    fan_in: int = 10,
+    manifest: Optional[Union[str, Path]] = None,
+    checksums: bool = False,
+    layout: str = "dense",
 ) -> None:
     """
 
@@ -458,6 +1029,27 @@ def aggregate_stations(
       Resampling frequency for creating output multi-file Datasets. E.g. 'YS': 1 year per file, '5YS': 5 years per file.
     temp_directory: Optional[Union[str, Path]]
       Use another temporary directory location in case default location is not spacious enough.
+    processes: int
+      Maximum number of file groupings converted, and of `mf_dataset_freq` files written, concurrently. Default: 1.
+    memory_limit: Optional[Union[int, str]]
+      Memory budget (bytes, or a string such as "16GB") shared by the concurrent file groupings.
+      Each grouping is written in blocks of stations that fit in its share of the budget.
+      Files of `mf_dataset_freq` periods are only written concurrently as long as they fit in it. Default: No limit.
+    fan_in: int
+      Maximum number of grouped files opened for the final multi-file Dataset.
+      Above it, the grouped files are merged together in rounds of `fan_in` files. Default: 10.
+    manifest: Optional[Union[str, Path]]
+      JSON file recording the station files aggregated and the outputs of every variable. If given, variables
+      are only aggregated again if station files were added, removed or changed since they were recorded.
+      A manifest cannot be shared with the flat file conversions.
+    checksums: bool
+      Detect changed station files with checksums of their content, rather than modification times. Default: False.
+    layout: {"dense", "contiguous", "indexed"}
+      "dense" writes (station, time) arrays over every time step from the first to the last year of the stations.
+      "contiguous" and "indexed" write CF ragged arrays of time series instead, only holding the time steps found
+      in the station files: grouped by station, or in chronological order with the index of their station.
+      Ragged arrays can be densified with `ragged_to_dense`. `mf_dataset_freq` only applies to dense arrays.
+      Default: "dense".
 
     Returns
     -------
@@ -484,17 +1076,16 @@ def aggregate_stations(
     if isinstance(variables, (str, int)):
         variables = [variables]
     elif variables is None:
-        if hourly:
-            variables = [
-                89,
-                94,
-                123,
-            ]
-            variables.extend(range(76, 81))
-            variables.extend(range(262, 281))
-        else:
-            variables = [1, 2, 3]
-            variables.extend(range(10, 26))
+        variables = _default_variables(hourly)
+
+    if layout not in ["dense", "contiguous", "indexed"]:
+        raise NotImplementedError(f"`layout`: '{layout}'")
+
+    # Find the ECCC stations where we have available metadata
+    inventory = StationInventory.from_csv(station_metadata)
+    columns, rename = inventory.eccc_columns()
+
+    manifest = _open_manifest(manifest, source_files, checksums, "aggregate_stations")
 
     for variable_code in variables:
         if hourly:
@@ -504,30 +1095,70 @@ def aggregate_stations(
         variable_name = info["nc_name"]
         logging.info(f"Merging `{variable_name}` using `{time_step}` time step.")
 
-        # Find the ECCC stations where we have available metadata
-        df_inv = pd.read_csv(str(station_metadata), header=3)
-        station_inventory = list(df_inv["Climate ID"].values)
-
         # Only perform aggregation on available data with corresponding metadata
         logging.info("Performing glob and sort.")
         nclist = sorted(list(source_files.joinpath(variable_name).rglob("*.nc")))
 
-        ds = None
-        if nclist != list():
-            nclists = np.array_split(nclist, groups)
-
-            with tempfile.TemporaryDirectory(
-                prefix="eccc", dir=temp_directory
-            ) as temp_dir:
-                combinations = [(ii, nc, temp_dir) for ii, nc in enumerate(nclists)]
+        element = str(variable_code).zfill(3)
+        if manifest is not None:
+            recorded = manifest.variable_sources(element)
+            if (
+                nclist
+                and recorded == sorted(manifest.key(nc) for nc in nclist)
+                and all(manifest.is_current(nc, element) for nc in nclist)
+            ):
+                logging.info(
+                    f"Station files of `{variable_name}` are unchanged since their last aggregation. Continuing..."
+                )
+                continue
+            for key in recorded:
+                manifest.discard(key, element)
+
+        if layout != "dense":
+            paths = _aggregate_ragged(
+                nclist,
+                output_folder,
+                inventory,
+                variable_name,
+                hourly,
+                include_flags,
+                groups,
+                temp_directory,
+                processes,
+                layout,
+            )
+            if manifest is not None and paths:
+                for nc in nclist:
+                    manifest.record(nc, element, paths)
+                manifest.save()
+            continue
 
-                # TODO memory use seems ok here .. could try using Pool() to increase performance
-                for combo in combinations:
-                    ii, nc, temp_dir = combo
-                    _tmp_nc(ii, nc, temp_dir, groups)
+        ds = None
+        temp_dir = None
+        try:
+            if nclist != list():
+                nclists = [nc for nc in np.array_split(nclist, groups) if len(nc) > 0]
+
+                # The batch files are kept until the outputs are written, possibly by other processes
+                temp_dir = tempfile.mkdtemp(prefix="eccc", dir=temp_directory)
+                workers, memory_ceiling = _batch_workers(
+                    nclists, processes, memory_limit
+                )
+                combinations = [
+                    (ii, nc, temp_dir, len(nclists), memory_ceiling)
+                    for ii, nc in enumerate(nclists)
+                ]
+                pool = batch_pool(workers)
+                try:
+                    run_batches(_tmp_nc, combinations, pool)
+                    tmp_files = _reduce_tmp_nc(temp_dir, fan_in, pool)
+                finally:
+                    if pool is not None:
+                        pool.close()
+                        pool.join()
 
                 ds = xr.open_mfdataset(
-                    sorted(list(Path(temp_dir).glob("*.nc"))),
+                    tmp_files,
                     combine="nested",
                     concat_dim="station",
                     chunks=dict(time=365),
@@ -535,169 +1166,341 @@ def aggregate_stations(
 
                 # dask gives warnings about export 'object' data types
                 ds["station_id"] = ds["station_id"].astype(str)
-        if ds:
-            station_file_codes = [x.name.split("_")[0] for x in nclist]
-            rejected_stations = set(station_file_codes).difference(
-                set(station_inventory)
-            )
+                if "flag" in ds and "flag_values" in ds.flag.attrs:
+                    ds["flag"] = restore_flag_codes(ds.flag)
+            if ds:
+                station_file_codes = [x.name.split("_")[0] for x in nclist]
+                rejected_stations = inventory.rejected(station_file_codes)
 
-            logging.info(f"{len(rejected_stations)} rejected due to missing metadata.")
-            r_all = np.zeros(ds.station_id.shape) == 0
-
-            for r in rejected_stations:
-                r_all[ds.station_id == r] = False
-            ds = ds.isel(station=r_all)
-            if not include_flags:
-                drop_vars = [vv for vv in ds.data_vars if "flag" in vv]
-                ds = ds.drop_vars(drop_vars)
-
-            # Ensure data is in order to add metadata
-            ds = ds.sortby(ds.station_id)
-
-            attrs1 = ds.attrs
-            # filter metadata for station_ids in dataset
-            logging.info("Writing metdata.")
-
-            meta = df_inv.loc[df_inv["Climate ID"].isin(ds.station_id.values)]
-            # Rearrange column order to have lon, lat, elev first
-            cols = meta.columns.tolist()
-            cols1 = [
-                "Latitude (Decimal Degrees)",
-                "Longitude (Decimal Degrees)",
-                "Elevation (m)",
-            ]
-            for rr in cols1:
-                cols.remove(rr)
-            cols1.extend(cols)
-            meta = meta[cols1]
-            meta.index.rename("station", inplace=True)
-            meta = meta.to_xarray()
-            meta.sortby(meta["Climate ID"])
-            meta = meta.assign({"station": ds.station.values})
-
-            meta = meta.drop(
-                ["Longitude", "Latitude"]
-            )  # these values are projected x,y values Need to know prj to potentially rename
-            np.testing.assert_array_equal(
-                meta["Climate ID"].values, ds.station_id.values
-            )
-            ds = xr.merge([ds, meta])
-            ds.attrs = attrs1
+                logging.info(
+                    f"{len(rejected_stations)} rejected due to missing metadata."
+                )
+                ds = ds.isel(station=inventory.contains(ds.station_id.values))
+                if not include_flags:
+                    drop_vars = [vv for vv in ds.data_vars if "flag" in vv]
+                    ds = ds.drop_vars(drop_vars)
 
-            # TODO rename Longitude / Latitude DD
-            rename = {
-                "Latitude (Decimal Degrees)": "lat",
-                "Longitude (Decimal Degrees)": "lon",
-            }
-            for i in rename.items():
-                ds = ds.rename({i[0]: i[1]})
+                # Ensure data is in order to add metadata
+                ds = ds.sortby(ds.station_id)
 
-            valid_stations = list(sorted(ds.station_id.values))
-            valid_stations_count = len(valid_stations)
+                # Add the metadata of the station_ids in dataset
+                logging.info("Writing metdata.")
+                ds = inventory.join(ds, columns=columns, rename=rename)
+                ds = ds.assign_coords(station=np.arange(ds.station.size))
 
-            logging.info(f"Processing stations for variable `{variable_name}`.")
+                valid_stations = list(sorted(ds.station_id.values))
+                valid_stations_count = len(valid_stations)
 
-            if len(station_file_codes) == 0:
-                logging.error(
-                    f"No stations were found containing variable filename `{variable_name}`. Exiting."
-                )
-                return
+                logging.info(f"Processing stations for variable `{variable_name}`.")
+
+                if len(station_file_codes) == 0:
+                    logging.error(
+                        f"No stations were found containing variable filename `{variable_name}`. Exiting."
+                    )
+                    return
 
-            logging.warning(
-                "Files exist for {} ECCC stations. Metadata found for {} stations. Rejecting {} stations.".format(
-                    len(station_file_codes),
-                    valid_stations_count,
-                    len(rejected_stations),
-                )
-            )
-            if rejected_stations:
                 logging.warning(
-                    f"Rejected station codes are the following: {', '.join(rejected_stations)}."
+                    "Files exist for {} ECCC stations. Metadata found for {} stations. Rejecting {} stations.".format(
+                        len(station_file_codes),
+                        valid_stations_count,
+                        len(rejected_stations),
+                    )
                 )
+                if rejected_stations:
+                    logging.warning(
+                        f"Rejected station codes are the following: {', '.join(rejected_stations)}."
+                    )
 
-            logging.info("Preparing the NetCDF time period.")
-            # Create the time period timestamps
-            year_start = ds.time.dt.year.min().values
-            year_end = ds.time.dt.year.max().values
+                logging.info("Preparing the NetCDF time period.")
+                # Create the time period timestamps
+                year_start = ds.time.dt.year.min().values
+                year_end = ds.time.dt.year.max().values
 
-            # Calculate the time index dimensions of the output NetCDF
-            time_index = pd.date_range(
-                start=f"{year_start}-01-01",
-                end=f"{year_end + 1}-01-01",
-                freq="H" if hourly else "D",
-            )[:-1]
+                # Calculate the time index dimensions of the output NetCDF
+                time_index = pd.date_range(
+                    start=f"{year_start}-01-01",
+                    end=f"{year_end + 1}-01-01",
+                    freq="H" if hourly else "D",
+                )[:-1]
 
-            logging.info(
-                "Number of ECCC stations: {}, time steps: {}.".format(
-                    valid_stations_count, time_index.size
+                logging.info(
+                    "Number of ECCC stations: {}, time steps: {}.".format(
+                        valid_stations_count, time_index.size
+                    )
                 )
-            )
 
-            ds_out = xr.Dataset(
-                coords={
-                    "time": time_index,
-                    "station": ds.station,
-                    "station_id": ds.station_id,
-                },
-                attrs=ds.attrs,
-            )
+                ds_out = xr.Dataset(
+                    coords={
+                        "time": time_index,
+                        "station": ds.station,
+                        "station_id": ds.station_id,
+                    },
+                    attrs=ds.attrs,
+                )
 
-            for vv in ds.data_vars:
-                ds_out[vv] = ds[
-                    vv
-                ]  # assign data variables to output dataset ... will align with time coords
+                for vv in ds.data_vars:
+                    ds_out[vv] = ds[
+                        vv
+                    ]  # assign data variables to output dataset ... will align with time coords
+                    if "flag_values" in ds[vv].attrs:
+                        ds_out[vv] = restore_flag_codes(ds_out[vv])
 
-            output_folder.mkdir(parents=True, exist_ok=True)
+                output_folder.mkdir(parents=True, exist_ok=True)
 
-            file_out = Path(output_folder).joinpath(
-                "{}_eccc_{}".format(
-                    variable_name,
-                    "hourly" if hourly else "daily",
+                file_out = Path(output_folder).joinpath(
+                    "{}_eccc_{}".format(
+                        variable_name,
+                        "hourly" if hourly else "daily",
+                    )
                 )
-            )
 
-            if mf_dataset_freq is not None:
-                _, datasets = zip(
-                    *ds_out.resample(time=mf_dataset_freq)
-                )  # output mf_dataset using resampling frequency
-            else:
-                datasets = [ds_out]
+                if mf_dataset_freq is not None:
+                    _, datasets = zip(
+                        *ds_out.resample(time=mf_dataset_freq)
+                    )  # output mf_dataset using resampling frequency
+                else:
+                    datasets = [ds_out]
 
-            paths = [
-                f"{file_out}_{dd.time.dt.year.min().values}-{dd.time.dt.year.max().values}_"
-                f'created{dt.now().strftime("%Y%m%d")}.nc'
-                for dd in datasets
-            ]
+                paths = [
+                    f"{file_out}_{dd.time.dt.year.min().values}-{dd.time.dt.year.max().values}_"
+                    f'created{dt.now().strftime("%Y%m%d")}.nc'
+                    for dd in datasets
+                ]
 
-            comp = dict(zlib=True, complevel=5)
+                comp = dict(zlib=True, complevel=5)
+                encoding = {var: comp for var in ds_out.data_vars}
 
-            with ProgressBar():
-                for dataset, path in zip(datasets, paths):
-                    encoding = {var: comp for var in ds_out.data_vars}
-                    dataset.to_netcdf(
-                        path,
-                        engine="h5netcdf",
-                        format="NETCDF4",
-                        encoding=encoding,
+                pool = batch_pool(_period_workers(datasets, processes, memory_limit))
+                try:
+                    run_batches(
+                        _write_period,
+                        [(dd, path, encoding) for dd, path in zip(datasets, paths)],
+                        pool,
                     )
-                    dataset.close()
-                    del dataset
-            ds.close()
-            ds_out.close()
+                finally:
+                    if pool is not None:
+                        pool.close()
+                        pool.join()
+                del datasets
+                ds.close()
+                ds_out.close()
+
+                if manifest is not None:
+                    for nc in nclist:
+                        manifest.record(nc, element, paths)
+                    manifest.save()
 
-        else:
-            logging.info("No files found for variable: `%s`." % variable_name)
+            else:
+                logging.info("No files found for variable: `%s`." % variable_name)
+        finally:
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir, ignore_errors=True)
 
     runtime = f"Process completed in {time.time() - func_time:.2f} seconds"
     logging.warning(runtime)
 
 
+def _aggregate_ragged(
+    nclist: List[Path],
+    output_folder: Union[str, Path],
+    inventory: StationInventory,
+    variable_name: str,
+    hourly: bool,
+    include_flags: bool,
+    groups: int,
+    temp_directory: Optional[Union[str, Path]],
+    processes: int,
+    layout: str,
+) -> List[Path]:
+    """Aggregate station files to a CF contiguous or indexed ragged array, returning the file written (if any)."""
+    if not nclist:
+        logging.info("No files found for variable: `%s`." % variable_name)
+        return list()
+
+    station_file_codes = [x.name.split("_")[0] for x in nclist]
+    rejected_stations = inventory.rejected(station_file_codes)
+    keep = inventory.contains(station_file_codes)
+    logging.warning(
+        "Files exist for {} ECCC stations. Metadata found for {} stations. Rejecting {} stations.".format(
+            len(station_file_codes), keep.sum(), len(rejected_stations)
+        )
+    )
+    if rejected_stations:
+        logging.warning(
+            f"Rejected station codes are the following: {', '.join(rejected_stations)}."
+        )
+    # Stations are written in order, as reordering a contiguous ragged array means moving all its observations
+    nclist = [
+        nc for code, nc in sorted(zip(station_file_codes, nclist)) if code in inventory
+    ]
+    if not nclist:
+        logging.error(f"No stations with metadata were found for `{variable_name}`.")
+        return list()
+
+    output_folder = Path(output_folder)
+    output_folder.mkdir(parents=True, exist_ok=True)
+    nclists = [nc for nc in np.array_split(nclist, groups) if len(nc) > 0]
+    with tempfile.TemporaryDirectory(prefix="eccc", dir=temp_directory) as temp_dir:
+        combinations = [
+            (ii, nc, temp_dir, len(nclists)) for ii, nc in enumerate(nclists)
+        ]
+        pool = batch_pool(processes)
+        try:
+            run_batches(_tmp_ragged, combinations, pool)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        ds = _combine_ragged(sorted(Path(temp_dir).glob("*.nc")))
+        # dask gives warnings about export 'object' data types
+        ds["station_id"] = ds["station_id"].astype(str)
+        if not include_flags:
+            ds = ds.drop_vars([vv for vv in ds.data_vars if "flag" in vv])
+
+        logging.info("Writing metdata.")
+        columns, rename = inventory.eccc_columns()
+        ds = inventory.join(ds, columns=columns, rename=rename)
+        if layout == "indexed":
+            ds = _contiguous_to_indexed(ds)
+        ds = _ragged_attributes(ds)
+
+        logging.info(
+            "Number of ECCC stations: {}, observations: {}.".format(
+                ds.station.size, ds.obs.size
+            )
+        )
+        years = ds.time.dt.year
+        path = output_folder.joinpath(
+            f"{variable_name}_eccc_{'hourly' if hourly else 'daily'}_"
+            f"{years.min().values}-{years.max().values}_"
+            f'created{dt.now().strftime("%Y%m%d")}.nc'
+        )
+        comp = dict(zlib=True, complevel=5)
+        encoding = {var: comp for var in ds.data_vars if "obs" in ds[var].dims}
+        with ProgressBar():
+            ds.to_netcdf(path, engine="h5netcdf", format="NETCDF4", encoding=encoding)
+        ds.close()
+    return [path]
+
+
+# Peak memory of a block of stations being written, relative to the size of its loaded arrays
+_BLOCK_OVERHEAD = 2
+
+
+def _batch_workers(
+    nclists: List[np.ndarray],
+    processes: int,
+    memory_limit: Optional[Union[int, str]] = None,
+) -> Tuple[int, Optional[int]]:
+    """Number of file batches processed concurrently, and the memory ceiling of each batch, within the memory budget."""
+    if memory_limit is None:
+        return processes, None
+    if isinstance(memory_limit, str):
+        memory_limit = parse_bytes(memory_limit)
+
+    # Estimate the footprint of a station from the lazily opened files of the largest batch
+    largest = max(nclists, key=len)
+    with xr.open_mfdataset(largest, combine="nested", concat_dim="station") as ds:
+        station_size = ds.nbytes / ds.station.size
+
+    # Every batch must at least be able to hold a block of one station
+    workers = int(
+        max(1, min(processes, memory_limit // max(_BLOCK_OVERHEAD * station_size, 1)))
+    )
+    logging.info(
+        f"Estimated {station_size / 2**20:.1f} MiB per station. Processing {workers} batch(es) at once."
+    )
+    return workers, memory_limit // workers
+
+
+def _period_workers(
+    datasets: List[xr.Dataset],
+    processes: int,
+    memory_limit: Optional[Union[int, str]] = None,
+) -> int:
+    """Number of period files written concurrently, within the memory budget."""
+    if memory_limit is None or len(datasets) < 2:
+        return min(processes, len(datasets))
+    if isinstance(memory_limit, str):
+        memory_limit = parse_bytes(memory_limit)
+
+    period_size = max(dd.nbytes for dd in datasets)
+    workers = int(
+        max(1, min(processes, memory_limit // max(_BLOCK_OVERHEAD * period_size, 1)))
+    )
+    logging.info(
+        f"Estimated {period_size / 2**20:.1f} MiB per period. Writing {workers} file(s) at once."
+    )
+    return workers
+
+
+def _write_period(
+    ds: xr.Dataset, path: Union[str, Path], encoding: Dict[str, dict]
+) -> None:
+    """Write the file of a period of the aggregated stations, compressing it in the calling process."""
+    logging.info(f"Writing {Path(path).name}.")
+    with ProgressBar():
+        ds.to_netcdf(path, engine="h5netcdf", format="NETCDF4", encoding=encoding)
+    ds.close()
+
+
+def _merge_tmp_nc(
+    ii: int, nc: List[Path], tempdir: Union[str, Path], level: int
+) -> Path:
+    """Concatenate batch files along stations, replacing them with a single file."""
+    if len(nc) == 1:
+        return nc[0]
+
+    logging.info(f"Merging {len(nc)} batch files (round {level}, group {ii + 1}).")
+    outfile = Path(tempdir).joinpath(f"merged{level}_{str(ii).zfill(3)}.nc")
+
+    with xr.open_mfdataset(nc, combine="nested", concat_dim="station") as ds:
+        if "flag" in ds and "flag_values" in ds.flag.attrs:
+            ds["flag"] = restore_flag_codes(ds.flag)
+        comp = dict(zlib=True, complevel=5)
+        encoding = {var: comp for var in ds.data_vars}
+        ds.to_netcdf(
+            outfile,
+            engine="h5netcdf",
+            format="NETCDF4",
+            encoding=encoding,
+        )
+    for f in nc:
+        f.unlink()
+    return outfile
+
+
+def _reduce_tmp_nc(
+    tempdir: Union[str, Path],
+    fan_in: int,
+    pool: Optional[multiprocessing.pool.Pool] = None,
+) -> List[Path]:
+    """Merge batch files in rounds of `fan_in` files until at most `fan_in` files remain."""
+    fan_in = max(fan_in, 2)
+    tmp_files = sorted(Path(tempdir).glob("*.nc"))
+    level = 0
+    while len(tmp_files) > fan_in:
+        level += 1
+        file_groups = [
+            tmp_files[i : i + fan_in] for i in range(0, len(tmp_files), fan_in)
+        ]
+        combinations = [(ii, nc, tempdir, level) for ii, nc in enumerate(file_groups)]
+        tmp_files = run_batches(_merge_tmp_nc, combinations, pool)
+    return tmp_files
+
+
 def _tmp_nc(
     ii: int,
     nc: Union[str, Path],
     tempdir: Union[str, Path],
     batches: Optional[int] = None,
+    memory_ceiling: Optional[int] = None,
 ) -> None:
+    """Concatenate a batch of station files, writing blocks of stations that fit within the memory ceiling.
+
+    A batch written in many blocks produces one file per block, numbered after the batch.
+    """
     if batches is None:
         batches = "X"
     logging.info(f"Processing batch of files {ii + 1} of {batches}")
@@ -709,26 +1512,154 @@ def _tmp_nc(
     )
     if "flag" in ds.data_vars:
         ds1 = ds.drop_vars("flag").copy(deep=True)
-        ds1["flag"] = ds.flag.astype(str)
+        if "flag_values" in ds.flag.attrs:
+            ds1["flag"] = restore_flag_codes(ds.flag)
+        else:
+            ds1["flag"] = ds.flag.astype(str)
         ds = ds1
 
+    stations = ds.station.size
+    block = stations
+    if memory_ceiling is not None:
+        station_size = ds.nbytes / stations
+        block = int(max(1, memory_ceiling // (_BLOCK_OVERHEAD * station_size)))
+    starts = range(0, stations, block)
+
     comp = dict(zlib=True, complevel=5)
     encoding = {var: comp for var in ds.data_vars}
 
+    for part, start in enumerate(starts):
+        if len(starts) == 1:
+            outfile = Path(tempdir).joinpath(f"{str(ii).zfill(3)}.nc")
+        else:
+            logging.info(
+                f"Writing stations {start + 1} to {min(start + block, stations)} of {stations}."
+            )
+            outfile = Path(tempdir).joinpath(
+                f"{str(ii).zfill(3)}_{str(part).zfill(3)}.nc"
+            )
+
+        with ProgressBar():
+            ds.isel(station=slice(start, start + block)).load().to_netcdf(
+                outfile,
+                engine="h5netcdf",
+                format="NETCDF4",
+                encoding=encoding,
+            )
+    ds.close()
+    del ds
+
+
+def _merged_outputs(output_folder: Path, prefix: str, varia: str) -> List[Path]:
+    """Merged files of a station already found in the output folder, named after their years."""
+    return sorted(
+        f
+        for f in output_folder.glob(f"{prefix}_{varia}_*.nc")
+        if re.fullmatch(r"\d{4}-\d{4}", f.stem[len(f"{prefix}_{varia}_") :])
+    )
+
+
+def _merged_name(prefix: str, varia: str, ds: xr.Dataset) -> str:
+    return (
+        f"{prefix}_{varia}_"
+        f"{ds.time.dt.year.min().values}-{ds.time.dt.year.max().values}.nc"
+    )
+
+
+def _write_merged(ds: xr.Dataset, outfile: Path) -> None:
+    comp = dict(zlib=True, complevel=5)
+    encoding = {data_var: comp for data_var in ds.data_vars}
+    encoding["time"] = {"dtype": "single"}
     with ProgressBar():
-        ds.load().to_netcdf(
-            Path(tempdir).joinpath(f"{str(ii).zfill(3)}.nc"),
-            engine="h5netcdf",
-            format="NETCDF4",
-            encoding=encoding,
+        ds.to_netcdf(outfile, encoding=encoding)
+
+
+def _open_station_files(ncfiles: List[Path], varia: str) -> xr.Dataset:
+    """Join the files of a station along time, with a single value per time step.
+
+    The per-source files of a station overlap when the same period is found in several source files. A time step
+    found in many files takes the value and flag of the last of these files (in order of file names) where the
+    value is not missing.
+    """
+    datasets = list()
+    for nc in ncfiles:
+        with xr.open_dataset(nc) as ds:
+            datasets.append(ds.load())
+    ds = xr.concat(datasets, dim="time", combine_attrs="override")
+
+    rank = np.concatenate([np.full(d.time.size, i) for i, d in enumerate(datasets)])
+    valid = ds[varia].notnull().values
+    order = np.lexsort((rank, valid, ds.time.values))
+    times = ds.time.values[order]
+    last = np.append(times[1:] != times[:-1], True)
+    if not last.all():
+        logging.info(
+            f"{(~last).sum()} time steps found in more than one file of station {ncfiles[0].parent.name}."
+        )
+    return ds.isel(time=order[last])
+
+
+def _combine_years(
+    varia: str,
+    input_folder: Path,
+    output_folder: Path,
+    incremental: bool = False,
+) -> Optional[Path]:
+    """Merge the files of a station along time, returning the merged file if it was written.
+
+    In incremental mode, a station already merged is merged again when any of its files was written after its
+    merged file, so that new, revised and backfilled periods are all taken into account. Other stations are skipped.
+    """
+    ncfiles = sorted(list(input_folder.glob("*.nc")))
+    logging.info(f"Found {len(ncfiles)} files for station code {input_folder.name}.")
+
+    prefix = ncfiles[0].name.split(f"_{varia}_")[0]
+    existing = _merged_outputs(output_folder, prefix, varia)
+    if existing and not incremental:
+        logging.info(f"Files exist for {existing[-1].name}. Continuing...")
+        return
+
+    if existing:
+        merged_at = existing[-1].stat().st_mtime_ns
+        changed = [nc for nc in ncfiles if nc.stat().st_mtime_ns > merged_at]
+        if not changed:
+            logging.info(f"{existing[-1].name} is up to date. Continuing...")
+            return
+        logging.info(
+            f"{len(changed)} files changed since {existing[-1].name} was merged. Merging again..."
         )
-        del ds
+
+    logging.info(f"Opening: {ncfiles}")
+    ds = _open_station_files(ncfiles, varia)
+    outfile = output_folder.joinpath(_merged_name(prefix, varia, ds))
+    logging.info(f"Merging to {outfile.name}")
+
+    # Previous merged files are only replaced once the new one is complete
+    tmpfile = outfile.with_suffix(".nc.tmp")
+    _write_merged(ds, tmpfile)
+    ds.close()
+    for f in existing:
+        f.unlink()
+    tmpfile.rename(outfile)
+    return outfile
+
+
+def _combine_station(
+    varia: str, input_folder: Path, output_folder: Path, incremental: bool
+) -> Optional[str]:
+    """Merge the files of a station, returning the error encountered, if any."""
+    try:
+        _combine_years(varia, input_folder, output_folder, incremental)
+    except ValueError as e:
+        return str(e)
 
 
 def merge_converted_variables(
     source: Union[str, Path],
     destination: Union[str, Path],
     variables: Optional[Union[str, int, List[Union[str, int]]]] = None,
+    processes: int = 1,
+    incremental: bool = False,
 ) -> None:
     """
 
@@ -737,39 +1668,21 @@ def merge_converted_variables(
     source : Union[str, Path]
     destination : Union[str, Path]
     variables : Optional[Union[str, int, List[Union[str, int]]]]
+    processes : int
+      Number of stations merged concurrently. Default: 1.
+    incremental : bool
+      Merge again the stations with source files written since their merged file, rather than skipping all the
+      stations that were already merged. Default: False.
 
     Returns
     -------
 
+    Notes
+    -----
+    A station period found in several source files is converted to one file per source file. Time steps found in
+    many of these files take the value and flag of the last file (in order of file names) where the value is not
+    missing.
     """
-
-    def _combine_years(args: Tuple[str, Union[str, Path], Union[str, Path]]) -> None:
-        varia, input_folder, output_folder = args
-
-        ncfiles = sorted(list(input_folder.glob("*.nc")))
-        logging.info(
-            f"Found {len(ncfiles)} files for station code {input_folder.name}."
-        )
-        logging.info(f"Opening: {ncfiles}")
-
-        ds = xr.open_mfdataset(
-            ncfiles, parallel=False, combine="by_coords", concat_dim={"time"}
-        )
-
-        outfile = output_folder.joinpath(
-            f'{ncfiles[0].name.split(f"_{varia}_")[0]}_{varia}_'
-            f"{ds.time.dt.year.min().values}-{ds.time.dt.year.max().values}.nc"
-        )
-        if not outfile.exists():
-            logging.info(f"Merging to {outfile.name}")
-            comp = dict(zlib=True, complevel=5)
-            encoding = {data_var: comp for data_var in ds.data_vars}
-            encoding["time"] = {"dtype": "single"}
-            with ProgressBar():
-                ds.to_netcdf(outfile, encoding=encoding)
-        else:
-            logging.info(f"Files exist for {outfile.name}. Continuing...")
-
     if isinstance(source, str):
         source = Path(source)
     if isinstance(destination, str):
@@ -783,7 +1696,7 @@ def merge_converted_variables(
             try:
                 selected_variables.append(cf_hourly_metadata(var))
             except KeyError:
-                selected_variables.append(cf_hourly_metadata(var))
+                selected_variables.append(cf_daily_metadata(var))
 
     variables_found = [x.name for x in source.iterdir() if x.is_dir()]
     if selected_variables:
@@ -793,18 +1706,27 @@ def merge_converted_variables(
             if x in [item["nc_name"] for item in selected_variables]
         ]
 
-    for variable in variables_found:
-        logging.info(f"Merging files found for variable: `{variable}`.")
-        station_dirs = [x for x in source.joinpath(variable).iterdir() if x.is_dir()]
-        logging.info(f"Number of stations found: {len(station_dirs)}.")
-        outrep = destination.joinpath(variable)
+    pool = batch_pool(processes)
+    try:
+        for variable in variables_found:
+            logging.info(f"Merging files found for variable: `{variable}`.")
+            station_dirs = [
+                x for x in source.joinpath(variable).iterdir() if x.is_dir()
+            ]
+            logging.info(f"Number of stations found: {len(station_dirs)}.")
+            outrep = destination.joinpath(variable)
 
-        Path(outrep).mkdir(parents=True, exist_ok=True)
-        combs = list(itertools.product(*[[variable], station_dirs, [outrep]]))
-        for c in combs:
-            try:
-                _combine_years(c)
-            except ValueError as e:
-                logging.error(
-                    f"`{e}` encountered for station `{c[1].name}`. Continuing..."
-                )
+            Path(outrep).mkdir(parents=True, exist_ok=True)
+            combs = list(
+                itertools.product(*[[variable], station_dirs, [outrep], [incremental]])
+            )
+            errors = run_batches(_combine_station, combs, pool)
+            for c, e in zip(combs, errors):
+                if e is not None:
+                    logging.error(
+                        f"`{e}` encountered for station `{c[1].name}`. Continuing..."
+                    )
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
@@ -11,20 +11,29 @@
 # "Max Temp (°C)" is renamed "tasmax" and converted to °K.
 #
 #####################################################################
+import io
 import json
 import logging
 from logging import config
+from multiprocessing.pool import ThreadPool
 from pathlib import Path
-from typing import Generator, List, Tuple, Union
+from typing import Generator, List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
 import xarray as xr
 
+from miranda._parallel import batch_pool, run_batches
 from miranda.scripting import LOGGING_CONFIG
 
+from ._flags import encode_flags, flag_attributes
+
 config.dictConfig(LOGGING_CONFIG)
-__all__ = ["extract_daily_summaries", "daily_summaries_to_netcdf"]
+__all__ = [
+    "aggregate_daily_summaries",
+    "extract_daily_summaries",
+    "daily_summaries_to_netcdf",
+]
 
 eccc_metadata = json.load(
     open(Path(__file__).parent / "eccc_obs_summary_cf_attrs.json")
@@ -33,7 +42,10 @@ eccc_metadata = json.load(
 
 # Searches a location for the station data, then calls the needed scripts to read and assembles the data using pandas
 def extract_daily_summaries(
-    path_station: Union[Path, str], rm_flags: bool = False, file_suffix: str = ".csv"
+    path_station: Union[Path, str],
+    rm_flags: bool = False,
+    file_suffix: str = ".csv",
+    threads: int = 1,
 ) -> dict:
     """
 
@@ -45,6 +57,9 @@ def extract_daily_summaries(
       Removes the 'Flag' and 'Quality' columns of the ECCC files.
     file_suffix : str
       File suffixes used by the tabular data. Default: ".csv".
+    threads : int
+      Number of files parsed concurrently. Default: 1.
+
     Returns
     -------
     dict
@@ -57,13 +72,17 @@ def extract_daily_summaries(
     station_files = Path(path_station).rglob(file_suffix)
 
     # extract the .csv data
-    station = _read_multiple_daily_summaries(station_files, rm_flags=rm_flags)
+    station = _read_multiple_daily_summaries(
+        station_files, rm_flags=rm_flags, threads=threads
+    )
 
     return station
 
 
 # Uses xarray to transform the 'station' from find_and_extract_dly into a CF-Convention netCDF file
-def daily_summaries_to_netcdf(station: dict, path_output: Union[Path, str]) -> None:
+def daily_summaries_to_netcdf(
+    station: dict, path_output: Union[Path, str], flag_codes: bool = False
+) -> None:
     """
 
     Parameters
@@ -71,6 +90,9 @@ def daily_summaries_to_netcdf(station: dict, path_output: Union[Path, str]) -> N
     station : dict
       dict created by using find_and_extract_dly
     path_output: Union[Path, str]
+    flag_codes: bool
+      Also write the flags of the variables, as uint8 codes with CF `flag_values` / `flag_meanings` attributes.
+      Default: False.
 
     Returns
     -------
@@ -91,7 +113,7 @@ def daily_summaries_to_netcdf(station: dict, path_output: Union[Path, str]) -> N
 
     ds = None
 
-    variables = eccc_metadata["variable_entry"]
+    variables = eccc_metadata
     for var in variables.keys():
         original_field = variables[var]["original_field"]
         add_offset = variables[var]["add_offset"]
@@ -128,6 +150,16 @@ def daily_summaries_to_netcdf(station: dict, path_output: Union[Path, str]) -> N
         else:
             ds[var] = da
 
+        # the flags of "Max Temp (°C)" are found in "Max Temp Flag"
+        flag_field = f"{original_field.split(' (')[0]} Flag"
+        if flag_codes and flag_field in station["data"].columns:
+            codes = encode_flags(station["data"][flag_field].to_numpy())
+            ds[f"{var}_flag"] = da.copy(data=codes[:, np.newaxis, np.newaxis])
+            ds[f"{var}_flag"].attrs = dict(
+                long_name=f"{variables[var]['long_name']} flag",
+                **flag_attributes(codes),
+            )
+
     # add attributes to lon, lat, time, elevation, and the grid
     # TODO: There is probably a better CF Convention for point-based data
     da = xr.DataArray(np.full(len(time), np.nan), [("time", time)])
@@ -136,7 +168,7 @@ def daily_summaries_to_netcdf(station: dict, path_output: Union[Path, str]) -> N
     ds["regular_lon_lat"] = da
 
     da = xr.DataArray(
-        np.expand_dims(np.expand_dims(station["elevation"], axis=1), axis=2),
+        np.expand_dims(np.expand_dims(station["elevation"], axis=0), axis=1),
         [("lat", [station["latitude"]]), ("lon", [station["longitude"]])],
     )
     da.name = "elevation"
@@ -176,15 +208,192 @@ def daily_summaries_to_netcdf(station: dict, path_output: Union[Path, str]) -> N
     ds.to_netcdf(output_file)
 
 
+def _read_station_summaries(
+    path_station: Path, file_suffix: str, flag_codes: bool
+) -> Optional[dict]:
+    """Read the daily summaries of a station, keeping only the columns that are converted."""
+    try:
+        station = extract_daily_summaries(
+            path_station, rm_flags=not flag_codes, file_suffix=file_suffix
+        )
+    except (FileNotFoundError, ValueError) as e:
+        logging.error(
+            f"`{e}` encountered for station folder `{path_station.name}`. Continuing..."
+        )
+        return None
+
+    fields = {entry["original_field"] for entry in eccc_metadata.values()}
+    if flag_codes:
+        fields |= {f"{field.split(' (')[0]} Flag" for field in fields}
+    data = station["data"]
+    station["data"] = data[["Date/Time"] + [c for c in data.columns if c in fields]]
+    return station
+
+
+# Converts the stations found in a folder (one sub-folder per station) into a single netCDF file
+def aggregate_daily_summaries(
+    path_stations: Union[Path, str],
+    path_output: Union[Path, str],
+    file_suffix: str = ".csv",
+    processes: int = 1,
+    flag_codes: bool = False,
+) -> Optional[Path]:
+    """Convert the daily summaries of many stations to a single netCDF file, along a "station" dimension.
+
+    Parameters
+    ----------
+    path_stations : Union[Path, str]
+      Folder holding a sub-folder of csv files per station.
+    path_output : Union[Path, str]
+    file_suffix : str
+      File suffixes used by the tabular data. Default: ".csv".
+    processes : int
+      Number of stations read concurrently. Default: 1.
+    flag_codes : bool
+      Also write the flags of the variables, as uint8 codes with CF `flag_values` / `flag_meanings` attributes.
+      Default: False.
+
+    Returns
+    -------
+    Path, optional
+      The netCDF file written, or None if no station could be read.
+    """
+    if "*" not in file_suffix:
+        file_suffix = f"*{file_suffix}"
+    station_folders = sorted(x for x in Path(path_stations).iterdir() if x.is_dir())
+    logging.info(f"Number of station folders found: {len(station_folders)}.")
+
+    pool = batch_pool(processes)
+    try:
+        stations = run_batches(
+            _read_station_summaries,
+            [(folder, file_suffix, flag_codes) for folder in station_folders],
+            pool,
+        )
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    stations = sorted((s for s in stations if s is not None), key=lambda s: s["ID"])
+    if not stations:
+        logging.error(f"No daily summaries found in {path_stations}.")
+        return None
+
+    # Place the observations of all stations on a (station, time) grid at once
+    data = pd.concat([s["data"] for s in stations], ignore_index=True)
+    rows = np.repeat(np.arange(len(stations)), [len(s["data"]) for s in stations])
+    dates = data["Date/Time"].to_numpy()
+    time = pd.date_range(dates.min(), dates.max(), freq="D")
+    columns = time.get_indexer(dates)
+    shape = (len(stations), time.size)
+
+    ds = xr.Dataset(coords=dict(time=time))
+    for var, entry in eccc_metadata.items():
+        original_field = entry["original_field"]
+        values = np.full(shape, np.nan)
+        if original_field in data.columns:
+            field = pd.to_numeric(data[original_field], errors="coerce").to_numpy()
+            values[rows, columns] = field * entry["scale_factor"] + entry["add_offset"]
+        attrs = {
+            key: entry[key]
+            for key in [
+                "standard_name",
+                "long_name",
+                "units",
+                "comments",
+                "frequency",
+            ]
+        }
+        ds[var] = xr.DataArray(values, dims=("station", "time"), attrs=attrs)
+
+        flag_field = f"{original_field.split(' (')[0]} Flag"
+        if flag_codes and flag_field in data.columns:
+            codes = np.zeros(shape, dtype=np.uint8)
+            codes[rows, columns] = encode_flags(data[flag_field].to_numpy())
+            ds[f"{var}_flag"] = xr.DataArray(
+                codes,
+                dims=("station", "time"),
+                attrs=dict(
+                    long_name=f"{entry['long_name']} flag", **flag_attributes(codes)
+                ),
+            )
+
+    # Station metadata
+    meta = {key: [s[key] for s in stations] for key in stations[0] if key != "data"}
+    ds = ds.assign_coords(
+        station_id=(
+            "station",
+            np.array(meta["ID"], dtype=str),
+            dict(long_name="Climate Identifier", cf_role="timeseries_id"),
+        ),
+        station_name=(
+            "station",
+            np.array(meta["name"], dtype=str),
+            dict(long_name="Station Name"),
+        ),
+        province=(
+            "station",
+            np.array(meta["province"], dtype=str),
+            dict(long_name="Province"),
+        ),
+        wmo_id=(
+            "station",
+            np.array(meta["WMO_ID"], dtype=str),
+            dict(long_name="WMO Identifier"),
+        ),
+        tc_id=(
+            "station",
+            np.array(meta["TC_ID"], dtype=str),
+            dict(long_name="TC Identifier"),
+        ),
+        lat=(
+            "station",
+            np.array(meta["latitude"]),
+            dict(standard_name="latitude", long_name="latitude", units="degrees_north"),
+        ),
+        lon=(
+            "station",
+            np.array(meta["longitude"]),
+            dict(
+                standard_name="longitude", long_name="longitude", units="degrees_east"
+            ),
+        ),
+        elevation=(
+            "station",
+            np.array(meta["elevation"]),
+            dict(standard_name="elevation", long_name="elevation", units="m", axis="Z"),
+        ),
+    )
+
+    ds.time.attrs["standard_name"] = "time"
+    ds.time.attrs["long_name"] = "time"
+    ds.time.attrs["axis"] = "T"
+    ds.time.encoding["units"] = "days since 1950-01-01 00:00:00"
+    ds.time.encoding["calendar"] = "gregorian"
+
+    ds.attrs["featureType"] = "timeSeries"
+    ds.attrs["Institution"] = "Environment and Climate Change Canada"
+
+    # save the data
+    Path(path_output).mkdir(parents=True, exist_ok=True)
+    output_file = Path(path_output).joinpath(
+        f"daily_summaries_eccc_{time.year.min()}-{time.year.max()}.nc"
+    )
+    comp = dict(zlib=True, complevel=5)
+    ds.to_netcdf(output_file, encoding={var: comp for var in ds.data_vars})
+    return output_file
+
+
 ##########################################
 # BELOW THIS POINT ARE UTILITY SCRIPTS
 ##########################################
 
 
-# This calls _read_single_eccc_dly and appends the data in a single Dict
+# This calls _read_single_daily_summaries on every file and concatenates the data in a single Dict
 def _read_multiple_daily_summaries(
     files: Union[List[Union[str, Path]], Generator[Path, None, None]],
     rm_flags: bool = False,
+    threads: int = 1,
 ) -> dict:
     """
 
@@ -194,37 +403,36 @@ def _read_multiple_daily_summaries(
       A list of all the files to append.
     rm_flags : bool
       Removes all the 'Flag' and 'Quality' columns of the ECCC files. Default: False.
+    threads : int
+      Number of files parsed concurrently. Default: 1.
 
     Returns
     -------
     dict
     """
-
-    # Extract the data for each files
-    station_meta = None
-    datafull = None
-
     file_list = [Path(f) for f in files]
     file_list.sort()
-
-    for f in file_list:
-        station_meta, data = _read_single_daily_summaries(f)
-        if datafull is None:
-            datafull = data
-        else:
-            datafull = datafull.append(data, ignore_index=True)
+    if not file_list:
+        raise FileNotFoundError("No daily summaries files found.")
+
+    # Extract the data for each files, then concatenate them once
+    if threads > 1 and len(file_list) > 1:
+        with ThreadPool(processes=threads) as pool:
+            results = pool.map(_read_single_daily_summaries, file_list)
+    else:
+        results = [_read_single_daily_summaries(f) for f in file_list]
+    station_meta = results[-1][0]
+    datafull = pd.concat([data for _, data in results], ignore_index=True)
 
     # change the Date/Time column to a datetime64 type
     datafull["Date/Time"] = pd.to_datetime(datafull["Date/Time"])
 
     # if wanted, remove the quality and flag columns
     if rm_flags:
-        index_quality = [
-            i for i, s in enumerate(datafull.columns.values) if "Quality" in s
-        ]
-        datafull = datafull.drop(datafull.columns.values[index_quality], axis="columns")
-        index_flag = [i for i, s in enumerate(datafull.columns.values) if "Flag" in s]
-        datafull = datafull.drop(datafull.columns.values[index_flag], axis="columns")
+        datafull = datafull.drop(
+            [c for c in datafull.columns if "Quality" in c or "Flag" in c],
+            axis="columns",
+        )
 
     # combine everything in a single Dict
     station = station_meta
@@ -233,6 +441,19 @@ def _read_multiple_daily_summaries(
     return station
 
 
+# Header lines holding the station metadata, along with their keys in the metadata Dict
+_SUMMARY_HEADERS = {
+    "Station Name": "name",
+    "Province": "province",
+    "Latitude": "latitude",
+    "Longitude": "longitude",
+    "Elevation": "elevation",
+    "Climate Identifier": "ID",
+    "WMO Identifier": "WMO_ID",
+    "TC Identifier": "TC_ID",
+}
+
+
 # This is the script that actually reads the CSV files.
 # The metadata are saved in a Dict, while the data is returned as a pandas Dataframe.
 # FIXME: Climate Services Canada has changed the way they store metadata -- No longer in CSV heading
@@ -247,60 +468,38 @@ def _read_single_daily_summaries(file: Union[Path, str]) -> Tuple[dict, pd.DataF
     -------
     Tuple[dict, pd.DataFrame]
     """
-    # Read the whole file
+    # Read the whole file once; the data is parsed from the same buffer, after the header
     with open(file, encoding="utf-8-sig") as fi:
-        lines = fi.readlines()
-
-    # Find each elements in the header
-    search_header = [0] * 9
-    search_header[0] = [i for i, s in enumerate(lines) if "Station Name" in s][0]
-    search_header[1] = [i for i, s in enumerate(lines) if "Province" in s][0]
-    search_header[2] = [i for i, s in enumerate(lines) if "Latitude" in s][0]
-    search_header[3] = [i for i, s in enumerate(lines) if "Longitude" in s][0]
-    search_header[4] = [i for i, s in enumerate(lines) if "Elevation" in s][0]
-    search_header[5] = [i for i, s in enumerate(lines) if "Climate Identifier" in s][0]
-    search_header[6] = [i for i, s in enumerate(lines) if "WMO Identifier" in s][0]
-    search_header[7] = [i for i, s in enumerate(lines) if "TC Identifier" in s][0]
-    search_header[8] = [i for i, s in enumerate(lines) if "Date/Time" in s][
-        0
-    ]  # This is where the data actually starts
-
-    # Does a bunch of stuff, but basically finds the right line, then cleans up the string
-    station_meta = {
-        "name": lines[search_header[0]]
-        .split(",")[1]
-        .replace('"', "")
-        .replace("\n", ""),
-        "province": lines[search_header[1]]
-        .split(",")[1]
-        .replace('"', "")
-        .replace("\n", ""),
-        "latitude": float(
-            lines[search_header[2]].split(",")[1].replace('"', "").replace("\n", "")
-        ),
-        "longitude": float(
-            lines[search_header[3]].split(",")[1].replace('"', "").replace("\n", "")
-        ),
-        "elevation": float(
-            lines[search_header[4]].split(",")[1].replace('"', "").replace("\n", "")
-        ),
-        "ID": lines[search_header[5]].split(",")[1].replace('"', "").replace("\n", ""),
-        "WMO_ID": lines[search_header[6]]
-        .split(",")[1]
-        .replace('"', "")
-        .replace("\n", ""),
-        "TC_ID": lines[search_header[7]]
-        .split(",")[1]
-        .replace('"', "")
-        .replace("\n", ""),
-    }
-
-    data = pd.read_csv(file, header=search_header[8] - 2)
+        text = fi.read()
+
+    # Find each element of the header in a single pass, up to the line where the data actually starts
+    station_meta = dict()
+    offset = 0
+    while True:
+        end = text.find("\n", offset)
+        line = text[offset:] if end < 0 else text[offset:end]
+        if "Date/Time" in line:
+            break
+        if end < 0:
+            raise ValueError(f"No data found in {file}.")
+        for header, key in _SUMMARY_HEADERS.items():
+            if key not in station_meta and header in line:
+                station_meta[key] = line.split(",")[1].replace('"', "")
+        offset = end + 1
+
+    missing = [h for h, key in _SUMMARY_HEADERS.items() if key not in station_meta]
+    if missing:
+        raise ValueError(f"Header line(s) {', '.join(missing)} not found in {file}.")
+    station_meta = {key: station_meta[key] for key in _SUMMARY_HEADERS.values()}
+    for key in ["latitude", "longitude", "elevation"]:
+        station_meta[key] = float(station_meta[key])
+
+    data = pd.read_csv(io.StringIO(text[offset:]))
     # Makes sure that the data starts on Jan 1st
-    if data.values[0, 2] != 1 | data.values[0, 3] != 1:
+    if data.values[0, 2] != 1 or data.values[0, 3] != 1:
         logging.warning(
             "Data for file {} is not starting on January 1st. Make sure this is what you want!".format(
-                file.name
+                Path(file).name
             )
         )
 
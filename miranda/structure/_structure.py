@@ -157,6 +157,7 @@ def structure_datasets(
     method: str = "copy",
     make_dirs: bool = False,
     filename_pattern: str = "*.nc",
+    cache: Optional[Union[str, os.PathLike]] = None,
 ) -> Mapping[Path, Path]:
     """
 
@@ -176,6 +177,8 @@ def structure_datasets(
     filename_pattern: str
       If pattern ends with "zarr", will 'glob' with provided pattern.
       Otherwise, will perform an 'rglob' (recursive) operation.
+    cache: str or Path, optional
+      SQLite file of a facet cache, so that only the files that are new or changed since a previous call are decoded.
 
     Returns
     -------
@@ -187,14 +190,14 @@ def structure_datasets(
         for f in input_files:
             project = guess_project(f)
             decoder = Decoder(project)
-            decoder.decode(f)
+            decoder.decode(f, cache=cache)
             break
         else:
             raise FileNotFoundError()
-        decoder.decode(input_files)
+        decoder.decode(input_files, cache=cache)
     else:
         decoder = Decoder(project)
-        decoder.decode(input_files)
+        decoder.decode(input_files, cache=cache)
 
     all_file_paths = dict()
     for file, facets in decoder.file_facets().items():
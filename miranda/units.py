@@ -1,5 +1,9 @@
+import contextlib
+import functools
 import re
+from typing import Optional, Tuple, Union
 
+import numpy as np
 import pint
 
 u = pint.UnitRegistry(autoconvert_offset_to_baseunit=True)
@@ -41,9 +45,12 @@ u.add_context(hq)
 u.enable_contexts(hq)
 
 
+@functools.lru_cache(maxsize=None)
 def units2pint(value: str) -> u.Unit:
     """Return the pint Unit for the DataArray units.
 
+    Parsed expressions are cached, as pint Units are immutable.
+
     Parameters
     ----------
     value : str
@@ -70,6 +77,84 @@ def units2pint(value: str) -> u.Unit:
         return u.parse_expression(_transform(value)).units
 
 
+@functools.lru_cache(maxsize=None)
+def conversion_factors(
+    source: Union[str, u.Unit],
+    target: Union[str, u.Unit],
+    context: Optional[str] = None,
+) -> Tuple[float, float]:
+    """Return the scale and offset converting values from source to target units.
+
+    Parameters
+    ----------
+    source : Union[str, pint.Unit]
+      Units of the values. Strings are parsed with `units2pint`.
+    target : Union[str, pint.Unit]
+      Units to convert to.
+    context : str, optional
+      Name of a pint context to convert within, in addition to the enabled ones.
+
+    Returns
+    -------
+    float
+      Scale of the conversion.
+    float
+      Offset of the conversion, such that `target = source * scale + offset`.
+
+    Notes
+    -----
+    pint is only queried once for every (source, target, context), the factors being cached afterwards.
+    """
+    source = units2pint(source) if isinstance(source, str) else source
+    target = units2pint(target) if isinstance(target, str) else target
+
+    with u.context(context) if context else contextlib.nullcontext():
+        zero = u.Quantity(0.0, source)
+        offset = zero.to(target).magnitude
+        # Differences of offset units (e.g. degC) are converted to differences of the target units, exactly
+        delta = (u.Quantity(1.0, target) - u.Quantity(0.0, target)).units
+        scale = (u.Quantity(1.0, source) - zero).to(delta).magnitude
+        check = u.Quantity(-40.0, source).to(target).magnitude
+
+    if not np.isclose(check, offset - 40 * scale, rtol=1e-12, atol=1e-12):
+        raise ValueError(f"Conversion from {source} to {target} is not affine.")
+    return float(scale), float(offset)
+
+
+def convert_units(
+    values: Union[float, np.ndarray],
+    source: Union[str, u.Unit],
+    target: Union[str, u.Unit],
+    context: Optional[str] = None,
+) -> Union[float, np.ndarray]:
+    """Convert values from source to target units, with cached conversion factors.
+
+    Parameters
+    ----------
+    values : Union[float, np.ndarray]
+      Values to convert. Floating point arrays are converted in place.
+    source : Union[str, pint.Unit]
+    target : Union[str, pint.Unit]
+    context : str, optional
+      Name of a pint context to convert within, in addition to the enabled ones.
+
+    Returns
+    -------
+    Union[float, np.ndarray]
+      The converted values: the same array for floating point arrays, a new one for others, or a float for scalars.
+    """
+    scale, offset = conversion_factors(source, target, context)
+    if np.ndim(values) == 0:
+        return float(values) * scale + offset
+    if not (isinstance(values, np.ndarray) and values.dtype.kind == "f"):
+        values = np.asarray(values, dtype=float)
+    if scale != 1:
+        values *= scale
+    if offset != 0:
+        values += offset
+    return values
+
+
 KiB = int(pow(2, 10))
 MiB = int(pow(2, 20))
 GiB = int(pow(2, 30))
@@ -0,0 +1,157 @@
+import numpy as np
+import pytest  # noqa
+
+from miranda.convert import deh, hq
+
+
+def _hq_csv(path, site, rows, mesure="Maximum", x="-71,25", station_id=None):
+    """HQ meteo file of daily temperatures, with (date, value, quality, status) rows."""
+    header = [
+        "Installation :",
+        f"Nom;{site}",
+        *([f"Identificateur;{station_id}"] if station_id else []),
+        "Type;Météo",
+        "Ouverture;2000-01-01",
+        "Fermeture;2001-01-01",
+        f"XCOORD (degrés.décimales);{x}",
+        "YCOORD (degrés.décimales);46,5",
+        "ZCOORD (mètres);120",
+        "",
+        "Données :",
+        "Type de donnée;Température",
+        "Fuseau horaire;UTC-5",
+        "Pas de temps;Fin du pas journalier",
+        f"Type de mesure;{mesure}",
+        "Unité;°C",
+        "",
+        "Dateheure;Valeur;Qualite;Statut",
+    ]
+    lines = [f"{d} 00:00;{v};{q};{s}" for d, v, q, s in rows]
+    path.write_text("\n".join(header + lines) + "\n", encoding="latin1")
+    return path
+
+
+def _deh_txt(path, station, rows, area=1000):
+    """DEH stream flow file, with (date, flow, remark) rows."""
+    header = [
+        f"Station: {station}      Rivière Test         Régime: Naturel",
+        f"Bassin versant:  {area} km²",
+        "Coordonnées:  (NAD83) 48° 13' 43\" // -65° 56' 19\"",
+        "",
+        "Station     Date         Débit (m³/s)  Remarque",
+    ]
+    lines = [f"{station}    {d}    {q:9.3f}      {r}".rstrip() for d, q, r in rows]
+    path.write_text("\n".join(header + lines) + "\n", encoding="latin1")
+    return path
+
+
+class TestHydroQuebec:
+    def test_open_csv(self, tmp_path):
+        path = _hq_csv(
+            tmp_path.joinpath("a.csv"),
+            "SITE A",
+            [("2000-01-01", "-1,5", "1-Bonne", "0-Brute"), ("2000-01-02", "", "", "")],
+        )
+        da = hq.open_csv(path)
+        assert da.name == "tasmax"
+        np.testing.assert_allclose(da.values, [271.65, np.nan])
+        assert da.lon == -71.25
+        assert str(da.time.dt.strftime("%Y-%m-%d")[1].item()) == "2000-01-02"
+
+    def test_open_csv_files(self, tmp_path):
+        files = [
+            _hq_csv(
+                tmp_path.joinpath("a_max.csv"),
+                "SITE A",
+                [("2000-01-01", "-1,5", "1-Bonne", "0-Brute")],
+            ),
+            _hq_csv(
+                tmp_path.joinpath("b_max.csv"),
+                "SITE B",
+                [
+                    ("2000-01-02", "2", "2-Douteuse", "2-Validée"),
+                    ("2000-01-03", "3,25", "", ""),
+                ],
+                x="-72",
+            ),
+            _hq_csv(
+                tmp_path.joinpath("b_min.csv"),
+                "SITE B",
+                [("2000-01-01", "-10", "1-Bonne", "2-Validée")],
+                mesure="Minimum",
+                x="-72",
+            ),
+        ]
+        ds = hq.open_csv_files(files, processes=2)
+
+        np.testing.assert_array_equal(ds.site, ["SITE A", "SITE B"])
+        np.testing.assert_array_equal(ds.lon, [-71.25, -72])
+        assert ds.time.size == 3
+        np.testing.assert_allclose(
+            ds.tasmax, [[271.65, np.nan, np.nan], [np.nan, 275.15, 276.4]]
+        )
+        np.testing.assert_array_equal(ds.tasmax_quality, [[1, -1, -1], [-1, 2, -1]])
+        np.testing.assert_array_equal(ds.tasmax_status, [[0, -1, -1], [-1, 2, -1]])
+        np.testing.assert_allclose(ds.tasmin[:, 0], [np.nan, 263.15])
+        assert ds.tasmax.attrs["units"] == "K"
+
+        with pytest.raises(ValueError):
+            hq.open_csv_files(files + files[:1])
+
+    def test_station_identifiers(self, tmp_path):
+        files = [
+            _hq_csv(
+                tmp_path.joinpath(f"{station_id}.csv"),
+                "SITE A",
+                [("2000-01-01", "1", "1-Bonne", "Inconnu")],
+                station_id=station_id,
+            )
+            for station_id in ("7001", "7002")
+        ]
+        ds = hq.open_csv_files(files)
+
+        np.testing.assert_array_equal(ds.station_id, ["7001", "7002"])
+        np.testing.assert_array_equal(ds.site, ["SITE A", "SITE A"])
+        np.testing.assert_array_equal(ds.tasmax_quality, [[1], [1]])
+        np.testing.assert_array_equal(ds.tasmax_status, [[-1], [-1]])
+
+
+class TestDEH:
+    def test_open_txt(self, tmp_path):
+        path = _deh_txt(
+            tmp_path.joinpath("030101_Q.txt"),
+            "030101",
+            [("1970/01/01", 1.5, ""), ("1970/01/02", 2.25, "MJ")],
+        )
+        ds = deh.open_txt(path)
+        assert ds.station_id == "030101"
+        np.testing.assert_array_equal(ds.q, [1.5, 2.25])
+        assert ds.flag.values[1] == "MJ" and np.isnan(ds.flag.values[0])
+        assert ds.area == 1000
+        np.testing.assert_allclose([ds.lat, ds.lon], [48.228611, -65.938611])
+
+    def test_open_txt_files(self, tmp_path):
+        files = [
+            _deh_txt(
+                tmp_path.joinpath("030101_Q.txt"),
+                "030101",
+                [("1970/01/01", 1.5, ""), ("1970/01/02", 2.25, "MJ")],
+            ),
+            _deh_txt(
+                tmp_path.joinpath("030102_Q.txt"),
+                "030102",
+                [("1970/01/03", 3, "R")],
+                area=250,
+            ),
+        ]
+        ds = deh.open_txt_files(files, processes=2)
+
+        np.testing.assert_array_equal(ds.station_id, ["030101", "030102"])
+        np.testing.assert_array_equal(ds.area, [1000, 250])
+        assert ds.time.size == 3
+        np.testing.assert_array_equal(ds.q, [[1.5, 2.25, np.nan], [np.nan, np.nan, 3]])
+        np.testing.assert_array_equal(ds.flag, [["", "MJ", ""], ["", "", "R"]])
+        assert ds.q.attrs == deh.cmor["q"]
+
+        with pytest.raises(ValueError):
+            deh.open_txt_files(files + files[:1])
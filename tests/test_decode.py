@@ -0,0 +1,198 @@
+import os
+from pathlib import Path
+
+import netCDF4 as nc  # noqa
+import numpy as np
+import pandas as pd
+import pytest  # noqa
+import schema
+
+from miranda.decode import Decoder, FacetCache, _decoder
+
+
+def _decode_test_name(file):
+    """Facets of files named "{variable}_{source}_{member}.nc"."""
+    variable, source, member = Path(file).stem.split("_")
+    if member == "bad":
+        raise AttributeError("No member.")
+    return dict(source=source, member=member, variable=variable)
+
+
+@pytest.fixture
+def name_decoder(monkeypatch):
+    """Decode files with `_decode_test_name`, recording the files decoded."""
+    decoded = list()
+
+    def decode(file):
+        decoded.append(Path(file).name)
+        return _decode_test_name(file)
+
+    monkeypatch.setattr(
+        Decoder, "decode_test_name", staticmethod(decode), raising=False
+    )
+    monkeypatch.setattr(
+        _decoder, "FACETS_SCHEMA", schema.Schema({"member": str, str: str})
+    )
+    return decoded
+
+
+class TestDecoder:
+    @pytest.mark.parametrize("processes,backend", [(1, "process"), (3, "thread")])
+    def test_decode(self, name_decoder, processes, backend):
+        files = [f"tas_CanESM5_r{i}i1p1f1.nc" for i in range(25)] + ["tas_X_bad.nc"]
+
+        decoder = Decoder("test")
+        decoder.decode(
+            (f for f in files),
+            method="name",
+            processes=processes,
+            chunksize=4,
+            backend=backend,
+        )
+
+        facets = decoder.file_facets()
+        assert sorted(facets) == sorted(files[:-1])
+        assert facets["tas_CanESM5_r3i1p1f1.nc"]["member"] == "r3i1p1f1"
+        # Facets are kept per decoder
+        assert Decoder("test").file_facets() == dict()
+
+    @pytest.mark.parametrize(
+        "processes,backend", [(1, "process"), (2, "process"), (16, "thread")]
+    )
+    def test_decode_headers(self, tmp_path, processes, backend):
+        files = list()
+        for year in range(2000, 2200):
+            files.append(tmp_path.joinpath(f"tas_sem_ERA5_NAM_{year}.nc"))
+            with nc.Dataset(files[-1], "w") as ds:
+                ds.createDimension("time", 2)
+                ds.setncatts(
+                    dict(
+                        type="reanalysis",
+                        activity="ERA",
+                        institution="ECMWF",
+                        source="ERA5",
+                        frequency="sem",
+                        domain="NAM",
+                        format="netcdf",
+                        history="",
+                    )
+                )
+                ds.createVariable("tas", "f4", ("time",))
+
+        decoder = Decoder("reanalysis")
+        decoder.decode(files, method="data", processes=processes, backend=backend)
+
+        facets = decoder.file_facets()
+        assert sorted(facets) == files
+        assert facets[files[1]]["date"] == "2001"
+        assert facets[files[1]]["variable"] == "tas"
+        assert facets[files[1]]["timedelta"] == pd.Timedelta(7, "D")
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            Decoder("test").decode(["tas_CanESM5_r1i1p1f1.nc"], backend="mpi")
+
+
+class TestFacetCache:
+    def test_decode(self, tmp_path, name_decoder):
+        files = list()
+        for i in range(5):
+            files.append(tmp_path.joinpath(f"tas_CanESM5_r{i}i1p1f1.nc"))
+            files[-1].write_text("data")
+        cache_file = tmp_path.joinpath("cache", "facets.sqlite")
+
+        decoder = Decoder("test")
+        decoder.decode(files, method="name", processes=1, cache=cache_file)
+        assert len(name_decoder) == 5
+
+        # Unchanged files are not decoded again
+        name_decoder.clear()
+        cached = Decoder("test")
+        cached.decode(files, method="name", processes=1, cache=cache_file)
+        assert name_decoder == []
+        assert cached.file_facets() == decoder.file_facets()
+
+        # Changed files are
+        files[1].write_text("more data")
+        Decoder("test").decode(files, method="name", processes=1, cache=cache_file)
+        assert name_decoder == [files[1].name]
+
+        # An open cache can be shared by decoders
+        name_decoder.clear()
+        with FacetCache(cache_file) as cache:
+            Decoder("test").decode(files[:1], method="name", processes=1, cache=cache)
+            assert name_decoder == []
+            assert len(cache) == 5
+
+            files[0].unlink()
+            assert cache.prune() == 1
+            assert len(cache) == 4
+            assert cache.invalidate(files[1:2]) == 1
+            assert cache.invalidate() == 3
+
+    def test_json_values(self, tmp_path):
+        file = tmp_path.joinpath("tas_day_2015-2100.nc")
+        file.write_text("data")
+        signature = (file.stat().st_size, file.stat().st_mtime_ns)
+        facets = dict(
+            variable="tas",
+            timedelta=pd.Timedelta(1, "D"),
+            date_start=pd.Timestamp("2015-01-01"),
+            realization=np.int64(1),
+        )
+
+        with FacetCache(tmp_path.joinpath("facets.sqlite")) as cache:
+            cache.update(
+                [(file, signature, facets), (file, signature, dict(timedelta=pd.NaT))],
+                "a",
+            )
+            cache.update([(file, signature, dict(variable=object()))], "b")
+            rows = cache._connection.execute("SELECT facets FROM facets").fetchall()
+            assert len(rows) == 1 and isinstance(rows[0][0], str)
+
+            hits, misses = cache.lookup([file], "a")
+            assert hits[file]["timedelta"] is pd.NaT
+
+            cache.update([(file, signature, facets)], "a")
+            hits, _ = cache.lookup([file], "a")
+            assert hits[file] == dict(facets, realization=1)
+            assert isinstance(hits[file]["timedelta"], pd.Timedelta)
+
+            # Facets in an unknown format are decoded again
+            cache._connection.execute("UPDATE facets SET facets = ?", [b"\x80\x04"])
+            hits, misses = cache.lookup([file], "a")
+            assert hits == dict() and misses == {file: signature}
+
+
+class TestReadHeader:
+    @pytest.fixture
+    def nc_file(self, tmp_path):
+        file = tmp_path.joinpath("tas_day_CanESM5_ssp585_r1i1p1f1_gn_2015-2100.nc")
+        with nc.Dataset(file, "w") as ds:
+            ds.createDimension("time", 2)
+            ds.setncatts(dict(frequency="day", source_id="CanESM5"))
+            for v in ["time", "tas", "lat"]:
+                ds.createVariable(v, "f4", ("time",)).setncatts(dict(units=v))
+        return file
+
+    def test_from_dataset(self, nc_file):
+        variable, date, data = Decoder._from_dataset(nc_file)
+        assert variable == "tas"
+        assert date == "2015-2100"
+        assert data == dict(frequency="day", source_id="CanESM5")
+
+    def test_variable_attrs(self, nc_file):
+        variables, _, attrs = Decoder._read_header(nc_file, ["tas", "pr"])
+        assert variables == ["time", "tas", "lat"]
+        assert attrs == dict(tas=dict(units="tas"))
+
+    @pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="Linux only")
+    def test_closed(self, nc_file):
+        opened = len(os.listdir("/proc/self/fd"))
+        for _ in range(5):
+            Decoder._from_dataset(nc_file)
+        assert len(os.listdir("/proc/self/fd")) == opened
+
+    def test_unknown_format(self, tmp_path):
+        with pytest.raises(_decoder.DecoderError):
+            Decoder._from_dataset(tmp_path.joinpath("tas_day_2015-2100.grib"))
@@ -0,0 +1,830 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest  # noqa
+import xarray as xr
+
+from miranda.eccc import (
+    aggregate_daily_summaries,
+    aggregate_flat_files,
+    aggregate_stations,
+    convert_ahccd,
+    convert_daily_flat_files,
+    convert_hourly_flat_files,
+    extract_daily_summaries,
+    merge_converted_variables,
+    ragged_to_dense,
+)
+from miranda.eccc._flags import decode_flags, encode_flags, flag_attributes
+from miranda.eccc._flat_files import (
+    partition_records,
+    read_flat_file,
+    records_time_axis,
+)
+from miranda.eccc._homogenized import convert_ahccd_fwf_files
+from miranda.eccc._inventory import StationInventory
+from miranda.eccc._ragged import _contiguous_to_indexed
+from miranda.eccc._raw import _reduce_tmp_nc, _tmp_nc
+
+
+def _hourly_record(station, year, month, day, element, values, flags):
+    line = f"{station:>7}{year:04d}{month:02d}{day:02d}{element:03d}"
+    for value, flag in zip(values, flags):
+        line += f"{value:06d}{flag}"
+    return line
+
+
+def _daily_record(station, year, month, element, values, flags):
+    line = f"{station:>7}{year:04d}{month:02d}{element:03d}"
+    for value, flag in zip(values, flags):
+        line += f"{value:06d}{flag}"
+    return line
+
+
+def _inventory_csv(path, rows):
+    lines = [
+        '"Modified Date","2022-01-01"',
+        '"Disclaimer","test"',
+        '"Notes","test"',
+        '"Name","Climate ID","Latitude (Decimal Degrees)","Longitude (Decimal Degrees)",'
+        '"Latitude","Longitude","Elevation (m)"',
+    ]
+    for name, climate_id, lat, lon, elev in rows:
+        lines.append(f'"{name}","{climate_id}","{lat}","{lon}","0","0","{elev}"')
+    path.write_text("\n".join(lines))
+    return path
+
+
+def _daily_summary_csv(path, year, values, climate_id="7025250"):
+    lines = [
+        '"Station Name","MONTREAL"',
+        '"Province","QUEBEC"',
+        '"Latitude","45.47"',
+        '"Longitude","-73.74"',
+        '"Elevation","32.00"',
+        f'"Climate Identifier","{climate_id}"',
+        '"WMO Identifier","71627"',
+        '"TC Identifier","YUL"',
+        "",
+        '"Legend"',
+        '"E","Estimated"',
+        "",
+        '"Date/Time","Year","Month","Day","Data Quality","Max Temp (°C)","Max Temp Flag"',
+    ]
+    for day, value in enumerate(values, 1):
+        lines.append(f'"{year}-01-{day:02d}","{year}","1","{day}","","{value}","E"')
+    path.write_text("\n".join(lines), encoding="utf-8")
+    return path
+
+
+def _ahccd_temperature_file(path, months):
+    """Third generation AHCCD temperature file: 31 daily values and flags per (year, month) line."""
+    lines = ["Temperature", "Temperature", "Station"]
+    lines.append("Year  Mo " + "".join(f"{f'D{d:02d}':>7} " for d in range(1, 32)))
+    for year, month, values in months:
+        fields = "".join(
+            f"{-9999.9 if v is None else v:>7.1f}{'M' if v is None else ' '}"
+            for v in values
+        )
+        lines.append(f"{year:>5} {month:>2} {fields}")
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+
+class TestReadFlatFile:
+    def test_hourly_records(self, tmp_path):
+        values = list(range(-12, 12))
+        flags = [" "] * 23 + ["M"]
+        lines = [
+            _hourly_record("7025250", 1999, 12, 31, 78, values, flags),
+            _hourly_record("702S006", 2000, 1, 1, 80, [-9999] * 24, ["M"] * 24),
+        ]
+        f = tmp_path.joinpath("HLY01_test.txt")
+        f.write_text("\n".join(lines) + "\n")
+
+        records = read_flat_file(f, "hourly")
+
+        assert records.year.size == 2
+        np.testing.assert_array_equal(records.station, ["7025250", "702S006"])
+        np.testing.assert_array_equal(records.year, [1999, 2000])
+        np.testing.assert_array_equal(records.month, [12, 1])
+        np.testing.assert_array_equal(records.day, [31, 1])
+        np.testing.assert_array_equal(records.element, [78, 80])
+        assert records.values.dtype == np.int32
+        assert records.flags.dtype == np.uint8
+        np.testing.assert_array_equal(records.values[0], values)
+        assert (records.values[1] == -9999).all()
+        assert (records.flags[0, :23] == 0).all()
+        assert records.flags[0, 23] == ord("M")
+
+    def test_daily_records(self, tmp_path):
+        values = [10 * i for i in range(31)]
+        flags = ["T"] * 31
+        f = tmp_path.joinpath("DLY01_test.txt")
+        f.write_text(_daily_record("1012010", 1950, 2, 1, values, flags))
+
+        records = read_flat_file(f, "daily")
+
+        assert records.year.size == 1
+        assert records.day is None
+        # Still a plain tuple of the decoded fields
+        assert len(records._replace(element=records.element + 1)) == 7
+        assert records.values.shape == (1, 31)
+        np.testing.assert_array_equal(records.values[0], values)
+        assert (records.flags == ord("T")).all()
+
+    def test_irregular_lines(self, tmp_path):
+        values = list(range(24))
+        lines = [
+            _hourly_record("7025250", 2001, 6, day, 76, values, [" "] * 24).rstrip()
+            for day in range(1, 4)
+        ]
+        f = tmp_path.joinpath("HLY01_crlf.txt")
+        f.write_bytes("\r\n".join(lines).encode())
+
+        records = read_flat_file(f, "h")
+
+        np.testing.assert_array_equal(records.day, [1, 2, 3])
+        np.testing.assert_array_equal(records.values, [values] * 3)
+        assert (records.flags == 0).all()
+
+    def test_bad_time_step(self, tmp_path):
+        f = tmp_path.joinpath("HLY01_empty.txt")
+        f.write_text("")
+        assert read_flat_file(f, "hourly").year.size == 0
+        with pytest.raises(ValueError):
+            read_flat_file(f, "monthly")
+
+
+class TestPartitionRecords:
+    def test_partitions(self, tmp_path):
+        lines = [
+            _hourly_record(station, 2000, 1, day, element, [0] * 24, [" "] * 24)
+            for day in (1, 2)
+            for station, element in [("7025250", 78), ("701S001", 78), ("7025250", 76)]
+        ]
+        f = tmp_path.joinpath("HLY01_test.txt")
+        f.write_text("\n".join(lines))
+
+        records = read_flat_file(f, "hourly")
+        partitions = partition_records(records)
+
+        assert set(partitions) == {"7025250", "701S001"}
+        assert set(partitions["7025250"]) == {76, 78}
+        assert set(partitions["701S001"]) == {78}
+        np.testing.assert_array_equal(partitions["7025250"][78], [0, 3])
+        np.testing.assert_array_equal(partitions["7025250"][76], [2, 5])
+        np.testing.assert_array_equal(records.day[partitions["701S001"][78]], [1, 2])
+
+
+class TestRecordsTimeAxis:
+    def test_daily_records(self):
+        times, valid = records_time_axis(np.array([2000, 2001]), np.array([2, 2]))
+
+        assert times.shape == valid.shape == (2, 31)
+        assert valid.sum(axis=1).tolist() == [29, 28]
+        assert times[0, 0] == np.datetime64("2000-02-01")
+        assert times[valid][-1] == np.datetime64("2001-02-28")
+        assert (np.diff(times[valid]) > np.timedelta64(0)).all()
+
+    def test_hourly_records(self):
+        times, valid = records_time_axis(
+            np.array([1999, 1999, 2001]), np.array([12, 12, 2]), np.array([31, 32, 28])
+        )
+
+        assert times.shape == (3, 24)
+        assert valid.all(axis=1).tolist() == [True, False, True]
+        assert times[0, 0] == np.datetime64("1999-12-31T00")
+        assert times[0, -1] == np.datetime64("1999-12-31T23")
+        assert times[valid].size == 48
+
+
+class TestConvertFlatFiles:
+    def test_station_in_many_source_files(self, tmp_path):
+        source = tmp_path.joinpath("source")
+        source.mkdir()
+        for month in (1, 2):
+            lines = [
+                _hourly_record(
+                    "7025250", 2000, month, day, 78, [10 * month] * 24, [" "] * 24
+                )
+                for day in (1, 2)
+            ]
+            source.joinpath(f"HLY01_2000_{month:02d}.txt").write_text("\n".join(lines))
+
+        output = tmp_path.joinpath("output")
+        convert_hourly_flat_files(source, output, variables=78, processes=2)
+
+        files = sorted(output.joinpath("tas_dry", "7025250").glob("*.nc"))
+        assert [f.name for f in files] == [
+            "7025250_078_tas_dry_2000_HLY01-2000-01.nc",
+            "7025250_078_tas_dry_2000_HLY01-2000-02.nc",
+        ]
+        with xr.open_dataset(files[1]) as ds:
+            assert ds.time.size == 48
+            np.testing.assert_allclose(ds.tas_dry, 2 * 0.1 * 10 + 273.15)
+
+    def test_flag_codes(self, tmp_path):
+        source = tmp_path.joinpath("source")
+        source.mkdir()
+        source.joinpath("DLY01_2000.txt").write_text(
+            _daily_record("7025250", 2000, 1, 1, [5] * 31, ["E"] * 30 + [" "])
+        )
+
+        output = tmp_path.joinpath("output")
+        convert_daily_flat_files(source, output, variables=1, flag_codes=True)
+
+        with xr.open_dataset(next(output.rglob("*.nc"))) as ds:
+            assert ds.flag.dtype == np.uint8
+            assert (ds.flag[:30] == ord("E")).all() and ds.flag[30] == 0
+            meanings = dict(
+                zip(ds.flag.flag_values.tolist(), ds.flag.flag_meanings.split())
+            )
+            assert meanings[ord("E")] == "estimated"
+
+
+class TestConversionManifest:
+    def test_changed_sources(self, tmp_path):
+        source = tmp_path.joinpath("source")
+        source.mkdir()
+        for year in (2000, 2001):
+            source.joinpath(f"DLY01_{year}.txt").write_text(
+                _daily_record("7025250", year, 1, 1, [10] * 31, [" "] * 31)
+            )
+        output = tmp_path.joinpath("output")
+        manifest = tmp_path.joinpath("manifest.json")
+
+        convert_daily_flat_files(source, output, variables=1, manifest=manifest)
+        outputs = {f: f.stat().st_mtime_ns for f in output.rglob("*.nc")}
+        assert len(outputs) == 2
+        assert sorted(json.loads(manifest.read_text())["sources"]) == [
+            "DLY01_2000.txt",
+            "DLY01_2001.txt",
+        ]
+
+        source.joinpath("DLY01_2001.txt").write_text(
+            "\n".join(
+                _daily_record(station, 2001, 1, 1, [20] * 31, [" "] * 31)
+                for station in ("7025250", "702S006")
+            )
+        )
+        convert_daily_flat_files(source, output, variables=[1, 2], manifest=manifest)
+
+        files = sorted(output.rglob("*.nc"))
+        assert len(files) == 3
+        sources = json.loads(manifest.read_text())["sources"]
+        assert sorted(sources["DLY01_2000.txt"]) == ["001", "002"]
+        assert sources["DLY01_2000.txt"]["002"]["outputs"] == []
+        unchanged = [f for f in files if outputs.get(f) == f.stat().st_mtime_ns]
+        assert [f.name for f in unchanged] == ["7025250_001_tasmax_2000_DLY01-2000.nc"]
+
+    def test_removed_sources(self, tmp_path):
+        source = tmp_path.joinpath("source")
+        source.mkdir()
+        for year in (2000, 2001, 2002):
+            source.joinpath(f"DLY01_{year}.txt").write_text(
+                _daily_record("7025250", year, 1, 1, [10] * 31, [" "] * 31)
+            )
+        output = tmp_path.joinpath("output")
+        manifest = tmp_path.joinpath("manifest.json")
+        convert_daily_flat_files(source, output, variables=1, manifest=manifest)
+
+        # Sources left out of an explicit list of files are not pruned
+        convert_daily_flat_files(
+            [source.joinpath("DLY01_2002.txt")], output, variables=1, manifest=manifest
+        )
+        assert len(list(output.rglob("*.nc"))) == 3
+
+        source.joinpath("DLY01_2001.txt").unlink()
+        convert_daily_flat_files(source, output, variables=1, manifest=manifest)
+
+        assert sorted(f.name for f in output.rglob("*.nc")) == [
+            "7025250_001_tasmax_2000_DLY01-2000.nc",
+            "7025250_001_tasmax_2002_DLY01-2002.nc",
+        ]
+        sources = json.loads(manifest.read_text())["sources"]
+        assert "DLY01_2001.txt" not in sources and "DLY01_2000.txt" in sources
+
+        # Aggregations cannot discard the records of conversions
+        inventory = _inventory_csv(
+            tmp_path.joinpath("inventory.csv"),
+            [("MONTREAL", "7025250", 45.47, -73.74, 32)],
+        )
+        with pytest.raises(ValueError):
+            aggregate_stations(
+                output,
+                tmp_path.joinpath("aggregated"),
+                inventory,
+                time_step="d",
+                variables=1,
+                manifest=manifest,
+            )
+
+
+class TestMergeConvertedVariables:
+    def test_incremental(self, tmp_path):
+        source = tmp_path.joinpath("source")
+        source.mkdir()
+        converted = tmp_path.joinpath("converted")
+        merged = tmp_path.joinpath("merged")
+
+        for year in (2000, 2001):
+            source.joinpath(f"DLY01_{year}.txt").write_text(
+                _daily_record("7025250", year, 1, 1, [year - 1990] * 31, [" "] * 31)
+            )
+            convert_daily_flat_files(source, converted, variables=1)
+            merge_converted_variables(converted, merged, incremental=True)
+
+        files = list(merged.joinpath("tasmax").glob("*.nc"))
+        assert [f.name for f in files] == ["7025250_001_tasmax_2000-2001.nc"]
+        with xr.open_dataset(files[0]) as ds:
+            assert ds.time.size == 62
+            np.testing.assert_allclose(ds.tasmax[-31:], 11 * 0.1 + 273.15)
+
+        # Stations are merged again when a period already merged is revised
+        merged_at = files[0].stat().st_mtime_ns
+        merge_converted_variables(converted, merged, incremental=True)
+        assert files[0].stat().st_mtime_ns == merged_at
+
+        source.joinpath("DLY01_2000.txt").write_text(
+            _daily_record("7025250", 2000, 1, 1, [5] * 31, [" "] * 31)
+        )
+        convert_daily_flat_files(source, converted, variables=1)
+        merge_converted_variables(converted, merged, incremental=True)
+        with xr.open_dataset(files[0]) as ds:
+            assert ds.time.size == 62
+            np.testing.assert_allclose(ds.tasmax[:31], 5 * 0.1 + 273.15)
+            np.testing.assert_allclose(ds.tasmax[-31:], 11 * 0.1 + 273.15)
+
+    def test_overlapping_sources(self, tmp_path):
+        source = tmp_path.joinpath("source")
+        source.mkdir()
+        source.joinpath("DLY01_2000.txt").write_text(
+            _daily_record("7025250", 2000, 1, 1, [10] * 26 + [-9999] * 5, [" "] * 31)
+        )
+        source.joinpath("DLY02_2000.txt").write_text(
+            _daily_record("7025250", 2000, 1, 1, [-9999] * 5 + [20] * 26, ["E"] * 31)
+        )
+        converted = tmp_path.joinpath("converted")
+        merged = tmp_path.joinpath("merged")
+        convert_daily_flat_files(source, converted, variables=1)
+        assert len(list(converted.rglob("*.nc"))) == 2
+
+        merge_converted_variables(converted, merged)
+
+        with xr.open_dataset(next(merged.rglob("*.nc"))) as ds:
+            assert ds.time.size == 31 and ds.indexes["time"].is_monotonic_increasing
+            # Days missing from the last source file are taken from the other one
+            np.testing.assert_allclose(ds.tasmax[:5], 10 * 0.1 + 273.15)
+            np.testing.assert_allclose(ds.tasmax[5:], 20 * 0.1 + 273.15)
+            assert (ds.flag[:5] != "E").all() and (ds.flag[5:] == "E").all()
+
+
+class TestFlagCodes:
+    def test_round_trip(self):
+        flags = np.array([["E", ""], [np.nan, "M"], ["‡", "z"]], dtype=object)
+        codes = encode_flags(flags)
+
+        assert codes.dtype == np.uint8
+        assert codes.tolist() == [[ord("E"), 0], [0, ord("M")], [128, ord("z")]]
+        np.testing.assert_array_equal(
+            decode_flags(codes), [["E", ""], ["", "M"], ["‡", "z"]]
+        )
+        assert encode_flags(codes) is codes
+
+        attrs = flag_attributes(codes)
+        meanings = dict(
+            zip(attrs["flag_values"].tolist(), attrs["flag_meanings"].split())
+        )
+        assert meanings[0] == "no_flag"
+        assert meanings[ord("M")] == "missing"
+        assert meanings[ord("z")] == "undocumented_z"
+
+
+class TestAggregateFlatFiles:
+    def test_station_time_store(self, tmp_path):
+        source = tmp_path.joinpath("source")
+        source.mkdir()
+        for year in (2000, 2001):
+            lines = [
+                _daily_record(station, year, 1, 1, [year - 1990] * 31, ["E"] * 31)
+                for station in ("7025250", "702S006", "7099999")
+            ]
+            source.joinpath(f"DLY01_{year}.txt").write_text("\n".join(lines))
+
+        inventory = _inventory_csv(
+            tmp_path.joinpath("inventory.csv"),
+            [
+                ("MONTREAL", "7025250", 45.47, -73.74, 32),
+                ("MONTREAL 2", "702S006", 45.5, -73.6, 40),
+            ],
+        )
+
+        output = tmp_path.joinpath("output")
+        aggregate_flat_files(source, output, inventory, time_step="d", variables=1)
+
+        stores = list(output.iterdir())
+        assert len(stores) == 1
+        assert stores[0].name.startswith("tasmax_eccc_daily_2000-2001_created")
+        with xr.open_zarr(stores[0]) as ds:
+            assert dict(ds.dims) == dict(station=2, time=731)
+            np.testing.assert_array_equal(ds.station_id, ["7025250", "702S006"])
+            np.testing.assert_allclose(ds.lat, [45.47, 45.5])
+            assert ds.time[0] == np.datetime64("2000-01-01")
+            tasmax = ds.tasmax.sel(station=0)
+            np.testing.assert_allclose(tasmax.sel(time="2001-01"), 11 * 0.1 + 273.15)
+            assert tasmax.sel(time="2000-02").isnull().all()
+            assert (ds.flag.sel(time="2000-01") == "E").all()
+
+        output = tmp_path.joinpath("codes")
+        aggregate_flat_files(
+            source,
+            output,
+            inventory,
+            time_step="d",
+            variables=1,
+            flag_codes=True,
+            processes=2,
+        )
+        with xr.open_zarr(next(output.iterdir())) as ds:
+            assert ds.flag.dtype == np.uint8
+            assert "_FillValue" not in ds.flag.encoding
+            assert (ds.flag.sel(time="2000-01") == ord("E")).all()
+            assert (ds.flag.sel(time="2000-02") == 0).all()
+
+    def test_unsorted_source_files(self, tmp_path):
+        source = tmp_path.joinpath("source")
+        source.mkdir()
+        files = list()
+        for year in (2003, 2000, 2001):
+            lines = [
+                _daily_record(station, year, 1, 1, [year - 1990] * 31, ["E"] * 31)
+                for station in ("7025250", "702S006")
+            ]
+            files.append(source.joinpath(f"DLY01_{year}.txt"))
+            files[-1].write_text("\n".join(lines))
+        inventory = _inventory_csv(
+            tmp_path.joinpath("inventory.csv"),
+            [
+                ("MONTREAL", "7025250", 45.47, -73.74, 32),
+                ("MONTREAL 2", "702S006", 45.5, -73.6, 40),
+            ],
+        )
+
+        output = tmp_path.joinpath("output")
+        aggregate_flat_files(
+            files,
+            output,
+            inventory,
+            time_step="d",
+            variables=1,
+            output_format="netcdf",
+            chunks=dict(station=2, time=500),
+            flag_codes=True,
+        )
+
+        with xr.open_dataset(next(output.iterdir())) as ds:
+            time = pd.DatetimeIndex(ds.time.values)
+            assert time.is_monotonic_increasing and time.is_unique
+            assert time[0] == pd.Timestamp("2000-01-01")
+            assert time.size == pd.date_range("2000-01-01", "2003-12-31").size
+            for year in (2000, 2001, 2003):
+                np.testing.assert_allclose(
+                    ds.tasmax.sel(time=f"{year}-01"), (year - 1990) * 0.1 + 273.15
+                )
+            assert ds.tasmax.sel(time="2002").isnull().all()
+            assert ds.flag.dtype == np.uint8
+            assert (ds.flag.sel(time="2003-01") == ord("E")).all()
+            assert (ds.flag.sel(time="2002") == 0).all()
+
+
+class TestAggregateStations:
+    def test_period_files(self, tmp_path):
+        source = tmp_path.joinpath("source", "tasmax")
+        source.mkdir(parents=True)
+        for station, start in zip(["702S006", "7025250"], [0, 360]):
+            ds = xr.Dataset(
+                dict(tasmax=("time", np.arange(10.0) + start)),
+                coords=dict(
+                    time=np.datetime64("2000-01-01") + np.arange(start, start + 10)
+                ),
+            )
+            ds.to_netcdf(source.joinpath(f"{station}_001_tasmax_2000-2001.nc"))
+        inventory = _inventory_csv(
+            tmp_path.joinpath("inventory.csv"),
+            [
+                ("MONTREAL", "7025250", 45.47, -73.74, 32),
+                ("MONTREAL 2", "702S006", 45.5, -73.6, 40),
+            ],
+        )
+
+        output = tmp_path.joinpath("output")
+        aggregate_stations(
+            source.parent,
+            output,
+            inventory,
+            time_step="d",
+            variables=1,
+            mf_dataset_freq="YS",
+            processes=2,
+        )
+
+        paths = sorted(output.glob("*.nc"))
+        assert [p.name.split("_")[3] for p in paths] == ["2000-2000", "2001-2001"]
+        with xr.open_mfdataset(paths) as ds:
+            assert dict(ds.dims) == dict(station=2, time=731)
+            np.testing.assert_array_equal(ds.station_id, ["7025250", "702S006"])
+            np.testing.assert_array_equal(
+                ds.tasmax.sel(station=0).dropna("time"), np.arange(360.0, 370.0)
+            )
+            np.testing.assert_array_equal(
+                ds.tasmax.sel(station=1).dropna("time"), np.arange(10.0)
+            )
+
+
+class TestRaggedStations:
+    @pytest.mark.parametrize("layout", ["contiguous", "indexed"])
+    def test_round_trip(self, tmp_path, layout):
+        source = tmp_path.joinpath("source", "tasmax")
+        source.mkdir(parents=True)
+        starts = dict(zip(["702S006", "7099999", "7025250"], [0, 0, 365]))
+        for station, start in starts.items():
+            ds = xr.Dataset(
+                dict(
+                    tasmax=("time", np.arange(10.0) + start),
+                    flag=("time", np.array(["E"] * 10, dtype=object)),
+                ),
+                coords=dict(
+                    time=np.datetime64("2000-01-01") + np.arange(start, start + 10)
+                ),
+            )
+            ds.to_netcdf(source.joinpath(f"{station}_001_tasmax_2000-2001.nc"))
+        inventory = _inventory_csv(
+            tmp_path.joinpath("inventory.csv"),
+            [
+                ("MONTREAL", "7025250", 45.47, -73.74, 32),
+                ("MONTREAL 2", "702S006", 45.5, -73.6, 40),
+            ],
+        )
+
+        output = tmp_path.joinpath("output")
+        aggregate_stations(
+            source.parent, output, inventory, time_step="d", variables=1, layout=layout
+        )
+
+        with xr.open_dataset(next(output.glob("*.nc"))) as ds:
+            assert ds.attrs["featureType"] == "timeSeries"
+            assert dict(ds.dims) == dict(station=2, obs=20)
+            np.testing.assert_array_equal(ds.station_id, ["7025250", "702S006"])
+
+            dense = ragged_to_dense(ds)
+            assert dict(dense.dims) == dict(station=2, time=20)
+            np.testing.assert_array_equal(dense.lat, [45.47, 45.5])
+            assert dense.tasmax.sel(station=0).isnull().sum() == 10
+            assert (dense.flag.sel(station=1)[:10] == "E").all()
+
+            dense = ragged_to_dense(
+                ds, station_ids=["7025250"], time=slice("2000-12-31", "2001-01-05")
+            )
+            np.testing.assert_array_equal(dense.tasmax, [np.arange(365, 371)])
+
+            # Partial dates select every time step of their period, as with `.sel`
+            dense = ragged_to_dense(ds, time=slice("2001-01-03", "2001-01"))
+            np.testing.assert_array_equal(
+                dense.tasmax.sel(station=0), np.arange(368, 375)
+            )
+            assert dense.tasmax.sel(station=1).isnull().all()
+
+    def test_contiguous_to_indexed(self):
+        row_size = [3, 2, 4]
+        time = np.datetime64("2000-01-01") + np.array([0, 2, 4, 1, 2, 0, 3, 5, 6])
+        ds = xr.Dataset(
+            dict(
+                tasmax=("obs", np.arange(9.0)),
+                row_size=("station", np.array(row_size, dtype=np.int32)),
+            ),
+            coords=dict(time=("obs", time), station_id=("station", ["a", "b", "c"])),
+        ).chunk(dict(obs=4))
+
+        indexed = _contiguous_to_indexed(ds)
+        assert indexed.tasmax.chunks == ((4, 4, 1),)
+        assert "row_size" not in indexed
+        np.testing.assert_array_equal(indexed.time, time[[0, 5, 3, 1, 4, 6, 2, 7, 8]])
+        np.testing.assert_array_equal(indexed.tasmax, [0, 5, 3, 1, 4, 6, 2, 7, 8])
+        np.testing.assert_array_equal(
+            indexed.station_index, [0, 2, 1, 0, 1, 2, 0, 2, 2]
+        )
+
+
+class TestTmpNc:
+    def test_station_blocks(self, tmp_path):
+        source = tmp_path.joinpath("source")
+        source.mkdir()
+        nc = list()
+        for i in range(5):
+            ds = xr.Dataset(
+                dict(
+                    tas=("time", np.full(100, float(i))),
+                    flag=("time", np.array(["E"] * 100, dtype=object)),
+                ),
+                coords=dict(time=np.arange(100)),
+            )
+            nc.append(source.joinpath(f"70{i:05d}_tas_2000-2001.nc"))
+            ds.to_netcdf(nc[-1])
+
+        output = tmp_path.joinpath("output")
+        output.mkdir()
+        # Each station weighs 1600 bytes (800 for the values and 800 for the flags)
+        _tmp_nc(0, nc, output, memory_ceiling=2 * 2 * 1600)
+
+        parts = sorted(output.glob("*.nc"))
+        assert [f.name for f in parts] == ["000_000.nc", "000_001.nc", "000_002.nc"]
+        with xr.open_mfdataset(parts, combine="nested", concat_dim="station") as ds:
+            np.testing.assert_array_equal(
+                ds.station_id, [f"70{i:05d}" for i in range(5)]
+            )
+            np.testing.assert_array_equal(ds.tas.isel(time=0), np.arange(5))
+            assert (ds.flag == "E").all()
+
+
+class TestReduceTmpNc:
+    def test_tree_reduction(self, tmp_path):
+        for i in range(7):
+            ds = xr.Dataset(
+                dict(tas=(("station", "time"), np.full((1, 3), float(i)))),
+                coords=dict(station_id=("station", [f"70{i:05d}"])),
+            )
+            ds.to_netcdf(tmp_path.joinpath(f"{str(i).zfill(3)}.nc"))
+
+        tmp_files = _reduce_tmp_nc(tmp_path, fan_in=2)
+
+        assert len(tmp_files) == 2
+        assert sorted(tmp_path.glob("*.nc")) == sorted(tmp_files)
+        with xr.open_mfdataset(tmp_files, combine="nested", concat_dim="station") as ds:
+            np.testing.assert_array_equal(ds.tas.isel(time=0), np.arange(7))
+            assert ds.station_id.values[-1] == "7000006"
+
+
+class TestStationInventory:
+    def test_alignment(self, tmp_path):
+        inventory = StationInventory.from_csv(
+            _inventory_csv(
+                tmp_path.joinpath("inventory.csv"),
+                [
+                    ("B", "702S006", 45.5, -73.6, 40),
+                    ("A", "7025250", 45.47, -73.74, 32),
+                    ("A bis", "7025250", 0, 0, 0),
+                ],
+            )
+        )
+
+        assert len(inventory) == 2
+        assert "7025250" in inventory and "7099999" not in inventory
+        ids = ["7025250", "7099999", "702S006", "7099999"]
+        np.testing.assert_array_equal(inventory.contains(ids), [1, 0, 1, 0])
+        assert inventory.rejected(ids) == ["7099999"]
+        with pytest.raises(KeyError):
+            inventory.select(ids)
+
+        columns, rename = inventory.eccc_columns()
+        assert columns[:3] == [
+            "Latitude (Decimal Degrees)",
+            "Longitude (Decimal Degrees)",
+            "Elevation (m)",
+        ]
+        assert "Latitude" not in columns
+        ds = xr.Dataset(coords=dict(station_id=("station", ["7025250", "702S006"])))
+        ds = inventory.join(ds, columns=columns, rename=rename)
+        np.testing.assert_array_equal(ds.Name, ["A", "B"])
+        np.testing.assert_array_equal(ds.lat, [45.47, 45.5])
+        np.testing.assert_array_equal(ds["Elevation (m)"], [32, 40])
+
+    def test_cached(self, tmp_path):
+        path = _inventory_csv(
+            tmp_path.joinpath("inventory.csv"), [("A", "7025250", 45.47, -73.74, 32)]
+        )
+        assert StationInventory.from_csv(path) is StationInventory.from_csv(path)
+
+
+class TestDailySummaries:
+    @pytest.mark.parametrize("threads", [1, 2])
+    def test_read_multiple_files(self, tmp_path, threads):
+        _daily_summary_csv(tmp_path.joinpath("2001.csv"), 2001, [3.5, 4.0])
+        _daily_summary_csv(tmp_path.joinpath("2000.csv"), 2000, [1.0, 2.0, -1.5])
+
+        station = extract_daily_summaries(tmp_path, threads=threads)
+        assert station["ID"] == "7025250"
+        assert station["TC_ID"] == "YUL"
+        assert station["latitude"] == 45.47
+        data = station["data"]
+        np.testing.assert_array_equal(
+            data["Date/Time"].dt.strftime("%Y-%m-%d"),
+            ["2000-01-01", "2000-01-02", "2000-01-03", "2001-01-01", "2001-01-02"],
+        )
+        np.testing.assert_array_equal(data["Max Temp (°C)"], [1, 2, -1.5, 3.5, 4])
+
+        station = extract_daily_summaries(tmp_path, rm_flags=True, threads=threads)
+        assert "Max Temp Flag" not in station["data"]
+        assert "Data Quality" not in station["data"]
+
+    def test_aggregate_stations(self, tmp_path):
+        source = tmp_path.joinpath("source")
+        for climate_id, year, values in [
+            ("7025250", 2000, [1.0, 2.0]),
+            ("702S006", 2001, [3.5]),
+        ]:
+            source.joinpath(climate_id).mkdir(parents=True)
+            _daily_summary_csv(
+                source.joinpath(climate_id, f"{year}.csv"), year, values, climate_id
+            )
+
+        output = aggregate_daily_summaries(
+            source, tmp_path.joinpath("output"), flag_codes=True
+        )
+        with xr.open_dataset(output) as ds:
+            assert dict(ds.dims) == dict(station=2, time=367)
+            np.testing.assert_array_equal(ds.station_id, ["7025250", "702S006"])
+            np.testing.assert_array_equal(ds.lat, [45.47, 45.47])
+            np.testing.assert_allclose(
+                ds.tasmax.isel(station=0, time=[0, 1]), [274.15, 275.15]
+            )
+            np.testing.assert_allclose(ds.tasmax.isel(station=1, time=-1), 276.65)
+            assert ds.tasmax.isnull().sum() == 367 * 2 - 3
+            assert ds.pr.isnull().all()
+            assert ds.tasmax_flag.dtype == np.uint8
+            assert (ds.tasmax_flag == ord("E")).sum() == 3
+
+
+class TestConvertAhccd:
+    metadata = pd.DataFrame(
+        dict(
+            stnid=["7025250"],
+            station_name=["MONTREAL"],
+            long=[-73.74],
+            lat=[45.47],
+            elev=[32.0],
+        )
+    )
+
+    def test_daily_axis(self, tmp_path):
+        january = [float(d) for d in range(1, 32)]
+        february = [-float(d) for d in range(1, 29)] + [None] * 3
+        february[1] = None
+        path = _ahccd_temperature_file(
+            tmp_path.joinpath("dx7025250.txt"),
+            [(2001, 1, january), (2001, 2, february)],
+        )
+
+        ds = convert_ahccd_fwf_files(path, self.metadata, "tasmax", 3)
+        assert ds.time.size == 59
+        assert str(ds.time[-1].dt.strftime("%Y-%m-%d").item()) == "2001-02-28"
+        np.testing.assert_array_equal(ds.tasmax[:31], january)
+        assert np.isnan(ds.tasmax[32])
+        assert ds.tasmax[58] == -28
+        assert ds.tasmax_flag.isnull()[32]
+
+    def test_unsorted_months(self, tmp_path):
+        january = [float(d) for d in range(1, 32)]
+        february = [-float(d) for d in range(1, 29)] + [None] * 3
+        path = _ahccd_temperature_file(
+            tmp_path.joinpath("dx7025250.txt"),
+            [(2001, 2, february), (2001, 1, january), (2001, 13, [None] * 31)],
+        )
+
+        ds = convert_ahccd_fwf_files(path, self.metadata, "tasmax", 3)
+        assert ds.time.size == 59
+        assert str(ds.time[0].dt.strftime("%Y-%m-%d").item()) == "2001-01-01"
+        np.testing.assert_array_equal(ds.tasmax[:31], january)
+        np.testing.assert_array_equal(ds.tasmax[31:], february[:28])
+
+    def test_unknown_days(self, tmp_path):
+        february = [1.0] * 30 + [None]
+        path = _ahccd_temperature_file(
+            tmp_path.joinpath("dx7025250.txt"), [(2001, 2, february)]
+        )
+        with pytest.raises(RuntimeError):
+            convert_ahccd_fwf_files(path, self.metadata, "tasmax", 3)
+
+    @pytest.mark.parametrize("write_stations", [False, True])
+    def test_merge_stations(self, tmp_path, write_stations):
+        source = tmp_path.joinpath("source")
+        source.mkdir()
+        for stnid, value in [("1100031", 1.0), ("1100120", 2.0), ("0000000", 3.0)]:
+            _ahccd_temperature_file(
+                source.joinpath(f"dx{stnid}.txt"),
+                [(2001, 2, [value] * 28 + [None] * 3)],
+            )
+
+        convert_ahccd(source, tmp_path, "tasmax", 3, write_stations=write_stations)
+        with xr.open_dataset(
+            tmp_path.joinpath("merged_stations", "ahccd_gen3_tasmax.nc")
+        ) as ds:
+            np.testing.assert_array_equal(ds.stnid, ["1100031", "1100120"])
+            np.testing.assert_array_equal(ds.tasmax.isel(time=0), [1, 2])
+            assert ds.time.size == 28
+        station_files = sorted(f.name for f in tmp_path.joinpath("tasmax").glob("*.nc"))
+        if write_stations:
+            assert station_files == ["dx1100031.nc", "dx1100120.nc"]
+        else:
+            assert station_files == []
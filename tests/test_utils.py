@@ -2,10 +2,11 @@ import os
 from datetime import date
 from pathlib import Path
 
+import numpy as np
 import pytest  # noqa
 
 import miranda.eccc._utils as eccc_utils  # noqa
-from miranda import utils
+from miranda import units, utils
 
 
 class TestWorkingDirectory:
@@ -19,6 +20,28 @@ class TestWorkingDirectory:
         assert Path.cwd() == present_directory
 
 
+class TestConvertUnits:
+    def test_offset(self):
+        values = np.array([-40.0, 0, 25.5])
+        converted = units.convert_units(values, "celsius", "K")
+        assert converted is values
+        np.testing.assert_allclose(converted, [233.15, 273.15, 298.65])
+        np.testing.assert_allclose(
+            units.convert_units([-40, 100], "degC", "degF"), [-40, 212]
+        )
+
+    def test_context(self):
+        assert units.convert_units(86400, "mm/day", "kg m-2 s-1") == pytest.approx(1)
+        assert units.convert_units(1, "mm/day", "mm/day") == 1
+
+    def test_cached(self):
+        units.conversion_factors.cache_clear()
+        for _ in range(3):
+            units.convert_units(np.ones(3), "km²", "m²")
+        assert units.conversion_factors.cache_info().hits == 2
+        assert units.conversion_factors("km²", "m²") == (1e6, 0)
+
+
 class TestEnvCanVariables:
     def test_hourly_cf_dictionaries(self):
         keys = [76, 77, 78, 80, 123, 262]